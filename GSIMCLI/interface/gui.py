@@ -432,7 +432,7 @@ class GsimcliMainWindow(QtGui.QMainWindow):
         elif "STATUS: realization" in text:
             info_object = self.SI_labelStatusSim
             self.count_status[3] += 1
-            self.current_sim += self.SO_spinCores.value()
+            self.current_sim += 1
 
         else:
             info_object = None
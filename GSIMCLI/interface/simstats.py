@@ -6,6 +6,7 @@ Created on 05/03/2015
 """
 from PySide import QtGui, QtCore
 import glob2
+import multiprocessing as mp
 import os
 import sys
 import warnings
@@ -194,19 +195,16 @@ class SimStats(QtGui.QWidget):
         # calculate stats
         kwargs = self.fetch_stats()
         if self.full_grid:
-            self.results = self.grids.stats(**kwargs)
+            self.results = self.grids.stats(cores=mp.cpu_count(), **kwargs)
         else:
-            kwargs['tol'] = self.spinRadius.value()
-            save = False
-            kwargs['save'] = save
-            self.results = {}
+            tol = self.spinRadius.value()
+            # read only the lines needed for every station, at once
+            self.grids.index()
             stations_ids, x, y = self.selected_stations
-            for i, stid in stations_ids.iteritems():
-                print "processing: ", stid
-                loc = (x[i], y[i])
-                kwargs['loc'] = loc
-                self.results[stid] = self.grids.stats_area(**kwargs)
-                self.grids.reset_read()
+            locs = [(x[i], y[i], tol) for i in stations_ids.index]
+            print "processing: ", ", ".join(map(str, stations_ids))
+            results = self.grids.stats_locations(locs, **kwargs)
+            self.results = dict(zip(stations_ids, results))
         self.save_results()
         print 'done'
 
@@ -14,17 +14,24 @@ Created on 04/10/2013
 @author: julio
 """
 
+import Queue
+import collections
 import copy
 import datetime
+import hashlib
+import math
 import ntpath
 import os
 import shutil
 import sys
+import threading
 import time
 
 import multiprocessing as mp
+import numpy as np
 import parsers.dss as pdss
 import subprocess as sp
+import tools.simulation as sim
 import tools.utils as ut
 
 
@@ -50,6 +57,9 @@ class DssEnvironment(object):
         Instance of DssParam containing the actual DSS parameters.
     par_path : string
         Parameters file path.
+    seed0 : int
+        Seed in the parameters file. The seed of each realization is this one
+        plus twice its number.
     pardir : string
         Parameters directory path.
     parfile : string
@@ -66,9 +76,12 @@ class DssEnvironment(object):
         Number of the next realization.
     tempdir : string
         Temporary directory path.
+    workspaces : DssWorkspaces object
+        Long-lived directories shared with other environments, if any.
 
     """
-    def __init__(self, dss_path, par_path, output='dssim.out', simnum=0):
+    def __init__(self, dss_path, par_path, output='dssim.out', simnum=0,
+                 workspaces=None):
         """Constructor to initialise a DSS environment.
 
         A new directory named *temp* will be created in the same directory as
@@ -84,6 +97,10 @@ class DssEnvironment(object):
             Simulation output file full (NT) path.
         simnum : int, default 0
             Number of the next realization.
+        workspaces : DssWorkspaces object, optional
+            Use the directories of the given workspaces, which must be in the
+            same directory as the parameters file, when a slot is given to
+            `new`. They are not removed by `purge`.
 
         """
         if isinstance(par_path, pdss.DssParam):
@@ -94,23 +111,36 @@ class DssEnvironment(object):
             self.par = pdss.DssParam()
             self.par.load_old(par_path)  # TODO: old
 
+        self.seed0 = self.par.seed
         self.envs = list()
         self.dss_path = dss_path
         self.exedir, self.exefile = os.path.split(dss_path)
-        self.pardir, self.parfile = os.path.split(self.par_path)
+        self.pardir, self.parfile = os.path.split(
+            os.path.abspath(self.par_path))
         self.outputdir, self.outputfile = ntpath.split(output)
         self.simnum = simnum
+        self.workspaces = workspaces
+        self._template = None
 
         self.tempdir = os.path.join(self.pardir, 'temp')
+        if workspaces is not None and workspaces.tempdir != self.tempdir:
+            raise ValueError("the workspaces must be in the directory of the "
+                             "parameters file: {0}".format(self.pardir))
         if not os.path.isdir(self.tempdir):
             os.mkdir(self.tempdir)
         self.update_paths()
 
-    def new(self):
+    def new(self, slot=None):
         """Create a new directory, within the environment's temporary
         directory, and copy both binary and parameters files into it. Update
         the output and seed parameters.
 
+        Parameters
+        ----------
+        slot : int, optional
+            Reuse the directory of the given slot (counting from 0), instead of
+            creating a new one. Only one DSS run may use a slot at a time.
+
         Returns
         -------
         new_exe : string
@@ -119,15 +149,19 @@ class DssEnvironment(object):
             Parameters file path.
 
         """
-        os.chdir(self.tempdir)
-        new_dir = os.path.join(self.tempdir, str(len(self.envs) + 1))
-        if not os.path.isdir(new_dir):
-            os.mkdir(new_dir)
-
-        new_exe = os.path.join(new_dir, self.exefile)
-        new_par = os.path.join(new_dir, 'DSSim.PAR')  # TODO: old
-        if not os.path.isfile(new_exe):
-            shutil.copyfile(self.dss_path, new_exe)
+        if self.workspaces is not None and slot is not None:
+            new_dir, new_exe, new_par = self.workspaces.slot(slot)
+        else:
+            if slot is None:
+                slot = len(self.envs)
+            new_dir = os.path.join(self.tempdir, str(slot + 1))
+            if not os.path.isdir(new_dir):
+                os.mkdir(new_dir)
+
+            new_exe = os.path.join(new_dir, self.exefile)
+            new_par = os.path.join(new_dir, 'DSSim.PAR')  # TODO: old
+            if not os.path.isfile(new_exe):
+                shutil.copyfile(self.dss_path, new_exe)
         self.envs.append([new_dir, new_exe, new_par])
 
         # update path parameters and seed:
@@ -146,18 +180,48 @@ class DssEnvironment(object):
 
         keywords = ['output', 'seed']
         values = [ntpath.join(outdir, outfile),
-                  self.par.seed + 2 * self.simnum]
+                  self.seed0 + 2 * self.simnum]
         self.par.update(keywords, values)
-        self.par.save_old(new_par)
+        self.write_par(new_par)
         self.simnum += 1
 
         return new_exe, new_par
 
+    def write_par(self, par_path):
+        """Write the parameters file of a realization. Only the output and seed
+        lines change between realizations, so the other lines are formatted
+        only once.
+
+        Parameters
+        ----------
+        par_path : string
+            Parameters file path.
+
+        """
+        output, seed = self.par.output, self.par.seed
+        if self._template is None:
+            marker = '<{0}>'
+            self.par.update(['output', 'seed'],
+                            [marker.format('output'), marker.format('seed')])
+            self.par.save_old(par_path)  # TODO: old
+            self.par.update(['output', 'seed'], [output, seed])
+            self.reset_par_path()
+            with open(par_path, 'r') as fid:
+                lines = fid.readlines()
+            self._template = (lines,
+                              lines.index(marker.format('output') + '\n'),
+                              lines.index(marker.format('seed') + '\n'))
+
+        lines, output_line, seed_line = self._template
+        lines[output_line] = output + '\n'
+        lines[seed_line] = str(seed) + '\n'
+        with open(par_path, 'w') as fid:
+            fid.writelines(lines)
+
     def purge(self):
         """Remove all files and directories created for the environment.
 
         """
-        os.chdir(os.path.dirname(self.par_path))
         # workaround for delay issue on NT systems
         time.sleep(1)
         shutil.rmtree(self.tempdir)
@@ -244,47 +308,18 @@ def exec_ssdir(dss_path, par_path, dbg=None, print_status=False):
     if print_status:
         print "Computing: {0}".format(mp.current_process().name)
 
-    if os.name == 'posix':
-        env = 'wine '
-    else:
-        env = str()
-    command = (env + os.path.basename(dss_path) + ' ' +
-               os.path.basename(par_path))
+    command = dss_command(dss_path, par_path)
     wd = os.path.dirname(dss_path)
-    process = sp.Popen(command, shell=True, stdout=sp.PIPE, stderr=sp.STDOUT,
-                       cwd=wd)
-
-    # sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+    process = sp.Popen(command, stdout=sp.PIPE, stderr=sp.STDOUT, cwd=wd)
+    log = DebugLog(dbg)
 
-    if dbg:
-        dbgtest = open(dbg, 'ab')
-
-    while True:
-        nextline = process.stdout.readline()
+    for nextline in iter(process.stdout.readline, ''):
         if print_status:
-            if 'realization number' in nextline:
-                print nextline.strip()
-                # sys.stdout.write(nextline)
-                # sys.stdout.flush()
-            # if 'progress' in nextline:
-                # print 'Progress: {0}'.format(nextline.split()[-1])
-                # sys.stdout.write(nextline)
-                # sys.stdout.flush()
-            if 'error' in nextline.lower():
-                print nextline
-                # sys.stdout.write(nextline)
-                # sys.stdout.flush()
-            if 'elapsed time' in nextline.lower():
-                print ' '.join(nextline.split()[:4])
-
-        if not nextline and process.poll() is not None:
-            break
-        # sys.stdout.write(nextline)
-        # sys.stdout.flush()
-        if dbg:
-            dbgtest.write(str(datetime.datetime.now()) + '  ')
-            dbgtest.write(nextline)
-            dbgtest.flush()
+            message = parse_status(nextline)[1]
+            if message:
+                print message
+        log.write(nextline)
+    log.close()
 
     output = process.communicate()[0]
     exitCode = process.returncode
@@ -295,9 +330,119 @@ def exec_ssdir(dss_path, par_path, dbg=None, print_status=False):
         raise SystemError(command, exitCode, output)
 
 
+def dss_command(dss_path, par_path):
+    """Command line to run DSS from the binary file directory, through Wine on
+    POSIX systems.
+
+    Parameters
+    ----------
+    dss_path : string
+        Binary file full path.
+    par_path : string
+        Parameters file full path.
+
+    Returns
+    -------
+    list of string
+
+    """
+    command = [os.path.basename(dss_path), os.path.basename(par_path)]
+    if os.name == 'posix':
+        command.insert(0, 'wine')
+    return command
+
+
+def parse_status(line):
+    """Parse one line of the DSS console output.
+
+    Parameters
+    ----------
+    line : string
+        Output line.
+
+    Returns
+    -------
+    progress : float or None
+        Progress of the realization, in percentage, if the line reports it.
+    message : string or None
+        Message to print with the execution status: realization number,
+        elapsed time or error.
+
+    """
+    lower = line.lower()
+    progress = None
+    message = None
+    if 'progress' in lower:
+        try:
+            progress = float(line.split()[-1].rstrip('%'))
+        except (IndexError, ValueError):
+            pass
+    if 'realization number' in lower:
+        message = line.strip()
+    elif 'elapsed time' in lower:
+        message = ' '.join(line.split()[:4])
+    elif 'error' in lower:
+        message = line.strip()
+    return progress, message
+
+
+class DebugLog(object):
+    """Write the DSS console output to a debug file, in batches of lines,
+    each one with the time it was received.
+
+    Attributes
+    ----------
+    path : string or None
+        Debug output file path. If None, nothing is written.
+    lines : int
+        Number of lines kept before writing them.
+
+    """
+    def __init__(self, path=None, lines=200):
+        """Constructor to initialise a debug log.
+
+        Parameters
+        ----------
+        path : string, optional
+            Debug output file path. If None, nothing is written.
+        lines : int, default 200
+            Number of lines kept before writing them.
+
+        """
+        self.path = path
+        self.lines = lines
+        self._buffer = list()
+
+    def write(self, line, prefix=''):
+        """Keep one line, and write the kept ones if there are enough.
+
+        """
+        if not self.path:
+            return
+        self._buffer.append('{0}  {1}{2}'.format(datetime.datetime.now(),
+                                                 prefix, line))
+        if len(self._buffer) >= self.lines:
+            self.flush()
+
+    def flush(self):
+        """Write the kept lines.
+
+        """
+        if self.path and self._buffer:
+            with open(self.path, 'ab') as fid:
+                fid.writelines(self._buffer)
+            self._buffer = list()
+
+    def close(self):
+        """Write the remaining lines.
+
+        """
+        self.flush()
+
+
 def mp_exec(dss_path, par_path, output, simnum, totalsim=None, dbg=None,
             print_dss_status=False, cores=None, print_mp_status=False,
-            purge=False):
+            purge=False, callback=None):
     """Launch multiple threads of DSS at the same time, running at different
     cores.
 
@@ -324,6 +469,9 @@ def mp_exec(dss_path, par_path, output, simnum, totalsim=None, dbg=None,
         Print threads execution status.
     purge : boolean, default False
         Remove all temporary files and directories created.
+    callback : function, optional
+        Function called with the number of each realization as soon as it is
+        successfully finished, while the others are still running.
 
     """
     if not cores:
@@ -332,26 +480,703 @@ def mp_exec(dss_path, par_path, output, simnum, totalsim=None, dbg=None,
         print 'Running {0} in {1} cores'.format(os.path.basename(dss_path),
                                                 cores)
 
-    runs = list()
     dssenv = DssEnvironment(dss_path, par_path, output, simnum)
-
-    for run in xrange(cores):
-        if totalsim and simnum + run > totalsim:
-            break
-        dss_run, par_run = dssenv.new()
-        run_exe = mp.Process(target=exec_ssdir, args=(dss_run, par_run,
-                                                      dbg, print_dss_status))
-        runs.append(run_exe)
-        run_exe.start()
-
-    for run in runs:
-        run.join()
+    nruns = cores
+    if totalsim:
+        nruns = max(0, min(cores, totalsim - simnum + 1))
+    scheduler = DssScheduler(cores, dbg, print_dss_status)
+    scheduler.submit(dssenv, nruns, callback)
+    scheduler.run()
 
     dssenv.reset_par_path()
     if purge:
         dssenv.purge()
 
 
+class DssWorkspaces(object):
+    """Long-lived working directories to run DSS, one per core, each with its
+    own copy of the binary file.
+
+    The directories are created once and may be reused by every
+    DssEnvironment of a run (e.g., one for each candidate station), which only
+    rewrite the parameters file. They are removed at the end of the run, with
+    `purge`.
+
+    Attributes
+    ----------
+    dss_path : string
+        Binary file path.
+    tempdir : string
+        Directory with the workspaces.
+    slots : list
+        Directory, binary and parameters file paths of each workspace.
+
+    """
+    def __init__(self, dss_path, basedir, cores=None):
+        """Constructor to initialise the workspaces.
+
+        Parameters
+        ----------
+        dss_path : string
+            Binary file full path.
+        basedir : string
+            Directory of the parameters files. The workspaces are created in
+            its *temp* directory.
+        cores : int, optional
+            Number of workspaces. If None, one for each available core.
+
+        """
+        self.dss_path = dss_path
+        self.tempdir = os.path.join(os.path.abspath(basedir), 'temp')
+        if not os.path.isdir(self.tempdir):
+            os.mkdir(self.tempdir)
+        self.slots = list()
+        for i in xrange(cores or mp.cpu_count()):
+            self.slot(i)
+
+    def slot(self, i):
+        """Directory, binary and parameters file paths of a workspace. It is
+        created if it does not exist yet.
+
+        """
+        while len(self.slots) <= i:
+            new_dir = os.path.join(self.tempdir, str(len(self.slots) + 1))
+            if not os.path.isdir(new_dir):
+                os.mkdir(new_dir)
+            new_exe = os.path.join(new_dir, os.path.basename(self.dss_path))
+            if not os.path.isfile(new_exe):
+                shutil.copyfile(self.dss_path, new_exe)
+            self.slots.append([new_dir, new_exe,
+                               os.path.join(new_dir, 'DSSim.PAR')])
+        return self.slots[i]
+
+    def purge(self):
+        """Remove all the workspaces.
+
+        """
+        # workaround for delay issue on NT systems
+        time.sleep(1)
+        shutil.rmtree(self.tempdir)
+        self.slots = list()
+
+
+class SimulationFailed(SystemError):
+    """Some realizations failed, even after being run again.
+
+    Attributes
+    ----------
+    simnums : list of int
+        Numbers of the failed realizations.
+
+    """
+    def __init__(self, simnums):
+        self.simnums = sorted(simnums)
+        SystemError.__init__(self, 'DSS failed in the realizations {0}'.
+                             format(', '.join(map(str, self.simnums))))
+
+
+class DssScheduler(object):
+    """Run a queue of DSS realizations, keeping every core busy until the
+    queue is empty.
+
+    Unlike `mp_exec`, which waits for a whole batch of realizations before
+    launching the next one, a new realization is started as soon as any other
+    one is finished. Realizations of different DSS environments (e.g., of
+    independent candidate stations) may share the same queue.
+
+    Every DSS process is supervised from the calling process: their console
+    output is read by one thread each and handled in `run`, which parses the
+    progress of each realization, writes the debug output in batches, and
+    stops the realizations which take longer than `timeout`, running them
+    again up to `retries` times.
+
+    Attributes
+    ----------
+    cores : int
+        Maximum number of realizations running at the same time.
+    dbg : string
+        Debug output file path. Write DSS console output to a file.
+    print_status : boolean
+        Print DSS execution status.
+    timeout : float or None
+        Maximum duration of one realization, in seconds.
+    retries : int
+        Number of times a realization which timed out or failed is run again.
+    queue : collections.deque
+        Realizations waiting to be started, as (DssEnvironment, callback).
+    running : dict
+        Running processes, with the slot, environment, realization number,
+        callback, start time, attempt and progress of each one.
+    timings : list of dict
+        Slot, output file, realization number, start time, elapsed time, exit
+        code and number of attempts of each finished realization. The exit
+        code is None if it timed out.
+
+    """
+    def __init__(self, cores=None, dbg=None, print_status=False,
+                 timeout=None, retries=1):
+        """Constructor to initialise a DSS scheduler.
+
+        Parameters
+        ----------
+        cores : int, optional
+            Maximum number of cores to be used. If None, it will use all
+            available cores.
+        dbg : string, optional
+            Debug output file path. Write DSS console output to a file.
+        print_status : boolean, default False
+            Print DSS execution status.
+        timeout : float, optional
+            Maximum duration of one realization, in seconds. By default, there
+            is no limit.
+        retries : int, default 1
+            Number of times a realization which timed out or failed is run
+            again.
+
+        """
+        self.cores = cores or mp.cpu_count()
+        self.dbg = dbg
+        self.print_status = print_status
+        self.timeout = timeout
+        self.retries = retries
+        self.queue = collections.deque()
+        self.running = dict()
+        self.timings = list()
+        self._submitted = 0
+        self._lines = Queue.Queue()
+        self._log = DebugLog(dbg)
+
+    def submit(self, dssenv, nsim, callback=None):
+        """Add realizations of a DSS environment to the queue.
+
+        Parameters
+        ----------
+        dssenv : DssEnvironment object
+            Environment of the realizations, starting at its `simnum`.
+        nsim : int
+            Number of realizations.
+        callback : function, optional
+            Function called with the number of each realization as soon as it
+            is successfully finished, while the others are still running.
+
+        """
+        for i in xrange(nsim):
+            self.queue.append((dssenv, callback))
+        self._submitted += nsim
+
+    def run(self, abort=None, interval=0.1):
+        """Run every queued realization.
+
+        Parameters
+        ----------
+        abort : function, optional
+            Function checked before starting each realization. If it returns
+            True, the running realizations are terminated.
+        interval : float, default 0.1
+            Maximum seconds between checks for finished realizations.
+
+        Returns
+        -------
+        timings : list of dict
+            Timings of every realization run by the scheduler so far.
+
+        Raises
+        ------
+        SimulationFailed
+            Some realizations timed out or failed as many times as they were
+            run (`retries` + 1), so the set is incomplete. It is raised once
+            every other realization is finished, or aborted.
+        SystemError
+            The run was aborted.
+
+        """
+        start = time.time()
+        nruns = len(self.timings)
+        try:
+            while self.queue or self.running:
+                if abort is not None and abort():
+                    self.terminate()
+                    self._check(nruns)
+                    raise SystemError("process aborted")
+                busy = set(job['slot'] for job in self.running.itervalues())
+                free = [slot for slot in xrange(self.cores)
+                        if slot not in busy]
+                while self.queue and free:
+                    self._start(free.pop(0), *self.queue.popleft())
+                self._read(interval)
+                self._poll()
+        finally:
+            self._log.flush()
+
+        if self.print_status and len(self.timings) > nruns:
+            wall = time.time() - start
+            busy = sum(job['elapsed'] for job in self.timings[nruns:])
+            print ('{0} realizations in {1:.1f} s, cores busy {2:.0%}'.
+                   format(len(self.timings) - nruns, wall,
+                          busy / (wall * self.cores)))
+        self._check(nruns)
+        return self.timings
+
+    def _check(self, nruns):
+        """Raise SimulationFailed if any realization run since `nruns`
+        timings did not succeed.
+
+        """
+        failed = [job['simnum'] for job in self.timings[nruns:]
+                  if job['exitcode'] != 0]
+        if failed:
+            raise SimulationFailed(failed)
+
+    def progress(self):
+        """Aggregate progress of the submitted realizations.
+
+        Returns
+        -------
+        dict
+            Number of queued, running, finished and failed realizations, and
+            the fraction of the work done, which includes the progress
+            reported by the running ones.
+
+        """
+        finished = sum(1 for job in self.timings if job['exitcode'] == 0)
+        failed = len(self.timings) - finished
+        partial = sum(job['progress'] / 100.0
+                      for job in self.running.itervalues())
+        total = self._submitted or 1
+        return {'queued': len(self.queue), 'running': len(self.running),
+                'finished': finished, 'failed': failed,
+                'done': (len(self.timings) + partial) / total}
+
+    def terminate(self):
+        """Stop the running realizations and empty the queue.
+
+        """
+        for process in self.running:
+            _kill(process)
+        self.running.clear()
+        self.queue.clear()
+        self._log.flush()
+
+    def _start(self, slot, dssenv, callback):
+        """Launch the next realization of an environment in a given slot.
+
+        """
+        simnum = dssenv.simnum
+        dss_run, par_run = dssenv.new(slot)
+        self._launch({'slot': slot, 'dssenv': dssenv, 'simnum': simnum,
+                      'callback': callback, 'exe': dss_run, 'par': par_run,
+                      'attempt': 1, 'first': time.time()})
+
+    def _launch(self, job):
+        """Start the process of a realization, and the thread which reads its
+        output.
+
+        """
+        process = sp.Popen(dss_command(job['exe'], job['par']),
+                           stdout=sp.PIPE, stderr=sp.STDOUT,
+                           cwd=os.path.dirname(job['exe']))
+        reader = threading.Thread(target=_read_output,
+                                  args=(process, self._lines))
+        reader.daemon = True
+        reader.start()
+        job.update(start=time.time(), progress=0.0, reader=reader)
+        self.running[process] = job
+
+    def _read(self, interval):
+        """Handle the output lines of the running realizations, waiting for
+        them at most `interval` seconds.
+
+        """
+        timeout = interval
+        while True:
+            try:
+                process, line = self._lines.get(timeout=timeout)
+            except Queue.Empty:
+                return
+            # after the first line, only take those already received
+            timeout = 0.001
+            job = self.running.get(process)
+            if job is None or line is None:
+                continue
+            progress, message = parse_status(line)
+            if progress is not None:
+                job['progress'] = progress
+            if message and self.print_status:
+                print '[{0}] {1}'.format(job['slot'] + 1, message)
+            self._log.write(line, '[{0}] '.format(job['slot'] + 1))
+
+    def _poll(self):
+        """Collect the finished realizations, and stop those which timed out.
+        Return True if there was any.
+
+        """
+        now = time.time()
+        collected = False
+        for process, job in self.running.items():
+            timed_out = (self.timeout is not None and
+                         now - job['start'] > self.timeout)
+            if timed_out:
+                _kill(process)
+                exitcode = None
+            elif process.poll() is None or job['reader'].is_alive():
+                continue
+            else:
+                exitcode = process.returncode
+            del self.running[process]
+            collected = True
+            if exitcode != 0 and job['attempt'] <= self.retries:
+                if self.print_status:
+                    print ('Realization {0} {1}, running it again'.
+                           format(job['simnum'], 'timed out' if timed_out
+                                  else 'failed'))
+                job['attempt'] += 1
+                self._launch(job)
+                continue
+            self.timings.append({'slot': job['slot'],
+                                 'output': job['dssenv'].outputfile,
+                                 'simnum': job['simnum'],
+                                 'start': job['first'],
+                                 'elapsed': now - job['first'],
+                                 'exitcode': exitcode,
+                                 'attempts': job['attempt']})
+            if exitcode == 0 and job['callback'] is not None:
+                job['callback'](job['simnum'])
+        return collected
+
+
+def _read_output(process, lines):
+    """Put every output line of a process in a queue, then None.
+
+    """
+    for line in iter(process.stdout.readline, ''):
+        lines.put((process, line))
+    process.stdout.close()
+    lines.put((process, None))
+
+
+def _kill(process):
+    """Stop a process, if it is still running.
+
+    """
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+    process.wait()
+
+
+class SimulationBackend(object):
+    """Interface of the programs which generate the realizations for gsimcli.
+
+    Each realization is handed over through a callback, as soon as it is
+    finished, either as a file written to the output path in the parameters
+    or as an array with the values of every node (`in_memory`).
+
+    Attributes
+    ----------
+    in_memory : boolean
+        The realizations are given as arrays, instead of files.
+    version : string
+        Identification of the program which generates the realizations, so
+        that cached realizations are not mistaken for those of another
+        program (see `simulation_key`).
+
+    """
+    in_memory = False
+
+    @property
+    def version(self):
+        """Name of the backend.
+
+        """
+        return type(self).__name__
+
+    def simulate(self, par, data, nsim, callback=None, abort=None):
+        """Generate a set of realizations.
+
+        Parameters
+        ----------
+        par : DssParam object
+            DSS parameters, with the path to the parameters file in the output
+            directory and the output path (NT path relative to the binary
+            file directory).
+        data : PointSet
+            Conditioning data, also saved in `par.datapath`.
+        nsim : int
+            Number of realizations.
+        callback : function, optional
+            Function called with the number of each finished realization and
+            its values (None if it was written to a file).
+        abort : function, optional
+            Function checked before starting each realization. If it returns
+            True, the simulation is stopped.
+
+        Raises
+        ------
+        SimulationFailed
+            Some realizations failed.
+        SystemError
+            The simulation was aborted.
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources kept between simulations.
+
+        """
+        pass
+
+
+class DssBinary(SimulationBackend):
+    """Run the DSS binary file, one realization per core, in workspaces shared
+    by every simulation until `close`.
+
+    Attributes
+    ----------
+    dss_path : string
+        Binary file path.
+    cores : int
+        Number of cores.
+    dbg : string
+        Debug output file path.
+    print_status : boolean
+        Print DSS execution status.
+    timeout : float or None
+        Maximum duration of one realization, in seconds.
+    retries : int
+        Number of times a realization which timed out or failed is run again.
+    workspaces : DssWorkspaces object
+        Workspaces created in the directory of the first parameters file.
+    scheduler : DssScheduler object
+        Scheduler of the realizations.
+
+    """
+    def __init__(self, dss_path, cores=None, dbg=None, print_status=False,
+                 timeout=None, retries=1):
+        """Constructor to initialise the DSS binary backend.
+
+        Parameters
+        ----------
+        dss_path : string
+            Binary file full path.
+        cores : int, optional
+            Maximum number of cores to be used. If None, it will use all
+            available cores.
+        dbg : string, optional
+            Debug output file path. Write DSS console output to a file.
+        print_status : boolean, default False
+            Print DSS execution status.
+        timeout : float, optional
+            Maximum duration of one realization, in seconds. By default, there
+            is no limit.
+        retries : int, default 1
+            Number of times a realization which timed out or failed is run
+            again.
+
+        """
+        self.dss_path = dss_path
+        self.cores = cores or mp.cpu_count()
+        self.dbg = dbg
+        self.print_status = print_status
+        self.timeout = timeout
+        self.retries = retries
+        self.workspaces = None
+        self.scheduler = DssScheduler(self.cores, dbg, print_status, timeout,
+                                      retries)
+        self._version = None
+
+    @property
+    def version(self):
+        """Name of the backend and hash of the binary file contents.
+
+        """
+        if self._version is None:
+            digest = hashlib.sha1()
+            with open(self.dss_path, 'rb') as fid:
+                for chunk in iter(lambda: fid.read(2 ** 20), ''):
+                    digest.update(chunk)
+            self._version = 'DssBinary ' + digest.hexdigest()
+        return self._version
+
+    def simulate(self, par, data, nsim, callback=None, abort=None):
+        """Generate a set of realizations with DSS. See
+        `SimulationBackend.simulate`.
+
+        """
+        if self.workspaces is None:
+            self.workspaces = DssWorkspaces(self.dss_path,
+                                            os.path.dirname(par.path),
+                                            self.cores)
+        dssenv = DssEnvironment(self.dss_path, par, par.output, 1,
+                                self.workspaces)
+        if callback is None:
+            done = None
+        else:
+            def done(simnum):
+                "Hand over a realization file."
+                callback(simnum, None)
+        self.scheduler.submit(dssenv, nsim, callback=done)
+        self.scheduler.run(abort=abort)
+
+    def close(self):
+        """Remove the workspaces.
+
+        """
+        if self.workspaces is not None:
+            self.workspaces.purge()
+            self.workspaces = None
+
+
+class NumpyDss(SimulationBackend):
+    """Run the direct sequential simulation in-process, with the NumPy
+    implementation in `tools.simulation`. No binary file (nor Wine) is needed,
+    and the realizations are given as arrays.
+
+    The seed of each realization is the one in the parameters plus twice its
+    number.
+
+    Attributes
+    ----------
+    cores : int
+        Number of processes generating realizations at the same time.
+
+    """
+    in_memory = True
+    version = 'NumpyDss 1'
+
+    def __init__(self, cores=1):
+        """Constructor to initialise the NumPy backend.
+
+        Parameters
+        ----------
+        cores : int, default 1
+            Number of processes generating realizations at the same time.
+
+        """
+        self.cores = cores or mp.cpu_count()
+
+    def simulate(self, par, data, nsim, callback=None, abort=None):
+        """Generate a set of realizations with `DirectSequential`. See
+        `SimulationBackend.simulate`.
+
+        """
+        dss = sim.DirectSequential(par, data)
+        jobs = ((dss, int(par.seed) + 2 * simnum)
+                for simnum in xrange(1, nsim + 1))
+        if self.cores > 1:
+            pool = mp.Pool(min(self.cores, nsim))
+            results = pool.imap(_simulate_worker, jobs)
+        else:
+            pool = None
+            results = (_simulate_worker(job) for job in jobs)
+        try:
+            for simnum in xrange(1, nsim + 1):
+                if abort is not None and abort():
+                    raise SystemError("process aborted")
+                values = next(results)
+                if callback is not None:
+                    callback(simnum, values)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+
+def simulation_key(par, data, nsim, version):
+    """Key which identifies a set of realizations, to find them in a
+    `tools.grid.SimulationCache`.
+
+    It is a hash of every DSS parameter (except the paths to the parameters,
+    data and output files), of the conditioning data, of the number of
+    realizations and of the backend version.
+
+    Parameters
+    ----------
+    par : DssParam object
+        DSS parameters.
+    data : PointSet
+        Conditioning data.
+    nsim : int
+        Number of realizations.
+    version : string
+        Version of the backend, as in `SimulationBackend.version`.
+
+    Returns
+    -------
+    string
+        Hexadecimal digest.
+
+    """
+    digest = hashlib.sha1()
+    skip = ('path', 'datapath', 'output', 'nsim')
+    for name, value in sorted(vars(par).items()):
+        if name not in skip:
+            digest.update('{0}={1!r};'.format(name, value))
+    digest.update('nsim={0};version={1};'.format(int(nsim), version))
+    digest.update('{0!r};{1!r};'.format(list(data.varnames),
+                                        float(data.nodata)))
+    digest.update(np.ascontiguousarray(data.values.values,
+                                       dtype='float64').tostring())
+    return digest.hexdigest()
+
+
+def grid_window(par, loc, rad=0):
+    """Window of the simulation grid centred at a location, wide enough to
+    hold every node which takes part in the simulation of its vertical line:
+    those within the search radius or the largest variogram range, plus a
+    tolerance radius.
+
+    Parameters
+    ----------
+    par : DssParam object
+        DSS parameters, with the whole grid.
+    loc : array_like
+        Location [x, y].
+    rad : number, default 0
+        Tolerance radius used to search for neighbour nodes around `loc`, in
+        number of nodes.
+
+    Returns
+    -------
+    xx, yy : list
+        Number of nodes, first coordinate and node size of the window, in the
+        X and Y axes, as in `DssParam.xx` and `DssParam.yy`.
+
+    Raises
+    ------
+    ValueError
+        The location is too far from the grid.
+
+    """
+    ranges = par.ranges
+    if not isinstance(ranges[0], (list, tuple)):
+        ranges = [ranges]
+    reach = max(map(float, par.srchradius[:2]) +
+                [float(r) for struct in ranges for r in struct[:2]])
+    window = list()
+    for axis, coord in zip((par.xx, par.yy), loc):
+        nodes, first, size = axis
+        centre = int(round((coord - first) / float(size)))
+        half = int(math.ceil(reach / float(size) + rad))
+        start = max(0, centre - half)
+        stop = min(int(nodes) - 1, centre + half)
+        if start > stop:
+            raise ValueError('The location {0} is too far from the grid.'.
+                             format(list(loc)))
+        window.append([stop - start + 1, first + start * size, size])
+    return window
+
+
+def _simulate_worker(args):
+    """Generate one realization, in a worker process.
+
+    """
+    dss, seed = args
+    return dss.simulate(seed)
+
+
 if __name__ == '__main__':
     dssexe = '/Users/julio/Desktop/testes/newDSSIntelRelease.exe'
     dsspar = '/Users/julio/Desktop/testes/DSSim.PAR'
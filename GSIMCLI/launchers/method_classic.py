@@ -19,9 +19,13 @@ Created on 22 de Out de 2013
 
 """
 
+import copy
+import csv
 import glob
+import itertools
 import ntpath
 import os
+import Queue
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -40,12 +44,18 @@ import tools.utils as ut
 
 is_alive = True
 
+# detection and correction settings which may be swept in `gsimcli`
+SWEEP_SETTINGS = ['detect_prob', 'correct_method', 'correct_skew',
+                  'correct_percentile', 'rad']
+
 
 def gsimcli(stations_file, stations_header, no_data, stations_order,
             correct_method, detect_prob, detect_flag, detect_save, exe_path,
             par_file, outfolder, purge_sims, rad=0, correct_skew=None,
             correct_percentile=None, optional_stats=None, cores=None, dbgfile=None,
-            print_status=False, skip_dss=False):
+            print_status=False, skip_dss=False, online_stats=False,
+            backend=None, resume=False, cache=None, adaptive=None,
+            crop=False, engine='simulation', sweep=None):
     """Main routine to run GSIMCLI homogenisation procedure in a set of
     stations.
 
@@ -81,7 +91,7 @@ def gsimcli(stations_file, stations_header, no_data, stations_order,
         containing candidate and reference stations, homogenised and simulated
         values, and DSS parameters files.
     exe_path : string
-        DSS binary file path.
+        DSS binary file path. Not needed with an in-memory `backend`.
     par_file : string or DssParam object
         DSS parameters file path or DssParam instance.
     outfolder : string
@@ -107,6 +117,56 @@ def gsimcli(stations_file, stations_header, no_data, stations_order,
     skip_dss : boolean, default False
         Do not run DSS. Choose if the simulated maps are already in place and
         only the homogenisation process is needed.
+    online_stats : boolean, default False
+        Accumulate the local statistics of each realization as soon as it is
+        simulated, instead of reading every realization after the simulation.
+        With `purge_sims` (and without `detect_save`), each realization is
+        deleted right after being read. Ignored if `skip_dss` is True.
+    backend : SimulationBackend object, optional
+        Program which generates the realizations. By default, the DSS binary
+        file in `exe_path`. With an in-memory backend (e.g., `dss.NumpyDss`),
+        the realizations are handed over to the detection in memory, and they
+        are only written to disk if `purge_sims` is False (and `online_stats`
+        is not set).
+    resume : boolean, default False
+        Resume an interrupted run from the checkpoint in `outfolder`, skipping
+        the candidates already homogenised. If the run was completed, return
+        its results right away.
+    cache : SimulationCache object, optional
+        Reuse the realizations of a previous run with the same references, DSS
+        parameters (including the seed and the number of realizations) and
+        backend, instead of simulating them again, and keep the new ones. It
+        has no effect if `skip_dss` is True.
+    adaptive : dict, optional
+        Stop simulating each candidate as soon as its detection is stable (see
+        `homog.DetectionMonitor`), with at most the number of realizations in
+        `par_file`. It may have the keys 'batch' (number of realizations
+        between checks, default 10), 'tol' (maximum number of undecided time
+        steps, default 0), 'conf' (confidence level, default 0.95) and
+        'mean_tol' (maximum standard error of the mean). The realizations used
+        and the detections changed in each check are written to the file
+        ending with *_adaptive.csv*.
+    crop : boolean, default False
+        Simulate only a window of the grid centred at each candidate, as wide
+        as the largest of the search radius and the variogram ranges, plus
+        `rad` (see `dss.grid_window`). The references outside the window are
+        left out of the simulation.
+    engine : {'simulation', 'kriging'}, default 'simulation'
+        Estimate the local PDF's from the simulated realizations, or directly
+        by kriging the references (see `homog.KrigingPDF`), which is much
+        faster but only approximate, e.g., for a quick screening of the data.
+        With 'kriging', there is nothing to simulate and `exe_path` and
+        `backend` are not used.
+    sweep : list of dict, optional
+        Other detection and correction settings to evaluate with the same
+        realizations, e.g., as given by `sweep_grid`. Each dict overrides some
+        of the arguments in `SWEEP_SETTINGS`. The realizations of each
+        candidate are read only once, and every setting homogenises its own
+        copy of the stations, saved in a file ending with
+        *_sweep_<n>_homogenised_data.csv*. The settings and the total numbers
+        of detections and filled missing data are listed in the file ending
+        with *_sweep.csv*. It cannot be used with `online_stats` or
+        `adaptive`.
 
     Returns
     -------
@@ -119,9 +179,37 @@ def gsimcli(stations_file, stations_header, no_data, stations_order,
         Number of missing data that were interpolated in each candidate
         station.
 
+    Notes
+    -----
+    A checkpoint is saved in `outfolder` after each candidate, with the
+    homogenised stations, the detections and filled missing data so far, and
+    the next candidate. The realizations seeds depend only on the DSS seed and
+    on the realization number, so they are recovered from the DSS parameters.
+
+    In a `sweep`, the references of each candidate are always the stations
+    homogenised with the arguments given, so that the realizations are the
+    same for every setting.
+
     """
     global is_alive
 
+    if engine not in ('simulation', 'kriging'):
+        raise ValueError('Invalid detection engine: {0}'.format(engine))
+    settings = {'detect_prob': detect_prob, 'correct_method': correct_method,
+                'correct_skew': correct_skew,
+                'correct_percentile': correct_percentile, 'rad': rad}
+    if sweep:
+        if online_stats or adaptive:
+            raise ValueError('A sweep needs every realization, it cannot be '
+                             'used with online_stats or adaptive.')
+        for setting in sweep:
+            unknown = set(setting) - set(SWEEP_SETTINGS)
+            if unknown:
+                raise ValueError('Invalid sweep settings: {0}'.format(
+                    ', '.join(sorted(unknown))))
+        sweep = [dict(settings, **setting) for setting in sweep]
+    else:
+        sweep = list()
     if not cores or cores > mp.cpu_count():
         cores = mp.cpu_count()
     if print_status:
@@ -139,16 +227,72 @@ def gsimcli(stations_file, stations_header, no_data, stations_order,
     else:
         dsspar = pdss.DssParam()
         dsspar.load_old(par_file)  # TODO: old
+    if crop:
+        # the grid is cropped in a copy, the caller keeps the whole one
+        dsspar = copy.copy(dsspar)
+    # the climate values are kept as float32 while the stations are not used,
+    # from the start, so that every candidate sees the same values
+    climvars = ['clim']
+    stations_pset.compact(float32=climvars)
     dnumber_list = list()
     fnumber_list = list()
+    sweep_states = [{'stations_pset': copy.deepcopy(stations_pset),
+                     'dnumber_list': list(), 'fnumber_list': list()}
+                    for setting in sweep]
+
+    if engine == 'kriging':
+        # nothing to simulate
+        skip_dss = True
+        backend = None
+    elif backend is None:
+        backend = dss.DssBinary(exe_path, cores, dbgfile, print_status)
+    in_memory = backend is None or backend.in_memory
 
     # workaround for Qt forcing backslash
-    if os.name == "nt":
+    if os.name == "nt" and exe_path:
         exe_path = ntpath.abspath(exe_path)
 
-    commonpath = os.path.commonprefix((outfolder, exe_path))
+    if not in_memory:
+        commonpath = os.path.commonprefix((outfolder, exe_path))
+    oldpar = None
+    basename = os.path.basename(outfolder)
+    checkpoint = os.path.join(outfolder, basename + '_checkpoint.pkl')
+    first = 0
+    if resume and os.path.isfile(checkpoint):
+        state = ut.unpickle(checkpoint)
+        if (state['stations_order'] != list(stations_order) or
+                state['seed'] != dsspar.seed or state['nsim'] != dsspar.nsim or
+                state.get('sweep', list()) != sweep):
+            raise ValueError('The checkpoint {0} was saved with different '
+                             'candidates or DSS parameters'.format(checkpoint))
+        if state['results'] is not None:
+            if print_status:
+                print 'Already completed, skipping.'
+            return state['results']
+        stations_pset = state['stations_pset']
+        dnumber_list = state['dnumber_list']
+        fnumber_list = state['fnumber_list']
+        sweep_states = state.get('sweep_states', list())
+        first = state['next']
+        if print_status:
+            print 'Resuming from candidate {0}/{1}'.format(
+                first + 1, len(stations_order))
+
+    def save_checkpoint(next_candidate, results=None):
+        ut.pickle_atomic({'stations_order': list(stations_order),
+                          'seed': dsspar.seed, 'nsim': dsspar.nsim,
+                          'stations_pset': stations_pset,
+                          'dnumber_list': dnumber_list,
+                          'fnumber_list': fnumber_list,
+                          'sweep': sweep, 'sweep_states': sweep_states,
+                          'next': next_candidate, 'results': results},
+                         checkpoint)
+
+    full_grid = [list(dsspar.xx), list(dsspar.yy)]
+    # the realizations must hold the widest area of any setting
+    rads = sorted(set([rad] + [setting['rad'] for setting in sweep]))
     # start iterative process
-    for i in xrange(len(stations_order)):
+    for i in xrange(first, len(stations_order)):
         if not is_alive:
             raise SystemError("process aborted")
         if print_status:
@@ -158,60 +302,199 @@ def gsimcli(stations_file, stations_header, no_data, stations_order,
         # manage stations
         candidate, references = hmg.take_candidate(stations_pset,
                                                    stations_order[i])
+        if crop:
+            cand_xy = list(candidate.values.loc[
+                candidate.values.first_valid_index(), ['x', 'y']])
+            dsspar.update(['xx', 'yy'], full_grid)
+            window = dss.grid_window(dsspar, cand_xy, rads[-1])
+            dsspar.update(['xx', 'yy'], window)
+            refs = references.values
+            inside = np.ones(len(refs), dtype='bool')
+            for var, (nodes, start, size) in zip(['x', 'y'], window):
+                inside &= ((refs[var] >= start - size / 2.0) &
+                           (refs[var] <= start + (nodes - 0.5) * size)).values
+            references.values = refs[inside]
+            if print_status:
+                print ('Simulating {0} x {1} nodes around the candidate.'.
+                       format(window[0][0], window[1][0]))
         # prepare and launch DSS
-        basename = os.path.basename(outfolder)
         refname = basename + '_references_' + str(i) + '.prn'
         outname = basename + '_dss_map_st' + str(i) + '_sim.out'  # TODO: +1
         parname = basename + '_dss_par_st' + str(i) + '.par'
         candname = basename + '_candidate_' + str(i) + '.prn'
         reffile = os.path.join(outfolder, refname)
         outfile = os.path.join(outfolder, outname)
-        reffile_nt = ntpath.relpath(os.path.join(outfolder, refname),
-                                    commonpath)
-        outfile_nt = ntpath.relpath(os.path.join(outfolder, outname),
-                                    commonpath)
-        # workaround for mp_exec, it needs one less directory in the tree
-        reffile_nt = reffile_nt[reffile_nt.index('\\') + 1:]
-        outfile_nt = outfile_nt[outfile_nt.index('\\') + 1:]
+        if in_memory:
+            reffile_nt, outfile_nt = reffile, outfile
+        else:
+            reffile_nt = ntpath.relpath(os.path.join(outfolder, refname),
+                                        commonpath)
+            outfile_nt = ntpath.relpath(os.path.join(outfolder, outname),
+                                        commonpath)
+            # workaround for DSS, it needs one less directory in the tree
+            reffile_nt = reffile_nt[reffile_nt.index('\\') + 1:]
+            outfile_nt = outfile_nt[outfile_nt.index('\\') + 1:]
 
         parfile = os.path.join(outfolder, parname)
-        references.save(psetfile=reffile, header=False)
+        if detect_save or not in_memory:
+            references.save(psetfile=reffile, header=False)
         if detect_save:
             candfile = os.path.join(outfolder, candname)
             candidate.save(psetfile=candfile, header=True)
+        dims = [dsspar.xx[0], dsspar.yy[0], dsspar.zz[0]]
+        first_coord = [dsspar.xx[1], dsspar.yy[1], dsspar.zz[1]]
+        cells_size = [dsspar.xx[2], dsspar.yy[2], dsspar.zz[2]]
+        cached = None
+        writer = None
         if not skip_dss:
             dsspar.update(['datapath', 'output'], [reffile_nt, outfile_nt])
-            dsspar.save_old(parfile)  # TODO: old
-            oldpar = pdss.DssParam()
-            oldpar.load_old(parfile)
-            oldpar.nsim = 1
-            purge_temp = False
-            for sim in xrange(1, dsspar.nsim + 1, cores):
-                if not is_alive:
-                    raise SystemError("process aborted")
-                if print_status:
-                    print ('[{0}/{1}] Working on realization {2}'.
-                           format(i + 1, len(stations_order), sim))
-                print "STATUS: realization {0}".format(sim)
-                if sim >= dsspar.nsim + 1 - cores:
-                    purge_temp = True
-                dss.mp_exec(dss_path=exe_path, par_path=oldpar, dbg=dbgfile,
-                            output=outfile_nt, simnum=sim, cores=cores,
-                            purge=purge_temp, totalsim=dsspar.nsim)
+            if detect_save or oldpar is None:
+                dsspar.save_old(parfile)  # TODO: old
+            if oldpar is None:
+                # read the parameters as DSS does, only once
+                oldpar = pdss.DssParam()
+                oldpar.load_old(parfile)
+                oldpar.nsim = 1
+            else:
+                oldpar.update(['datapath', 'output', 'xx', 'yy'],
+                              [reffile_nt, outfile_nt, dsspar.xx, dsspar.yy])
+                oldpar.path = parfile
+            if cache is not None:
+                key = dss.simulation_key(oldpar, references, dsspar.nsim,
+                                         backend.version)
+                cached = cache.get(key)
+                if cached is None:
+                    writer = cache.writer(key, dsspar.nsim, dims, no_data)
+                elif print_status:
+                    print 'Reusing the cached realizations.'
+        received = list()
+
+        def simfile(simnum):
+            "Path to the file of a realization."
+            if simnum > 1:
+                return ut.filename_indexing(outfile, simnum)
+            return outfile
+
+        adaptive_sim = None
+        if adaptive and not skip_dss and cached is None:
+            monitor = hmg.DetectionMonitor(candidate, dims, first_coord,
+                                           cells_size, no_data, rad,
+                                           detect_prob, **adaptive)
+            adaptive_sim = AdaptiveSimulation(monitor, simfile, print_status)
+
+        if online_stats and not skip_dss:
+            cand_xy = list(candidate.values.loc[
+                candidate.values.first_valid_index(), ['x', 'y']])
+            sim_maps = gr.GridStream(dims, first_coord, cells_size, no_data,
+                                     headerin=0, loc=cand_xy, tol=rad)
+            sim_maps.folder = outfolder
+            remove_sims = purge_sims and not detect_save
+
+            def ingest(simnum, values):
+                "Add a finished realization to the running statistics."
+                if values is not None:
+                    sim_maps.add(values)
+                    return
+                sim_maps.ingest(simfile(simnum), remove=remove_sims)
+        elif (in_memory or cached is not None) and not skip_dss:
+            sim_maps = gr.GridArrays(dims, first_coord, cells_size, no_data,
+                                     nsim=dsspar.nsim, folder=outfolder)
+
+            def ingest(simnum, values):
+                "Keep a finished realization in memory."
+                sim_maps.add(values)
+        else:
+            sim_maps = None
+            ingest = None
 
+        # the stations and the candidate are only needed again after the
+        # simulation
+        stations_pset.compact(float32=climvars)
+        candidate.compact(float32=climvars)
+        if not skip_dss:
+            def finished(simnum, values):
+                "Report each finished realization."
+                if print_status:
+                    print ('[{0}/{1}] Finished realization {2}'.
+                           format(i + 1, len(stations_order), simnum))
+                print "STATUS: realization {0}".format(simnum)
+                if writer is not None:
+                    if values is None:
+                        with open(simfile(simnum), 'rb') as grid:
+                            writer.add(simnum, gr.read_values(
+                                grid, writer.cube[0].size))
+                    else:
+                        writer.add(simnum, values)
+                received.append(simnum)
+                if ingest is not None:
+                    ingest(simnum, values)
+
+            callback, abort = finished, lambda: not is_alive
+            if adaptive_sim is not None:
+                callback, abort = adaptive_sim.hooks(finished)
+            if cached is not None:
+                cache.replay(cached, callback, no_data)
+            else:
+                try:
+                    backend.simulate(oldpar, references, dsspar.nsim,
+                                     callback=callback, abort=abort)
+                except dss.SimulationFailed:
+                    # the detection is never done with a broken set
+                    if writer is not None:
+                        writer.discard()
+                    raise
+                except SystemError:
+                    if adaptive_sim is None or not adaptive_sim.stopped:
+                        if writer is not None:
+                            writer.discard()
+                        raise
+                except:
+                    if writer is not None:
+                        writer.discard()
+                    raise
+                if writer is not None:
+                    # an incomplete set is not kept
+                    writer.commit()
+            if adaptive_sim is not None:
+                adaptive_sim.save(os.path.join(
+                    outfolder, basename + '_adaptive.csv'), stations_order[i])
+                if print_status:
+                    print 'Realizations used: {0} of {1}'.format(
+                        len(received), dsspar.nsim)
+                if not in_memory:
+                    # leftovers of the stopped realizations
+                    for simnum in xrange(1, dsspar.nsim + 1):
+                        if (simnum not in received and
+                                os.path.isfile(simfile(simnum))):
+                            os.remove(simfile(simnum))
+            if isinstance(sim_maps, gr.GridArrays) and not purge_sims:
+                sim_maps.export(outfile)
+
+        references.compact(float32=climvars)
         # prepare detection
         intermediary_files = os.path.join(outfolder, basename + '_homogenised_'
                                           + str(i) + '.prn')
-        dims = [dsspar.xx[0], dsspar.yy[0], dsspar.zz[0]]
-        first_coord = [dsspar.xx[1], dsspar.yy[1], dsspar.zz[1]]
-        cells_size = [dsspar.xx[2], dsspar.yy[2], dsspar.zz[2]]
-        sim_maps = gr.GridFiles()
-        sim_maps.load(outfile, dsspar.nsim, dims, first_coord, cells_size,
-                      no_data, headerin=0)
+        if engine == 'kriging':
+            sim_maps = hmg.KrigingPDF(dsspar, references, no_data)
+        elif sim_maps is None:
+            sim_maps = gr.GridFiles()
+            if adaptive_sim is not None and len(received) < dsspar.nsim:
+                sim_maps.open_files([simfile(simnum)
+                                     for simnum in sorted(received)],
+                                    dims, first_coord, cells_size, no_data,
+                                    headerin=0)
+            else:
+                sim_maps.load(outfile, dsspar.nsim, dims, first_coord,
+                              cells_size, no_data, headerin=0)
 
         # detect and fix inhomogeneities
         if print_status:
             print 'Detecting inhomogeneities...'
+        if sweep and isinstance(sim_maps, gr.GridFiles):
+            # read the realizations around the candidate only once
+            cand_xy = list(candidate.values.loc[
+                candidate.values.first_valid_index(), ['x', 'y']])
+            sim_maps.locations_values([cand_xy + [r] for r in rads])
         homogenisation = hmg.detect(grids=sim_maps, obs_file=candidate,
                                     method=correct_method, prob=detect_prob,
                                     flag=detect_flag, save=detect_save,
@@ -224,31 +507,255 @@ def gsimcli(stations_file, stations_header, no_data, stations_order,
             print 'Inhomogeneities detected: {0}'.format(detected_number)
         dnumber_list.append(detected_number)
         fnumber_list.append(filled_number)
+        detect_sweep(sim_maps, stations_order[i], sweep, sweep_states,
+                     detect_flag, optional_stats, float32=climvars)
         # prepare next iteration
         stations_pset = hmg.update_station(stations_pset, homogenised)
+        stations_pset.compact(float32=climvars)
         if not detect_save:
             [os.remove(fpath) for fpath in
-             [reffile, parfile]]  # , dsspar.transfile]]
+             [reffile, parfile]  # , dsspar.transfile]]
+             if os.path.isfile(fpath)]
         if purge_sims:
             sim_maps.purge()
         else:
             sim_maps.dump()
+        save_checkpoint(i + 1)
+
+    if backend is not None:
+        backend.close()
 
     # save results
     if print_status:
         print 'Process completed.'
         print 'Detections: ', ', '.join(map(str, dnumber_list))
         print 'Missing data filled: ', ', '.join(map(str, fnumber_list))
+        if cache is not None:
+            print cache.report()
         print 'Saving results...'
     homogenised_file = os.path.join(outfolder, basename +
                                     '_homogenised_data.csv')
     hmg.save_output(pset_file=stations_pset, outfile=homogenised_file,
                     fformat='gsimcli', header=True, save_stations=True)
+    if sweep:
+        save_sweep(outfolder, settings, (homogenised_file, dnumber_list,
+                                         fnumber_list), sweep, sweep_states)
+    save_checkpoint(len(stations_order),
+                    (homogenised_file, dnumber_list, fnumber_list))
 
     return homogenised_file, dnumber_list, fnumber_list
 
 
-def run_par(par_path, print_status=False, **kwargs):
+class AdaptiveSimulation(object):
+
+    """Simulate a candidate only until its detection is stable, following it
+    with a `homog.DetectionMonitor` (see the `adaptive` argument of
+    `gsimcli`).
+
+    Attributes
+    ----------
+    monitor : DetectionMonitor
+        Detection at the candidate station.
+    simfile : function
+        Path to the file of a realization, given its number, for the backends
+        which only save it to a file.
+    print_status : boolean
+        Print the detection after each check.
+
+    """
+
+    def __init__(self, monitor, simfile, print_status=False):
+        """Constructor to initialise an AdaptiveSimulation instance.
+
+        """
+        self.monitor = monitor
+        self.simfile = simfile
+        self.print_status = print_status
+
+    def hooks(self, callback=None):
+        """Callback and abort hook to give to `SimulationBackend.simulate`.
+
+        Parameters
+        ----------
+        callback : function, optional
+            Called with each finished realization, as in
+            `SimulationBackend.simulate`, after the monitor.
+
+        Returns
+        -------
+        finished : function
+            Callback which adds each realization to the monitor, until the
+            detection is stable.
+        stop : function
+            Abort hook, true once the detection is stable, or if the process
+            was aborted (see `is_alive`).
+
+        """
+        def finished(simnum, values):
+            "Add a finished realization to the monitor."
+            monitor = self.monitor
+            if not monitor.stable:
+                if values is None:
+                    monitor.ingest(self.simfile(simnum))
+                else:
+                    monitor.add(values)
+                if self.print_status and monitor.nsim % monitor.batch == 0:
+                    print ('{nsim} realizations: {undecided} undecided, '
+                           '{flipped} changed'.format(**monitor.history[-1]))
+            if callback is not None:
+                callback(simnum, values)
+
+        return finished, self.stop
+
+    def stop(self):
+        """Abort, or stop once the detection is stable.
+
+        """
+        return not is_alive or self.monitor.stable
+
+    @property
+    def stopped(self):
+        """The simulation was stopped because the detection is stable, and
+        not aborted.
+
+        """
+        return is_alive and self.monitor.stable
+
+    def save(self, report, station):
+        """Append the checks of the monitor to a CSV report.
+
+        Parameters
+        ----------
+        report : string
+            File path of the report.
+        station : int
+            ID of the candidate station.
+
+        """
+        new = not os.path.isfile(report)
+        with open(report, 'ab') as fid:
+            rows = csv.writer(fid)
+            if new:
+                rows.writerow(['candidate', 'realizations', 'undecided',
+                               'changed', 'mean_se'])
+            for check in self.monitor.history:
+                rows.writerow([station, check['nsim'], check['undecided'],
+                               check['flipped'], check['mean_se']])
+
+
+def sweep_grid(**values):
+    """Every combination of detection and correction settings, to be
+    evaluated in the `sweep` of `gsimcli`.
+
+    Parameters
+    ----------
+    **values : list
+        Values of each setting, named as in `SWEEP_SETTINGS`, e.g.,
+        ``sweep_grid(detect_prob=[0.9, 0.95], rad=[0, 10000])``.
+
+    Returns
+    -------
+    list of dict
+        One dict for each combination.
+
+    """
+    keys = sorted(values)
+    return [dict(zip(keys, combination)) for combination in
+            itertools.product(*[values[key] for key in keys])]
+
+
+def detect_sweep(grids, station, sweep, sweep_states, flag=True,
+                 optional_stats=None, float32=None):
+    """Detect and correct the inhomogeneities of a candidate station with
+    every setting of a sweep, each one in its own copy of the stations.
+
+    Parameters
+    ----------
+    grids : GridFiles, GridArrays or GridStream object
+        Realizations of the candidate, as given to `homog.detect`.
+    station : int
+        ID of the candidate station.
+    sweep : list of dict
+        Detection and correction settings, with every key in
+        `SWEEP_SETTINGS`.
+    sweep_states : list of dict
+        Stations ('stations_pset'), and number of detections
+        ('dnumber_list') and of filled missing data ('fnumber_list') in each
+        candidate, of each setting. They are updated in place.
+    flag : boolean, default True
+        Flag the homogenised values (see `homog.detect`).
+    optional_stats : list, optional
+        Statistics to calculate in addition to the detection ones (see
+        `homog.detect`).
+    float32 : list, optional
+        Variables kept as float32 once the stations are updated (see
+        `PointSet.compact`).
+
+    """
+    for setting, state in zip(sweep, sweep_states):
+        candidate = hmg.take_candidate(state['stations_pset'], station)[0]
+        homogenised, detected, filled = hmg.detect(
+            grids=grids, obs_file=candidate,
+            method=setting['correct_method'], prob=setting['detect_prob'],
+            flag=flag, header=True, skewness=setting['correct_skew'],
+            rad=setting['rad'], percentile=setting['correct_percentile'],
+            optional_stats=optional_stats)
+        state['stations_pset'] = hmg.update_station(state['stations_pset'],
+                                                    homogenised)
+        state['stations_pset'].compact(float32=float32)
+        state['dnumber_list'].append(detected)
+        state['fnumber_list'].append(filled)
+
+
+def save_sweep(outfolder, settings, results, sweep, sweep_states):
+    """Save the homogenised data of every setting of a sweep, and a report
+    which compares them with the base settings.
+
+    Parameters
+    ----------
+    outfolder : string
+        Results folder. The files are named after it, as in `gsimcli`.
+    settings : dict
+        Base settings, with every key in `SWEEP_SETTINGS`.
+    results : tuple
+        Homogenised data file, and number of detections and of filled missing
+        data in each candidate, with the base settings.
+    sweep : list of dict
+        Settings of the sweep (see `detect_sweep`).
+    sweep_states : list of dict
+        Stations and counts of each setting (see `detect_sweep`).
+
+    Returns
+    -------
+    report : string
+        File path of the CSV report.
+
+    """
+    basename = os.path.basename(outfolder)
+    homogenised_file, dnumber_list, fnumber_list = results
+    report = os.path.join(outfolder, basename + '_sweep.csv')
+    with open(report, 'wb') as fid:
+        rows = csv.writer(fid)
+        rows.writerow(['setting'] + SWEEP_SETTINGS +
+                      ['detections', 'missing_data', 'homogenised_file'])
+        rows.writerow([0] + [settings[key] for key in SWEEP_SETTINGS] +
+                      [sum(dnumber_list), sum(fnumber_list),
+                       homogenised_file])
+        for j, (setting, state) in enumerate(zip(sweep, sweep_states)):
+            sweep_file = os.path.join(
+                outfolder, '{0}_sweep_{1}_homogenised_data.csv'.format(
+                    basename, j + 1))
+            hmg.save_output(pset_file=state['stations_pset'],
+                            outfile=sweep_file, fformat='gsimcli',
+                            header=True, save_stations=True)
+            rows.writerow([j + 1] +
+                          [setting[key] for key in SWEEP_SETTINGS] +
+                          [sum(state['dnumber_list']),
+                           sum(state['fnumber_list']), sweep_file])
+    return report
+
+
+def run_par(par_path, print_status=False, resume=False, **kwargs):
     """Run GSIMCLI using the settings included in a parameters file.
 
     Parameters
@@ -257,6 +764,9 @@ def run_par(par_path, print_status=False, **kwargs):
         File path or GsimcliParam instance with GSIMCLI parameters.
     print_status : boolean, default False
         Print some messages with the procedure status while it is running.
+    resume : boolean, default False
+        Resume an interrupted run, skipping the candidates already
+        homogenised.
 
     Returns
     -------
@@ -327,7 +837,8 @@ def run_par(par_path, print_status=False, **kwargs):
                       stations_order, gscpar.correct_method,
                       gscpar.detect_prob, detect_flag, gscpar.detect_save,
                       gscpar.dss_exe, dsspar, gscpar.results, gscpar.sim_purge,
-                      radius, skew, perc, print_status=print_status, **kwargs)
+                      radius, skew, perc, print_status=print_status,
+                      resume=resume, **kwargs)
 
     # FIXME: workaround for merge dependence
     results = list(results)
@@ -337,7 +848,7 @@ def run_par(par_path, print_status=False, **kwargs):
 
 
 def batch_decade(par_path, variograms_file, print_status=False,
-                 network_id=None, **kwargs):
+                 network_id=None, resume=False, jobs=1, **kwargs):
     """Batch process to run GSIMCLI with data files divided in decades.
 
     Parameters
@@ -351,11 +862,17 @@ def batch_decade(par_path, variograms_file, print_status=False,
     network_id : string, optional
         Network ID. If not given, will try to deduce from 'data' field, which
         should be passed in par_path.
+    resume : boolean, default False
+        Resume an interrupted run, skipping the decades and candidates already
+        homogenised.
+    jobs : int, default 1
+        Number of decades homogenised at the same time. See `run_jobs`.
 
     See Also
     --------
     run_par : Run GSIMCLI using the settings included in a parameters file.
     batch_networks : Run GSIMCLI along different networks.
+    run_jobs : Run several GSIMCLI jobs at the same time.
 
     Notes
     -----
@@ -388,20 +905,49 @@ def batch_decade(par_path, variograms_file, print_status=False,
     else:
         gscpar = pgc.GsimcliParam(par_path)
 
+    if not network_id:
+        network_id = os.path.basename(os.path.dirname(gscpar.data))
+    decades, results_path = decade_jobs(gscpar, variograms_file)
+    run_jobs(decades, [(results_path, range(len(decades)))], jobs,
+             print_status, resume, **kwargs)
+#     ss.xls2costhome(xlspath=gsimclipath, outpath=outpath, nd=gscpar.no_data,
+#                     sheet='All stations', header=False, skip_rows=[1],
+#                     network_id=network_id, status='ho', variable='vv',
+#                     resolution='y', content='d', ftype='data', yearly_sum=True)
+
+
+def decade_jobs(gscpar, variograms_file):
+    """Prepare the GSIMCLI parameters of each decade, as in `batch_decade`.
+
+    Parameters
+    ----------
+    gscpar : GsimcliParam object
+        GSIMCLI parameters.
+    variograms_file : string
+        Variograms file path.
+
+    Returns
+    -------
+    jobs : list of dict
+        GSIMCLI parameters of each decade ('par'), and its status message
+        ('status').
+    results_path : string
+        File path to merge the results of every decade.
+
+    See Also
+    --------
+    batch_decade : Run GSIMCLI with data files divided in decades.
+
+    """
     variograms = pd.read_csv(variograms_file)
     # make case insensitive
     variograms.rename(columns=lambda x: x.lower(), inplace=True)
 
-    results = list()
+    jobs = list()
     outpath = str(gscpar.results)
-    if not network_id:
-        network_id = os.path.basename(os.path.dirname(gscpar.data))
+    variograms_dir = os.path.dirname(os.path.abspath(variograms_file))
 
     for decade in variograms.iterrows():
-        if print_status:
-            print "Processing decade: ", decade[1].ix['decade']
-        print "STATUS: decade {0}".format(decade[1].ix['decade'])
-        os.chdir(os.path.dirname(variograms_file))
         first_year = decade[1].ix['decade'].split('-')[0].strip()
         # try to use the directory containing the decadal data, otherwise try
         # to find it in the same directory as the variograms file
@@ -411,7 +957,7 @@ def batch_decade(par_path, variograms_file, print_status=False,
             else:
                 data_folder = str(gscpar.data)
         else:
-            data_folder = os.path.join(os.getcwd(), glob.glob('dec*')[0])
+            data_folder = glob.glob(os.path.join(variograms_dir, 'dec*'))[0]
 
         data_file = os.path.join(data_folder, glob.glob
                                  (data_folder + '/*' + first_year + '*')[0])
@@ -442,8 +988,10 @@ def batch_decade(par_path, variograms_file, print_status=False,
 #         new_par = os.path.join(gscpar.results, os.path.basename(gscpar.path))
 #         gscpar.update(fields, values, True, ut.filename_indexing
 #                       (new_par, decade[1].ix['decade']))
-        gscpar.update(fields, values)
-        results.append(run_par(gscpar, print_status, **kwargs))
+        decade_par = copy.deepcopy(gscpar)
+        decade_par.update(fields, values)
+        jobs.append({'par': decade_par,
+                     'status': [('decade', decade[1].ix['decade'])]})
 
     # workaround for batch_network not working without batch_decade, thus not
     # updating the data path
@@ -451,15 +999,11 @@ def batch_decade(par_path, variograms_file, print_status=False,
     # results_path = os.path.join(outpath, 'gsimcli_results.xls')
     # try to merge paths or use the second
     results_path = os.path.join(outpath, gscpar.results_file)
-    hmg.merge_output(results, results_path)
-#     ss.xls2costhome(xlspath=gsimclipath, outpath=outpath, nd=gscpar.no_data,
-#                     sheet='All stations', header=False, skip_rows=[1],
-#                     network_id=network_id, status='ho', variable='vv',
-#                     resolution='y', content='d', ftype='data', yearly_sum=True)
+    return jobs, results_path
 
 
 def batch_networks(par_path, networks, decades=False, print_status=False,
-                   **kwargs):
+                   resume=False, jobs=1, **kwargs):
     """Batch process to run GSIMCLI along different networks.
 
     WARNING: it is only working for decades=True
@@ -478,11 +1022,18 @@ def batch_networks(par_path, networks, decades=False, print_status=False,
         *\*variog\*.csv*.
     print_status : boolean, default False
         Print some messages with the procedure status while it is running.
+    resume : boolean, default False
+        Resume an interrupted run, skipping the networks, decades and
+        candidates already homogenised.
+    jobs : int, default 1
+        Number of networks, or decades of any network, homogenised at the same
+        time. See `run_jobs`.
 
     See Also
     --------
     run_par : Run GSIMCLI using the settings included in a parameters file.
     batch_decade : Run GSIMCLI with data files divided in decades.
+    run_jobs : Run several GSIMCLI jobs at the same time.
 
     Notes
     -----
@@ -503,13 +1054,11 @@ def batch_networks(par_path, networks, decades=False, print_status=False,
     results_dir = str(gscpar.results)
     results_file = os.path.basename(gscpar.results_file)
 
+    all_jobs = list()
+    merges = list()
     for network in networks:
         network_id = os.path.basename(network)
-        if print_status:
-            print "Processing network: ", network_id
-        print "STATUS: network {0}".format(network_id)
-        os.chdir(network)
-        specfile = os.path.join(network, glob.glob('*grid*.csv')[0])
+        specfile = glob.glob(os.path.join(network, '*grid*.csv'))[0]
         network_results = os.path.join(results_dir, network_id)
         if not os.path.isdir(network_results):
             os.mkdir(network_results)
@@ -526,12 +1075,175 @@ def batch_networks(par_path, networks, decades=False, print_status=False,
                       (par_path, network_id))
 
         if decades:
-            variogram_file = os.path.join(network,
-                                          glob.glob('*variog*.csv')[0])
-            batch_decade(gscpar, variogram_file, print_status, network_id,
-                         **kwargs)
+            variogram_file = glob.glob(os.path.join(network,
+                                                    '*variog*.csv'))[0]
+            network_jobs, results_path = decade_jobs(gscpar, variogram_file)
+            merges.append((results_path,
+                           range(len(all_jobs),
+                                 len(all_jobs) + len(network_jobs))))
         else:
-            run_par(par_path, print_status, **kwargs)
+            network_jobs = [{'par': copy.deepcopy(gscpar), 'status': list()}]
+        network_jobs[0]['status'].insert(0, ('network', network_id))
+        all_jobs.extend(network_jobs)
+
+    run_jobs(all_jobs, merges, jobs, print_status, resume, **kwargs)
+
+
+def run_jobs(jobs, merges=None, njobs=1, print_status=False, resume=False,
+             **kwargs):
+    """Run several independent GSIMCLI jobs (e.g., decades or networks), some
+    of them at the same time, each one with its share of the cores. The
+    candidates of each job are still homogenised one after the other.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        GSIMCLI parameters of each job ('par'), and the status messages to
+        print when it starts ('status'), as (kind, name) pairs.
+    merges : list of tuple, optional
+        File path and job indexes of each set of results to merge (see
+        `homog.merge_output`), as soon as all of its jobs are finished.
+    njobs : int, default 1
+        Maximum number of jobs running at the same time, each one in its own
+        process.
+    print_status : boolean, default False
+        Print some messages with the procedure status while it is running.
+    resume : boolean, default False
+        Resume interrupted jobs, skipping the candidates already homogenised.
+    **kwargs
+        Other arguments of `gsimcli`. The `cores` (by default, all available
+        cores) are shared by the running jobs.
+
+    Returns
+    -------
+    results : list
+        Results of each job, as given by `run_par`.
+
+    Notes
+    -----
+    Each job must have its own results folder, which also holds the
+    temporary directories of the simulation. When `njobs` is greater than 1,
+    the `backend` argument, if any, must be picklable, and the jobs are not
+    stopped by `is_alive`. The jobs run in non-daemonic processes, so that the
+    backend may start its own processes, and a backend with a `cores`
+    attribute (e.g., `dss.NumpyDss`) is given a copy with no more than each
+    job's share of the cores.
+
+    """
+    cores = kwargs.pop('cores', None) or mp.cpu_count()
+    njobs = max(1, min(njobs, len(jobs)))
+    kwargs['cores'] = max(1, cores // njobs)
+    backend = kwargs.get('backend')
+    if getattr(backend, 'cores', 0) > kwargs['cores']:
+        backend = copy.copy(backend)
+        backend.cores = kwargs['cores']
+        kwargs['backend'] = backend
+    results = [None] * len(jobs)
+    pending = [(path, list(indexes)) for path, indexes in merges or list()]
+
+    tasks = [(i, job, print_status, resume, kwargs)
+             for i, job in enumerate(jobs)]
+    if njobs > 1:
+        workers = _JobWorkers(tasks, njobs)
+        finished = workers.results()
+    else:
+        workers = None
+        finished = itertools.imap(_job_worker, tasks)
+    try:
+        for i, result in finished:
+            results[i] = result
+            for merge in list(pending):
+                path, indexes = merge
+                if all(results[j] is not None for j in indexes):
+                    hmg.merge_output([results[j] for j in indexes], path)
+                    pending.remove(merge)
+    except:
+        if workers is not None:
+            workers.terminate()
+        raise
+    finally:
+        if workers is not None:
+            workers.join()
+    return results
+
+
+class _JobWorkers(object):
+    """Non-daemonic processes running GSIMCLI jobs, fed from a queue. Unlike
+    the workers of `multiprocessing.Pool`, they may start their own processes.
+
+    """
+    def __init__(self, tasks, njobs):
+        """Start `njobs` processes and queue the `tasks` (see `_job_worker`).
+
+        """
+        self.ntasks = len(tasks)
+        self.tasks = mp.Queue()
+        self.done = mp.Queue()
+        for task in tasks:
+            self.tasks.put(task)
+        self.processes = list()
+        for _ in xrange(njobs):
+            self.tasks.put(None)
+            process = mp.Process(target=_job_process,
+                                 args=(self.tasks, self.done))
+            process.start()
+            self.processes.append(process)
+
+    def results(self):
+        """Yield the results of the jobs as soon as they finish, and raise the
+        exception of the first job which fails.
+
+        """
+        for _ in xrange(self.ntasks):
+            while True:
+                try:
+                    failed, result = self.done.get(timeout=1)
+                    break
+                except Queue.Empty:
+                    if any(process.exitcode not in (None, 0)
+                           for process in self.processes):
+                        raise SystemError("a job process died")
+            if failed:
+                raise result
+            yield result
+
+    def terminate(self):
+        """Stop the running jobs.
+
+        """
+        for process in self.processes:
+            process.terminate()
+
+    def join(self):
+        """Wait for the processes to exit.
+
+        """
+        for process in self.processes:
+            process.join()
+
+
+def _job_process(tasks, done):
+    """Run the queued GSIMCLI jobs until a None task, in a `_JobWorkers`
+    process, and queue their results or exceptions.
+
+    """
+    for args in iter(tasks.get, None):
+        try:
+            done.put((False, _job_worker(args)))
+        except Exception as err:
+            done.put((True, err))
+
+
+def _job_worker(args):
+    """Run one GSIMCLI job, in a worker process.
+
+    """
+    i, job, print_status, resume, kwargs = args
+    for kind, name in job['status']:
+        if print_status:
+            print "Processing {0}: {1}".format(kind, name)
+        print "STATUS: {0} {1}".format(kind, name)
+    return i, run_par(job['par'], print_status, resume, **kwargs)
 
 
 if __name__ == '__main__':
@@ -60,7 +60,7 @@ class Shapefile(object):
         self.celly = self.cellx
         self.cellz = cellz
         self.nodata = float(fid.readline().split()[1])
-        self.data = np.loadtxt(fid)
+        self.data = gr.read_table(fid)
 
     def ascii2grid(self):
         """Convert a shapefile in ASCII format to GridArr format.
@@ -0,0 +1,80 @@
+"""
+Benchmark of the text parsers used to load point-sets and grids, comparing
+`tools.grid.read_table` with `numpy.loadtxt`.
+
+The stations fixture (data/000005_19001999.prn) is repeated until it has the
+given number of lines. Run from this directory:
+
+    python bench_parsers.py [number of lines]
+
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import tools.grid as gr
+from tools.utils import skip_lines
+
+
+def scale_fixture(path, nlines, out):
+    """Write the values of a point-set repeatedly, until `nlines` lines."""
+    pset = gr.PointSet()
+    pset.load(path)
+    reps = int(np.ceil(float(nlines) / pset.values.shape[0]))
+    pset.values = pset.values.iloc[np.tile(np.arange(pset.values.shape[0]),
+                                           reps)[:nlines]]
+    pset.save(out, header=True)
+    return pset.nvars
+
+
+def bench(label, loadtxt, fast, number=3):
+    """Time both readers and check that they read the same values."""
+    nt = min(timeit.repeat(loadtxt, number=1, repeat=number))
+    ft = min(timeit.repeat(fast, number=1, repeat=number))
+    same = np.array_equal(np.atleast_2d(loadtxt()), np.atleast_2d(fast()))
+    print '{0:<12} loadtxt {1:8.3f} s   read_table {2:8.3f} s   ' \
+        'speedup {3:6.1f}x   same values: {4}'.format(label, nt, ft,
+                                                      nt / ft, same)
+
+
+def main(nlines=500000):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        psetfile = os.path.join(tmpdir, 'stations.prn')
+        nvars = scale_fixture(os.path.join('data', '000005_19001999.prn'),
+                              nlines, psetfile)
+        gridfile = os.path.join(tmpdir, 'grid.out')
+        gr.GridArr(val=np.random.RandomState(0).normal(size=nlines)).save(
+            gridfile, header=True)
+
+        def skipped(path, nskip, reader):
+            with open(path, 'rb') as fid:
+                skip_lines(fid, nskip)
+                return reader(fid)
+
+        print 'Reading {0} lines'.format(nlines)
+        bench('PointSet',
+              lambda: skipped(psetfile, 2 + nvars, np.loadtxt),
+              lambda: skipped(psetfile, 2 + nvars, gr.read_table))
+        bench('GridArr',
+              lambda: skipped(gridfile, 3, np.loadtxt),
+              lambda: skipped(gridfile, 3, gr.read_table)[:, 0])
+        bench('chunked',
+              lambda: skipped(gridfile, 3, np.loadtxt),
+              lambda: np.concatenate(list(skipped(
+                  gridfile, 3, lambda fid: list(gr.read_table(
+                      fid, chunksize=100000)))))[:, 0])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
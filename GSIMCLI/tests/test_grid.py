@@ -3,11 +3,19 @@ Created on 02/03/2014
 
 @author: julio
 '''
+import StringIO
 import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
+import bottleneck as bn
 import numpy as np
+import numpy.testing as nt
+import pandas as pd
 import tools.grid as gr
+from tools.utils import filename_indexing, skip_lines
 
 
 class TestHeader(unittest.TestCase):
@@ -60,6 +68,648 @@ class TestHeader(unittest.TestCase):
         self.assertRaises(ValueError, np.loadtxt, out)
         self.assertRaises(ValueError, np.loadtxt, out, skiprows=6)
 
+    def test_read_table(self):
+        expected = np.loadtxt(self.pset_path_header, skiprows=7)
+        with open(self.pset_path_header, 'rb') as fid:
+            skip_lines(fid, 7)
+            values = gr.read_table(fid)
+        nt.assert_array_equal(values, expected)
+        chunks = list(gr.read_table(self.pset_path_noheader, chunksize=250))
+        self.assertEqual([chunk.shape[0] for chunk in chunks],
+                         [250, 250, 250, 150])
+        nt.assert_array_equal(np.vstack(chunks), expected)
+        pset = gr.PointSet()
+        pset.load(self.pset_path_header)
+        nt.assert_array_equal(pset.values.values, expected)
+        self.assertEqual(list(pset.values.columns),
+                         ['coordx', 'coordy', 'year', 'est_id', 'value'])
+
+    def test_read_table_empty(self):
+        with open(self.pset_path_header, 'rb') as fid:
+            fid.seek(0, os.SEEK_END)
+            self.assertEqual(gr.read_table(fid, 5).shape, (0, 5))
+
+    def test_write_table(self):
+        values = np.loadtxt(self.pset_path_noheader)
+        values[0, 0] = np.nan
+        for arr in [values, values[:, 2]]:
+            expected = StringIO.StringIO()
+            np.savetxt(expected, arr, fmt='%-10.6f')
+            out = StringIO.StringIO()
+            gr.write_table(out, arr, chunksize=7)
+            self.assertEqual(out.getvalue(), expected.getvalue())
+        out = StringIO.StringIO()
+        gr.write_table(out, values[1:3, 2:4], precision=1)
+        self.assertEqual(out.getvalue(), '1901.0 1.0\n1902.0 1.0\n')
+
+class TestPointSetStations(unittest.TestCase):
+
+    def test_station_rows(self):
+        pset = gr.PointSet()
+        pset.load('data/000005_19001999.prn')
+        pset.flush_varnames(['x', 'y', 'time', 'station', 'clim'])
+        self.assertEqual(pset.station_rows(1), slice(0, 100))
+        self.assertEqual(pset.station_rows(5), slice(400, 500))
+        self.assertEqual(pset.station_rows(10), slice(0, 0))
+        # stations out of order
+        pset.values = pd.DataFrame({'station': [3, 1, 1, 2, 3, 2, 2]})
+        nt.assert_array_equal(pset.station_rows(3), [0, 4])
+        self.assertEqual(pset.station_rows(1), slice(1, 3))
+        nt.assert_array_equal(pset.station_rows(2), [3, 5, 6])
+
+    def test_compact(self):
+        pset = gr.PointSet()
+        pset.load('data/000005_19001999.prn')
+        pset.flush_varnames(['x', 'y', 'time', 'station', 'clim'])
+        pset.values.loc[3, 'clim'] = pset.nodata
+        pset.values['name'] = 'st'
+        original = pset.values.copy()
+        pset.compact()
+        self.assertIsNone(pset._values)
+        dtypes = dict((var, dtype) for var, dtype, _ in pset._columns[1])
+        self.assertEqual(dtypes['station'], 'int32')
+        self.assertEqual(dtypes['clim'], 'float64')
+        self.assertEqual(dtypes['name'], 'category')
+        pd.util.testing.assert_frame_equal(pset.values, original)
+        # the values read from the file, and the missing data value, fit in
+        # float32 and are restored exactly
+        pset.compact(float32=['clim'])
+        values = pset.values
+        self.assertEqual(values.loc[3, 'clim'], pset.nodata)
+        pd.util.testing.assert_frame_equal(values, original)
+        pset.values.loc[4, 'clim'] = 1 / 3.0
+        pset.compact(float32=['clim'])
+        self.assertAlmostEqual(pset.values.loc[4, 'clim'], 1 / 3.0, 6)
+        self.assertFalse(hasattr(pset, '__dict__'))
+        pset.compact()
+        copy = pickle.loads(pickle.dumps(pset))
+        pd.util.testing.assert_frame_equal(copy.values, pset.values)
+
+
+class TestGridFilesStats(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.dims = [4, 3, 5]
+        cls.nsim = 7
+        cls.nodata = -999.9
+        cls.cells = np.prod(cls.dims)
+        rand = np.random.RandomState(1234)
+        cls.sims = rand.gamma(2, 10, (cls.nsim, cls.cells))
+        cls.sims[rand.rand(cls.nsim, cls.cells) < 0.1] = cls.nodata
+        cls.first = os.path.join(cls.tmpdir, 'test_sim.out')
+        for i in xrange(cls.nsim):
+            if i:
+                path = filename_indexing(cls.first, i + 1)
+            else:
+                path = cls.first
+            grid = gr.GridArr(val=cls.sims[i])
+            grid.save(path, header=True)
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def load_grids(self):
+        grids = gr.GridFiles()
+        grids.load(self.first, self.nsim, self.dims, [0, 0, 0], [1, 1, 1],
+                   self.nodata, headerin=3)
+        return grids
+
+    def expected(self, p=0.95):
+        """Node by node statistics, as in pandas and bottleneck."""
+        sims = np.loadtxt(self.first, skiprows=3)[np.newaxis, :]
+        for i in xrange(2, self.nsim + 1):
+            path = filename_indexing(self.first, i)
+            sims = np.vstack((sims, np.loadtxt(path, skiprows=3)))
+        sims[sims == self.nodata] = np.nan
+        perc = [pd.Series(sims[:, i]).quantile([(1 - p) / 2, 1 - (1 - p) / 2])
+                for i in xrange(self.cells)]
+        return {
+            'meanmap': bn.nanmean(sims, axis=0),
+            'medianmap': bn.nanmedian(sims, axis=0),
+            'skewmap': [pd.Series(sims[:, i]).skew()
+                        for i in xrange(self.cells)],
+            'varmap': bn.nanvar(sims, axis=0, ddof=1),
+            'stdmap': bn.nanstd(sims, axis=0, ddof=1),
+            'coefvarmap': (bn.nanstd(sims, axis=0, ddof=1) /
+                           bn.nanmean(sims, axis=0) * 100),
+            'percmap': np.array(perc),
+        }
+
+    def test_stats_blocks(self):
+        expected = self.expected()
+        for block in [1, 7, self.cells, 1000]:
+            grids = self.load_grids()
+            stats = grids.stats(lmean=True, lmed=True, lskew=True, lvar=True,
+                                lstd=True, lcoefvar=True, lperc=True,
+                                block=block)
+            grids.dump()
+            self.assertEqual(sorted(stats.keys()), sorted(expected.keys()))
+            for key, values in expected.iteritems():
+                nt.assert_allclose(stats[key].val, values, rtol=1e-10,
+                                   err_msg='{0} with block {1}'.
+                                   format(key, block))
+
+    def test_stats_cores(self):
+        expected = self.expected()
+        grids = self.load_grids()
+        try:
+            for indexed in [False, True]:
+                if indexed:
+                    grids.index(persist=False)
+                for cores in [2, 4]:
+                    stats = grids.stats(lmean=True, lmed=True, lskew=True,
+                                        lvar=True, lstd=True, lcoefvar=True,
+                                        lperc=True, block=5, cores=cores)
+                    self.assertEqual(sorted(stats.keys()),
+                                     sorted(expected.keys()))
+                    for key, values in expected.iteritems():
+                        nt.assert_allclose(stats[key].val, values,
+                                           rtol=1e-10, err_msg='{0} with {1} '
+                                           'cores'.format(key, cores))
+        finally:
+            grids.dump()
+
+    def test_stats_cores_indexed(self):
+        expected = self.expected()
+        grids = self.load_grids()
+
+        def skip_lines(*args):
+            raise AssertionError('a band read the file from its start')
+
+        # the workers are forked with the patched function
+        gr.skip_lines, original = skip_lines, gr.skip_lines
+        try:
+            stats = grids.stats(lmean=True, block=5, cores=3)
+        finally:
+            gr.skip_lines = original
+            grids.dump()
+        self.assertEqual(len(grids.indexes), self.nsim)
+        nt.assert_allclose(stats['meanmap'].val, expected['meanmap'],
+                           rtol=1e-10)
+
+    def test_file_pool(self):
+        expected = self.expected()
+        grids = gr.GridFiles()
+        grids.load(self.first, self.nsim, self.dims, [0, 0, 0], [1, 1, 1],
+                   self.nodata, headerin=3, maxfiles=2)
+        stats = grids.stats(lmean=True, lperc=True, block=7)
+        self.assertLessEqual(len(grids.pool.opened), 2)
+        nt.assert_allclose(stats['meanmap'].val, expected['meanmap'])
+        nt.assert_allclose(stats['percmap'].val, expected['percmap'])
+        vline = grids.stats_area([2, 1], tol=1, lmean=True)
+        self.assertLessEqual(len(grids.pool.opened), 2)
+        full = self.load_grids()
+        nt.assert_allclose(vline.values,
+                           full.stats_area([2, 1], tol=1, lmean=True).values)
+        full.dump()
+        grids.dump()
+        self.assertEqual(len(grids.pool.opened), 0)
+        self.assertTrue(all(grid.closed for grid in grids.files))
+
+    def test_stats_only_paths(self):
+        expected = self.expected(0.9)
+        grids = gr.GridFiles()
+        paths = [self.first] + [filename_indexing(self.first, i)
+                                for i in xrange(2, self.nsim + 1)]
+        grids.open_files(paths, self.dims, [0, 0, 0], [1, 1, 1], self.nodata,
+                         only_paths=True)
+        stats = grids.stats(lmean=True, lperc=True, p=0.9, block=4)
+        nt.assert_allclose(stats['meanmap'].val, expected['meanmap'])
+        nt.assert_allclose(stats['percmap'].val, expected['percmap'])
+
+    def test_stats_area(self):
+        sims = self.sims.copy().reshape((self.nsim, self.dims[2],
+                                         self.dims[1], self.dims[0]))
+        sims[sims == self.nodata] = np.nan
+        # node (2, 2) and its neighbours within a radius of 1 node
+        nodes = sims[:, :, [0, 1, 1, 1, 2], [1, 0, 1, 2, 1]]
+        arr = nodes.transpose((0, 2, 1)).reshape((-1, self.dims[2]))
+        grids = self.load_grids()
+        vline = grids.stats_area([1, 1], tol=1, lmean=True, lmed=True,
+                                 lperc=True)
+        nt.assert_allclose(vline.values['mean'], bn.nanmean(arr, axis=0),
+                           rtol=1e-5)
+        nt.assert_allclose(vline.values['median'], bn.nanmedian(arr, axis=0),
+                           rtol=1e-5)
+        nt.assert_allclose(vline.values[['lperc', 'rperc']],
+                           np.nanpercentile(arr, [2.5, 97.5], axis=0).T,
+                           rtol=1e-5)
+        self.assertEqual(list(vline.values['z']), range(self.dims[2]))
+        grids.dump()
+
+    def test_area_values_cache(self):
+        grids = self.load_grids()
+        values = grids.area_values([2, 1], tol=1)
+        self.assertFalse(values.flags.writeable)
+        vline = grids.stats_area([2, 1], tol=1, lmean=True, lperc=True)
+        # the files are not read again for the same location and radius
+        read_lines = grids._read_lines
+        grids._read_lines = None
+        self.assertIs(grids.area_values([2, 1], tol=1), values)
+        cached = grids.stats_area([2, 1], tol=1, lmean=True, lperc=True)
+        nt.assert_array_equal(cached.values, vline.values)
+        grids.stats_locations([(2, 1, 1)], lmed=True)
+        grids._read_lines = read_lines
+        self.assertIsNot(grids.area_values([2, 1], tol=0), values)
+        self.assertEqual(len(grids.cache), 2)
+        grids.dump()
+        self.assertEqual(grids.cache, dict())
+
+    def test_stats_locations(self):
+        locs = [(2, 1, 1), (0, 0, 0), (3, 2, 2), (2, 1, 0)]
+        flags = dict(lmean=True, lmed=True, lskew=True, lperc=True)
+        grids = self.load_grids()
+        expected = [grids.stats_area(loc[:2], loc[2], **flags)
+                    for loc in locs]
+        results = grids.stats_locations(locs, **flags)
+        self.assertEqual(len(results), len(locs))
+        for vline, result in zip(expected, results):
+            self.assertEqual(result.name, vline.name)
+            nt.assert_allclose(result.values, vline.values)
+        grids.dump()
+
+    def test_pack_cube(self):
+        grids = self.load_grids()
+        expected = grids.stats(lmean=True, lvar=True, lperc=True)
+        vline = grids.stats_area([2, 1], tol=1, lmean=True, lskew=True)
+        path = grids.pack()
+        self.assertEqual(path, os.path.join(self.tmpdir, 'test_sim.npy'))
+        grids.dump()
+        try:
+            cubegrids = self.load_grids()
+            self.assertIsNotNone(cubegrids.cube)
+            self.assertEqual(cubegrids.cube.shape,
+                             (self.nsim, self.dims[2], self.dims[1],
+                              self.dims[0]))
+            stats = cubegrids.stats(lmean=True, lvar=True, lperc=True)
+            for key in expected:
+                nt.assert_allclose(stats[key].val, expected[key].val,
+                                   rtol=1e-5)
+            cubevline = cubegrids.stats_area([2, 1], tol=1, lmean=True,
+                                             lskew=True)
+            nt.assert_allclose(cubevline.values, vline.values, rtol=1e-5)
+            cubegrids.dump()
+        finally:
+            os.remove(path)
+            os.remove(os.path.join(self.tmpdir, 'test_sim.json'))
+
+    def test_stats_area_indexed(self):
+        grids = self.load_grids()
+        vline = grids.stats_area([2, 1], tol=1, lmean=True, lperc=True)
+        grids.index()
+        try:
+            self.assertTrue(os.path.isfile(self.first + '.idx'))
+            indexed = grids.stats_area([2, 1], tol=1, lmean=True, lperc=True)
+            nt.assert_allclose(indexed.values, vline.values)
+        finally:
+            grids.dump()
+            for i in xrange(1, self.nsim + 1):
+                if i > 1:
+                    os.remove(filename_indexing(self.first, i) + '.idx')
+                else:
+                    os.remove(self.first + '.idx')
+
+    def paths(self):
+        return [self.first] + [filename_indexing(self.first, i)
+                               for i in xrange(2, self.nsim + 1)]
+
+    def test_stream_area(self):
+        grids = self.load_grids()
+        flags = dict(lmean=True, lmed=True, lskew=True, lvar=True, lstd=True,
+                     lcoefvar=True, lperc=True)
+        vline = grids.stats_area([2, 1], tol=1, **flags)
+        grids.dump()
+        stream = gr.GridStream(self.dims, [0, 0, 0], [1, 1, 1], self.nodata,
+                               headerin=3, loc=[2, 1], tol=1)
+        for path in self.paths():
+            stream.ingest(path)
+        self.assertEqual(stream.nfiles, self.nsim)
+        svline = stream.stats_area([2, 1], tol=1, **flags)
+        self.assertEqual(list(svline.values.columns),
+                         list(vline.values.columns))
+        nt.assert_allclose(svline.values, vline.values, rtol=1e-10)
+        self.assertRaises(ValueError, stream.stats_area, [0, 0], 1)
+        self.assertRaises(ValueError, stream.stats, lmean=True)
+
+    def test_arrays(self):
+        expected = self.expected()
+        flags = dict(lmean=True, lmed=True, lskew=True, lvar=True, lstd=True,
+                     lcoefvar=True, lperc=True)
+        grids = self.load_grids()
+        vline = grids.stats_area([2, 1], tol=1, **flags)
+        grids.dump()
+        # the same values that were written
+        sims = [np.loadtxt(path, skiprows=3) for path in self.paths()]
+        for shared in [False, True]:
+            arrays = gr.GridArrays(self.dims, [0, 0, 0], [1, 1, 1],
+                                   self.nodata, nsim=self.nsim, shared=shared)
+            for values in sims:
+                arrays.add(values)
+            self.assertEqual(arrays.nfiles, self.nsim)
+            avline = arrays.stats_area([2, 1], tol=1, **flags)
+            nt.assert_allclose(avline.values, vline.values, rtol=1e-10)
+            stats = arrays.stats(cores=2, **flags)
+            for key, values in expected.iteritems():
+                nt.assert_allclose(stats[key].val, values, rtol=1e-10,
+                                   err_msg=key)
+            shm = arrays.shared
+            arrays.dump()
+            self.assertEqual(arrays.nfiles, 0)
+            if shared:
+                self.assertFalse(os.path.exists(shm))
+        self.assertRaises(ValueError, gr.GridArrays, self.dims, [0, 0, 0],
+                          [1, 1, 1], self.nodata, shared=True)
+
+    def test_arrays_export(self):
+        arrays = gr.GridArrays(self.dims, [0, 0, 0], [1, 1, 1], self.nodata)
+        for values in self.sims[:3]:
+            arrays.add(values)
+        first = os.path.join(self.tmpdir, 'export_sim.out')
+        arrays.export(first)
+        self.assertEqual(len(arrays.files), 3)
+        grids = gr.GridFiles()
+        grids.load(first, 3, self.dims, [0, 0, 0], [1, 1, 1], self.nodata,
+                   headerin=0)
+        nt.assert_allclose(grids.area_values([1, 2], 0),
+                           arrays.area_values([1, 2], 0))
+        grids.dump()
+        arrays.purge()
+        self.assertFalse(os.path.exists(first))
+
+    def test_stream_grid(self):
+        expected = self.expected()
+        stream = gr.GridStream(self.dims, [0, 0, 0], [1, 1, 1], self.nodata,
+                               headerin=3)
+        for path in self.paths():
+            stream.ingest(path)
+        stats = stream.stats(lmean=True, lskew=True, lvar=True, lstd=True,
+                             lcoefvar=True)
+        self.assertEqual(len(stats), 5)
+        for key, values in stats.iteritems():
+            nt.assert_allclose(values.val, expected[key], rtol=1e-10,
+                               err_msg=key)
+        # the same realisations, given as arrays
+        arrays = gr.GridStream(self.dims, [0, 0, 0], [1, 1, 1], self.nodata)
+        for values in self.sims:
+            arrays.add(values)
+        for key, values in arrays.stats(lmean=True, lstd=True).iteritems():
+            nt.assert_allclose(values.val, stats[key].val, err_msg=key)
+        self.assertRaises(ValueError, arrays.add, self.sims[0][:-1])
+        self.assertRaises(ValueError, stream.stats, lmed=True)
+
+    def test_stats_sketch(self):
+        grids = self.load_grids()
+        expected = grids.stats(lperc=True, p=0.9)
+        stats = grids.stats(lperc=True, p=0.9, sketch=50)
+        nt.assert_allclose(stats['percmap'].val, expected['percmap'].val,
+                           rtol=1e-10)
+        vline = grids.stats_area([2, 1], tol=1, lperc=True)
+        svline = grids.stats_area([2, 1], tol=1, lperc=True, sketch=50)
+        nt.assert_allclose(svline.values, vline.values, rtol=1e-10)
+        grids.dump()
+
+    def test_stream_sketch(self):
+        expected = self.expected()
+        stream = gr.GridStream(self.dims, [0, 0, 0], [1, 1, 1], self.nodata,
+                               headerin=3, sketch=50)
+        for path in self.paths():
+            stream.ingest(path)
+        stats = stream.stats(lmed=True, lperc=True)
+        nt.assert_allclose(stats['medianmap'].val, expected['medianmap'],
+                           rtol=1e-10)
+        nt.assert_allclose(stats['percmap'].val, expected['percmap'],
+                           rtol=1e-10)
+
+class TestRunningStats(unittest.TestCase):
+
+    def test_merge(self):
+        rand = np.random.RandomState(42)
+        arr = rand.normal(5, 2, (30, 6))
+        arr[rand.rand(30, 6) < 0.2] = np.nan
+        arr[:, 0] = np.nan
+        first = gr.RunningStats(6)
+        second = gr.RunningStats(6)
+        for values in arr[:12]:
+            first.update(values)
+        for values in arr[12:]:
+            second.update(values)
+        first.merge(second)
+        expected = gr.block_stats(arr.copy(), lmean=True, lskew=True,
+                                  lvar=True, lstd=True, lcoefvar=True)
+        results = first.results(lmean=True, lskew=True, lvar=True, lstd=True,
+                                lcoefvar=True)
+        nt.assert_array_equal(first.count, (~np.isnan(arr)).sum(axis=0))
+        for key in expected:
+            nt.assert_allclose(results[key], expected[key], rtol=1e-10,
+                               err_msg=key)
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_exact(self):
+        rand = np.random.RandomState(3)
+        arr = rand.normal(size=(150, 20))
+        arr[rand.rand(150, 20) < 0.2] = np.nan
+        arr[:, 0] = np.nan
+        sketch = gr.QuantileSketch(20, k=200)
+        for values in arr:
+            sketch.update(values)
+        expected = np.nanpercentile(arr[:, 1:], [2.5, 50, 97.5], axis=0).T
+        result = sketch.quantiles([0.025, 0.5, 0.975])
+        nt.assert_allclose(result[1:], expected, rtol=1e-10)
+        self.assertTrue(np.isnan(result[0]).all())
+        self.assertEqual(sketch.quantiles(0.5).shape, (20, ))
+
+    def test_merge(self):
+        rand = np.random.RandomState(4)
+        arr = rand.normal(size=(4000, 30))
+        first = gr.QuantileSketch(30, k=200, seed=1)
+        second = gr.QuantileSketch(30, k=200, seed=2)
+        for values in arr[:2500]:
+            first.update(values)
+        for values in arr[2500:]:
+            second.update(values)
+        first.merge(second)
+        self.assertGreater(len(first.levels), 1)
+        for q in [0.025, 0.5, 0.975]:
+            ranks = (arr < first.quantiles(q)).mean(axis=0)
+            self.assertLess(np.abs(ranks - q).max(), 0.02)
+
+class TestFilePool(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.paths = list()
+        for i in xrange(3):
+            path = os.path.join(cls.tmpdir, 'file{0}.txt'.format(i))
+            with open(path, 'w') as fid:
+                fid.writelines('{0} {1}\n'.format(i, line)
+                               for line in xrange(5))
+            cls.paths.append(path)
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_eviction(self):
+        pool = gr.FilePool(maxfiles=2)
+        files = [pool.open(path) for path in self.paths]
+        self.assertEqual(len(pool.opened), 0)
+        for line in xrange(5):
+            for i, fid in enumerate(files):
+                self.assertEqual(fid.readline(),
+                                 '{0} {1}\n'.format(i, line))
+                self.assertLessEqual(len(pool.opened), 2)
+        # the least recently used file was closed, keeping its position
+        self.assertIsNone(files[0].fid)
+        self.assertEqual(files[0].tell(), 20)
+        files[0].seek(4)
+        self.assertIsNone(files[0].fid)
+        self.assertEqual(files[0].readline(), '0 1\n')
+        pool.close()
+        self.assertEqual(len(pool.opened), 0)
+        self.assertRaises(IOError, pool.open,
+                          os.path.join(self.tmpdir, 'missing.txt'))
+
+class TestLineIndex(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.varwidth = os.path.join(cls.tmpdir, 'varwidth.out')
+        cls.fixwidth = os.path.join(cls.tmpdir, 'fixwidth.out')
+        cls.values = np.arange(24) * 10.5 - 3
+        with open(cls.varwidth, 'wb') as fid:
+            fid.write('varwidth\n1\nvar\n')
+            fid.write('\n'.join(map(str, cls.values)) + '\n')
+        grid = gr.GridArr(dx=4, dy=3, dz=2, val=cls.values)
+        grid.save(cls.fixwidth, header=True)
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def read(self, path, index, lines):
+        with open(path, 'rb') as fid:
+            return gr.read_indexed(fid, index, lines)
+
+    def test_variable_width(self):
+        index = gr.LineIndex(self.varwidth, header=3)
+        self.assertIsNone(index.width)
+        self.assertEqual(index.nlines, 24)
+        lines = [24, 1, 7, 13]
+        nt.assert_allclose(self.read(self.varwidth, index, lines),
+                           self.values[np.array(lines) - 1])
+
+    def test_fixed_width(self):
+        index = gr.LineIndex(self.fixwidth, header=3)
+        self.assertEqual(index.width, 11)
+        lines = [2, 24, 5]
+        nt.assert_allclose(self.read(self.fixwidth, index, lines),
+                           self.values[np.array(lines) - 1])
+        computed = gr.LineIndex(self.fixwidth, header=3, fixed_width=11)
+        nt.assert_array_equal(computed.offset(lines), index.offset(lines))
+
+    def test_persist_invalidate(self):
+        path = os.path.join(self.tmpdir, 'persist.out')
+        shutil.copyfile(self.varwidth, path)
+        index = gr.line_index(path, header=3)
+        self.assertTrue(os.path.isfile(path + '.idx'))
+        reused = gr.line_index(path, header=3)
+        nt.assert_array_equal(reused.offsets, index.offsets)
+        with open(path, 'ab') as fid:
+            fid.write('1000.5\n')
+        self.assertFalse(reused.is_valid())
+        rebuilt = gr.line_index(path, header=3)
+        self.assertEqual(rebuilt.nlines, 25)
+
+    def test_drill_lazy(self):
+        grid = gr.GridArr()
+        grid.load(self.varwidth, (4, 3, 2), (0, 0, 0), (1, 1, 1))
+        well = grid.drill((1, 2))
+        nt.assert_allclose(well.values['var'], self.values[[9, 21]])
+        lazy = gr.GridArr()
+        lazy.load(self.varwidth, (4, 3, 2), (0, 0, 0), (1, 1, 1), lazy=True)
+        self.assertIsNone(lazy.val)
+        nt.assert_allclose(lazy.drill((1, 2)).values, well.values)
+
+
+
+class TestSimulationCache(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        rand = np.random.RandomState(7)
+        cls.sims = rand.normal(size=(3, 4 * 3 * 2))
+        cls.sims[:, 5] = -999.9
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def store(self, cache, key):
+        writer = cache.writer(key, 3, [4, 3, 2], -999.9)
+        for i, values in enumerate(self.sims):
+            writer.add(i + 1, values)
+        writer.commit()
+
+    def test_hit_miss(self):
+        cache = gr.SimulationCache(os.path.join(self.tmpdir, 'hits'))
+        self.assertIsNone(cache.get('a'))
+        # incomplete sets are not kept
+        writer = cache.writer('a', 3, [4, 3, 2], -999.9)
+        writer.add(1, self.sims[0])
+        writer.commit()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(os.listdir(cache.folder), [])
+        self.store(cache, 'a')
+        cube = cache.get('a')
+        self.assertEqual(cube.shape, (3, 2, 3, 4))
+        self.assertTrue(np.isnan(cube[:, 0, 1, 1]).all())
+        replayed = list()
+        cache.replay(cube, lambda simnum, values: replayed.append(values),
+                     -999.9)
+        nt.assert_array_equal(replayed, self.sims)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertIn('1 hits, 2 misses', cache.report())
+
+    def test_evict(self):
+        cache = gr.SimulationCache(os.path.join(self.tmpdir, 'lru'))
+        for key in 'abc':
+            self.store(cache, key)
+        os.utime(cache.path('a'), (1, 1))
+        os.utime(cache.path('b'), (2, 2))
+        cache.get('a')
+        setsize = os.path.getsize(cache.path('a'))
+        cache.maxsize = 2 * setsize
+        cache.evict()
+        self.assertEqual(sorted(os.listdir(cache.folder)), ['a.npy', 'c.npy'])
+        self.assertEqual(cache.evictions, 1)
+        # the new set is kept, even if it is larger than the cache
+        cache.maxsize = 1
+        self.store(cache, 'd')
+        self.assertEqual(os.listdir(cache.folder), ['d.npy'])
+
+    def test_read_only(self):
+        cache = gr.SimulationCache(os.path.join(self.tmpdir, 'read_only'))
+        self.store(cache, 'a')
+
+        def utime(path, times):
+            raise OSError(13, 'Permission denied', path)
+
+        gr.os.utime, original = utime, gr.os.utime
+        try:
+            cube = cache.get('a')
+        finally:
+            gr.os.utime = original
+        self.assertEqual(cube.shape, (3, 2, 3, 4))
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
 
 if __name__ == "__main__":
     import nose
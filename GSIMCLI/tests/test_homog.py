@@ -0,0 +1,132 @@
+'''
+Created on 17/10/2026
+
+@author: julio
+'''
+import unittest
+
+import numpy as np
+
+import parsers.dss as pdss
+import tools.grid as gr
+import tools.homog as hmg
+
+
+class TestDetect(unittest.TestCase):
+
+    def setUp(self):
+        # the second station keeps its rows labels, from 4 to 7
+        values = [[x, 0, 2000 + t, station, value]
+                  for x, station, series in [(0, 1, [0, 0, 0, 0]),
+                                             (1, 2, [0, 10, -10, 0.1])]
+                  for t, value in enumerate(series)]
+        stations = gr.PointSet(nodata=-999.9, nvars=5,
+                               varnames=['x', 'y', 'time', 'station', 'clim'],
+                               values=values)
+        self.candidate = hmg.take_candidate(stations, 2)[0]
+        self.grids = gr.GridStream([2, 1, 4], [0, 0, 2000], [1, 1, 1],
+                                   -999.9, loc=[1, 0], tol=0)
+        for sim in np.random.RandomState(3).normal(size=(20, 2 * 4)):
+            self.grids.add(sim)
+
+    def test_percentile(self):
+        homogenised, detected, missing = hmg.detect(
+            self.grids, self.candidate, method='percentile', percentile=0.95,
+            optional_stats={'lperc': True})
+        self.assertEqual((detected, missing), (2, 0))
+        perc = self.grids.stats_area([1, 0], lperc=True).values
+        np.testing.assert_allclose(homogenised.values['clim'],
+                                   [0, perc['rperc'].iloc[1],
+                                    perc['lperc'].iloc[2], 0.1])
+        self.assertEqual(homogenised.values['pdet'].iloc[1],
+                         perc['rperc'].iloc[1])
+
+
+
+class TestDetectionMonitor(unittest.TestCase):
+
+    def setUp(self):
+        # detected, inside, at the lower percentile, missing
+        self.obs = gr.PointSet(nodata=-999.9, nvars=5,
+                               varnames=['x', 'y', 'time', 'station', 'clim'],
+                               values=[[1, 1, 2000, 1, 10], [1, 1, 2001, 1, 0],
+                                       [1, 1, 2002, 1, -0.6745],
+                                       [1, 1, 2003, 1, -999.9]])
+        self.sims = np.random.RandomState(5).normal(size=(40, 3 * 3 * 4))
+
+    def monitor(self, tol):
+        return hmg.DetectionMonitor(self.obs, [3, 3, 4], [0, 0, 2000],
+                                    [1, 1, 1], -999.9, rad=1.5, prob=0.5,
+                                    batch=20, tol=tol)
+
+    def test_undecided(self):
+        monitor = self.monitor(tol=0)
+        stable = [monitor.add(values) for values in self.sims]
+        self.assertFalse(any(stable))
+        self.assertEqual(monitor.nsim, 40)
+        self.assertEqual([check['nsim'] for check in monitor.history],
+                         [20, 40])
+        self.assertEqual([check['undecided'] for check in monitor.history],
+                         [1, 1])
+        self.assertEqual(monitor.history[0]['flipped'], 0)
+
+    def test_stable(self):
+        monitor = self.monitor(tol=1)
+        for values in self.sims[:19]:
+            self.assertFalse(monitor.add(values))
+        self.assertTrue(monitor.add(self.sims[19]))
+        self.assertEqual(len(monitor.history), 1)
+        self.assertLess(monitor.history[0]['mean_se'], 0.5)
+
+
+class TestKrigingPDF(unittest.TestCase):
+
+    def setUp(self):
+        self.par = pdss.DssParam()
+        self.par.columns_set = [1, 2, 3, 5, 0, 0]
+        self.par.xx = [3, 0, 1]
+        self.par.yy = [1, 0, 1]
+        self.par.zz = [4, 2000, 1]
+        self.par.nstruct = [1, 0]
+        self.par.struct = [[1, 1, 0, 0, 0]]
+        self.par.ranges = [[10, 10, 1]]
+        self.par.srchradius = [10, 10, 1]
+        self.par.nsamples = [1, 8]
+        self.par.krig = [0, 0, 7.42]
+        values = [[x, 0, 2000 + t, station, value]
+                  for x, station, series in [(0, 1, [1, 2, 3, -999.9]),
+                                             (2, 2, [2, 3, 4, 5])]
+                  for t, value in enumerate(series)]
+        self.refs = gr.PointSet(nodata=-999.9, nvars=5,
+                                varnames=['x', 'y', 'time', 'station', 'clim'],
+                                values=values)
+
+    def test_estimate(self):
+        engine = hmg.KrigingPDF(self.par, self.refs, -999.9)
+        estimates, variances = engine.estimate([0, 0])
+        np.testing.assert_allclose(estimates[:3], [1, 2, 3])
+        np.testing.assert_allclose(variances[:3], 0, atol=1e-10)
+        self.assertGreater(variances[3], 0)
+        # beyond the search radius, the mean and the variance of the data
+        estimates, variances = engine.estimate([50, 0])
+        np.testing.assert_allclose(estimates, engine.mean)
+        np.testing.assert_allclose(variances, engine.data.var(ddof=1))
+
+    def test_detect(self):
+        obs = gr.PointSet(nodata=-999.9, nvars=5,
+                          varnames=['x', 'y', 'time', 'station', 'clim'],
+                          values=[[0, 0, 2000 + t, 3, value] for t, value
+                                  in enumerate([1, 9, 3, -999.9])])
+        engine = hmg.KrigingPDF(self.par, self.refs, -999.9)
+        homogenised, detected, missing = hmg.detect(engine, obs,
+                                                    optional_stats={
+                                                        'lstd': True})
+        self.assertEqual((detected, missing), (1, 1))
+        estimate = engine.estimate([0, 0])[0][3]
+        np.testing.assert_allclose(homogenised.values['clim'],
+                                   [1, 2, 3, estimate])
+        self.assertIn('std', homogenised.varnames)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,529 @@
+'''
+Created on 17/10/2026
+
+@author: julio
+'''
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import launchers.dss as dss
+import launchers.method_classic as mc
+import parsers.dss as pdss
+import tools.grid as gr
+
+
+# take longer for the first realization, identified by its output file, hang
+# once if there is a file named "hang", and always fail the realization number
+# written in a file named "fail"
+FAKE_DSS = """
+import os, re, sys, time
+output = [line for line in open(sys.argv[1]).read().splitlines()
+          if line.endswith('.out')][0]
+number = re.findall(r'(\\d+)\\.out$', output)
+simnum = int(number[0]) if number else 1
+hang = os.path.join(sys.argv[2], 'hang')
+if os.path.exists(hang):
+    os.remove(hang)
+    time.sleep(30)
+fail = os.path.join(sys.argv[2], 'fail')
+if os.path.exists(fail) and open(fail).read() == str(simnum):
+    print 'DSS crashed'
+    sys.exit(1)
+print 'realization number  %d' % simnum
+print 'progress: 50'
+sys.stdout.flush()
+time.sleep(1.0 if simnum == 1 else 0.1)
+print 'elapsed time  0.1 s'
+"""
+
+
+def small_network():
+    """Three stations with six years of data, in a grid of 4 x 3 nodes, and
+    the DSS parameters to simulate them.
+
+    """
+    rand = np.random.RandomState(11)
+    values = [[x, y, 2000 + t, station, rand.normal(10, 1) + shift * (t > 2)]
+              for x, y, station, shift in [(0, 0, 1, 0), (3, 0, 2, 4),
+                                           (1, 2, 3, 0)]
+              for t in xrange(6)]
+    stations = gr.PointSet(nodata=-999.9, nvars=5,
+                           varnames=['x', 'y', 'time', 'station', 'clim'],
+                           values=values)
+    par = pdss.DssParam()
+    par.columns_set = [1, 2, 3, 5, 0, 0]
+    par.xx = [4, 0, 1]
+    par.yy = [3, 0, 1]
+    par.zz = [6, 2000, 1]
+    par.nstruct = [1, 0]
+    par.struct = [[1, 1, 0, 0, 0]]
+    par.ranges = [[4, 4, 2]]
+    par.srchradius = [4, 4, 2]
+    par.nsamples = [1, 8]
+    par.maxsim = 8
+    par.krig = [0, 0, 7.42]
+    par.nsim = 5
+    return stations, par
+
+
+class FailingBackend(dss.SimulationBackend):
+    in_memory = True
+
+    def simulate(self, par, data, nsim, callback=None, abort=None):
+        raise dss.SimulationFailed([1])
+
+
+class TestDssScheduler(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.cwd = os.getcwd()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.exe = os.path.join(cls.tmpdir, 'DSS.exe')
+        open(cls.exe, 'w').close()
+        script = os.path.join(cls.tmpdir, 'fake_dss.py')
+        with open(script, 'w') as fid:
+            fid.write(FAKE_DSS)
+        cls.dss_command = dss.dss_command
+        dss.dss_command = lambda exe, par: [sys.executable, script, par,
+                                            cls.tmpdir]
+
+    @classmethod
+    def teardown_class(cls):
+        dss.dss_command = cls.dss_command
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.tmpdir)
+
+    def dssenv(self, workspaces=None):
+        par = pdss.DssParam()
+        par.path = os.path.join(self.tmpdir, 'DSSim.PAR')
+        par.struct = [par.struct]
+        par.ranges = [par.ranges]
+        return dss.DssEnvironment(self.exe, par, 'sim.out', 1, workspaces)
+
+    def test_no_barrier(self):
+        finished = list()
+        scheduler = dss.DssScheduler(cores=2)
+        dssenv = self.dssenv()
+        scheduler.submit(dssenv, 6, callback=finished.append)
+        start = time.time()
+        timings = scheduler.run(interval=0.01)
+        wall = time.time() - start
+        dssenv.purge()
+        self.assertEqual(sorted(finished), range(1, 7))
+        self.assertEqual(len(timings), 6)
+        self.assertTrue(all(job['exitcode'] == 0 for job in timings))
+        # the slot of the slow realization runs no other
+        slow = [job['slot'] for job in timings if job['simnum'] == 1]
+        self.assertEqual([job['simnum'] for job in timings
+                          if job['slot'] == slow[0]], [1])
+        # one batch of two at a time would take at least 1.0 + 2 * 0.1
+        self.assertLess(wall, 1.2)
+        self.assertEqual(scheduler.progress(),
+                         {'queued': 0, 'running': 0, 'finished': 6,
+                          'failed': 0, 'done': 1.0})
+
+    def test_abort(self):
+        scheduler = dss.DssScheduler(cores=2)
+        dssenv = self.dssenv()
+        scheduler.submit(dssenv, 4)
+        with self.assertRaises(SystemError):
+            scheduler.run(abort=lambda: bool(scheduler.running))
+        self.assertFalse(scheduler.queue)
+        self.assertFalse(scheduler.running)
+        dssenv.purge()
+
+    def test_timeout(self):
+        dbg = os.path.join(self.tmpdir, 'dss.dbg')
+        for retries in (1, 0):
+            finished = list()
+            open(os.path.join(self.tmpdir, 'hang'), 'w').close()
+            scheduler = dss.DssScheduler(cores=1, dbg=dbg, timeout=0.5,
+                                         retries=retries)
+            dssenv = self.dssenv()
+            dssenv.simnum = 2
+            scheduler.submit(dssenv, 1, callback=finished.append)
+            start = time.time()
+            if retries:
+                timings = scheduler.run(interval=0.01)
+            else:
+                self.assertRaises(dss.SimulationFailed, scheduler.run,
+                                  interval=0.01)
+                timings = scheduler.timings
+            self.assertLess(time.time() - start, 5)
+            self.assertEqual(timings[0]['attempts'], retries + 1)
+            self.assertEqual(timings[0]['exitcode'], 0 if retries else None)
+            self.assertEqual(finished, [2] if retries else [])
+            dssenv.purge()
+        with open(dbg) as fid:
+            lines = fid.readlines()
+        os.remove(dbg)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].strip().endswith('[1] realization number  2'))
+
+    def test_failed(self):
+        with open(os.path.join(self.tmpdir, 'fail'), 'w') as fid:
+            fid.write('2')
+        finished = list()
+        scheduler = dss.DssScheduler(cores=2, retries=2)
+        dssenv = self.dssenv()
+        scheduler.submit(dssenv, 3, callback=finished.append)
+        try:
+            with self.assertRaises(dss.SimulationFailed) as failure:
+                scheduler.run(interval=0.01)
+        finally:
+            os.remove(os.path.join(self.tmpdir, 'fail'))
+            dssenv.purge()
+        self.assertEqual(failure.exception.simnums, [2])
+        self.assertEqual(sorted(finished), [1, 3])
+        failed = [job for job in scheduler.timings if job['simnum'] == 2]
+        self.assertEqual([(job['exitcode'], job['attempts'])
+                          for job in failed], [(1, 3)])
+
+    def test_write_par(self):
+        dssenv = self.dssenv()
+        seed = dssenv.par.seed
+        expected = os.path.join(self.tmpdir, 'expected.par')
+        for i in xrange(3):
+            exe, par = dssenv.new()
+            dssenv.par.save_old(expected)
+            dssenv.reset_par_path()
+            with open(par) as fid, open(expected) as fexp:
+                self.assertEqual(fid.read(), fexp.read())
+            # the same seeds as NumpyDss, whatever the number of cores
+            written = pdss.DssParam()
+            written.load_old(par)
+            self.assertEqual(written.seed, seed + 2 * (i + 1))
+        dssenv.purge()
+
+    def test_workspaces(self):
+        workspaces = dss.DssWorkspaces(self.exe, self.tmpdir, 2)
+        slots = [list(slot) for slot in workspaces.slots]
+        self.assertTrue(all(os.path.isfile(slot[1]) for slot in slots))
+        scheduler = dss.DssScheduler(cores=2)
+        for i in xrange(2):
+            # e.g., two candidates
+            dssenv = self.dssenv(workspaces)
+            scheduler.submit(dssenv, 3)
+            scheduler.run(interval=0.01)
+            self.assertEqual(sorted(set(env[0] for env in dssenv.envs)),
+                             [slot[0] for slot in slots])
+            self.assertTrue(os.path.isdir(workspaces.tempdir))
+        self.assertEqual(workspaces.slots, slots)
+        self.assertTrue(all(job['exitcode'] == 0
+                            for job in scheduler.timings))
+        workspaces.purge()
+        self.assertFalse(os.path.exists(workspaces.tempdir))
+        with self.assertRaises(ValueError):
+            par = pdss.DssParam()
+            par.path = os.path.join(self.tmpdir, 'other', 'DSSim.PAR')
+            dss.DssEnvironment(self.exe, par, workspaces=workspaces)
+
+
+
+def fake_run_par(par_path, print_status=False, resume=False, **kwargs):
+    """Take some time, and return the job name and the given cores."""
+    time.sleep(0.3)
+    return [par_path, kwargs['cores']]
+
+
+def simulating_run_par(par_path, print_status=False, resume=False, **kwargs):
+    """Simulate the small network with the given backend, and return the
+    job name, the backend cores and the realizations received."""
+    stations, par = small_network()
+    received = list()
+    kwargs['backend'].simulate(par, stations, 3,
+                               callback=lambda simnum, values:
+                               received.append(simnum))
+    return [par_path, kwargs['backend'].cores, received]
+
+
+class TestRunJobs(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.run_par = mc.run_par
+        cls.merge_output = mc.hmg.merge_output
+        mc.run_par = fake_run_par
+
+    @classmethod
+    def teardown_class(cls):
+        mc.run_par = cls.run_par
+        mc.hmg.merge_output = cls.merge_output
+
+    def test_run_jobs(self):
+        merged = list()
+        mc.hmg.merge_output = lambda results, path: merged.append((path,
+                                                                   results))
+        jobs = [{'par': name, 'status': [('decade', name)]}
+                for name in ['a1', 'a2', 'b1', 'b2']]
+        merges = [('a.xls', [0, 1]), ('b.xls', [2, 3])]
+        start = time.time()
+        results = mc.run_jobs(jobs, merges, 2, cores=4)
+        wall = time.time() - start
+        self.assertEqual(results, [['a1', 2], ['a2', 2], ['b1', 2],
+                                   ['b2', 2]])
+        self.assertEqual(sorted(merged), [('a.xls', results[:2]),
+                                          ('b.xls', results[2:])])
+        # two at a time, instead of four one after the other
+        self.assertLess(wall, 1.1)
+        # one at a time, with every core
+        merged[:] = list()
+        self.assertEqual(mc.run_jobs(jobs[:2], merges[:1], cores=4),
+                         [['a1', 4], ['a2', 4]])
+        self.assertEqual(merged, [('a.xls', [['a1', 4], ['a2', 4]])])
+
+    def test_run_jobs_backend(self):
+        # the jobs may start the processes of the backend
+        mc.run_par = simulating_run_par
+        try:
+            jobs = [{'par': name, 'status': list()} for name in ['a', 'b']]
+            self.assertEqual(mc.run_jobs(jobs, njobs=2, cores=8,
+                                         backend=dss.NumpyDss(cores=2)),
+                             [['a', 2, [1, 2, 3]], ['b', 2, [1, 2, 3]]])
+            # no more than each job's share of the cores
+            self.assertEqual(mc.run_jobs(jobs, njobs=2, cores=2,
+                                         backend=dss.NumpyDss(cores=2)),
+                             [['a', 1, [1, 2, 3]], ['b', 1, [1, 2, 3]]])
+        finally:
+            mc.run_par = fake_run_par
+
+    def test_run_jobs_error(self):
+        mc.run_par = simulating_run_par
+        try:
+            jobs = [{'par': name, 'status': list()} for name in ['a', 'b']]
+            self.assertRaises(dss.SimulationFailed, mc.run_jobs, jobs,
+                              njobs=2, backend=FailingBackend())
+        finally:
+            mc.run_par = fake_run_par
+
+
+class TestSimulationKey(unittest.TestCase):
+
+    def test_key(self):
+        par = pdss.DssParam()
+        data = gr.PointSet(nodata=-999.9, nvars=4,
+                           varnames=['x', 'y', 'time', 'clim'],
+                           values=[[1, 2, 1990, 3.5], [2, 1, 1990, 4.25]])
+        key = dss.simulation_key(par, data, 10, 'NumpyDss 1')
+        # the files paths do not change the simulation
+        par.update(['datapath', 'output'], ['refs.prn', 'other.out'])
+        self.assertEqual(dss.simulation_key(par, data, 10, 'NumpyDss 1'), key)
+        self.assertNotEqual(dss.simulation_key(par, data, 20, 'NumpyDss 1'),
+                            key)
+        self.assertNotEqual(dss.simulation_key(par, data, 10, 'DssBinary'),
+                            key)
+        par.seed += 1
+        self.assertNotEqual(dss.simulation_key(par, data, 10, 'NumpyDss 1'),
+                            key)
+        par.seed -= 1
+        data.values.iloc[1, 3] = 4.5
+        self.assertNotEqual(dss.simulation_key(par, data, 10, 'NumpyDss 1'),
+                            key)
+
+
+class TestGridWindow(unittest.TestCase):
+
+    def test_window(self):
+        par = pdss.DssParam()
+        par.xx = [50, 100, 10]
+        par.yy = [40, 200, 10]
+        par.ranges = [[30, 20, 1]]
+        par.srchradius = [25, 25, 1]
+        xx, yy = dss.grid_window(par, [300, 400])
+        self.assertEqual(xx, [7, 270, 10])
+        self.assertEqual(yy, [7, 370, 10])
+        # clipped to the grid, and widened by the tolerance radius
+        xx, yy = dss.grid_window(par, [100, 590], rad=1)
+        self.assertEqual(xx, [5, 100, 10])
+        self.assertEqual(yy, [5, 550, 10])
+        self.assertRaises(ValueError, dss.grid_window, par, [1000, 400])
+
+    def test_crop_keeps_grid(self):
+        stations, par = small_network()
+        par.ranges = [[1, 1, 2]]
+        par.srchradius = [1, 1, 2]
+        outfolder = tempfile.mkdtemp()
+        try:
+            self.assertRaises(dss.SimulationFailed, mc.gsimcli, stations,
+                              True, -999.9, [2], 'mean', 0.95, True, False,
+                              None, par, outfolder, True, crop=True,
+                              backend=FailingBackend())
+        finally:
+            shutil.rmtree(outfolder)
+        self.assertEqual((par.xx, par.yy), ([4, 0, 1], [3, 0, 1]))
+
+
+class FakeMonitor(object):
+    """Stable after two realizations."""
+
+    def __init__(self):
+        self.added = list()
+        self.batch = 1
+        self.history = list()
+
+    @property
+    def nsim(self):
+        return len(self.added)
+
+    @property
+    def stable(self):
+        return self.nsim >= 2
+
+    def add(self, values):
+        self.added.append(values)
+        self.history.append({'nsim': self.nsim, 'undecided': 2 - self.nsim,
+                             'flipped': 0, 'mean_se': None})
+
+    def ingest(self, path):
+        self.add(path)
+
+
+class TestAdaptiveSimulation(unittest.TestCase):
+
+    def test_hooks(self):
+        received = list()
+        adaptive = mc.AdaptiveSimulation(FakeMonitor(),
+                                         lambda simnum: 'sim_' + str(simnum))
+        finished, stop = adaptive.hooks(lambda simnum, values:
+                                        received.append(simnum))
+        self.assertFalse(stop())
+        finished(1, None)
+        finished(2, 'values 2')
+        self.assertTrue(stop())
+        self.assertTrue(adaptive.stopped)
+        # a realization finished meanwhile is not monitored
+        finished(3, 'values 3')
+        self.assertEqual(adaptive.monitor.added, ['sim_1', 'values 2'])
+        self.assertEqual(received, [1, 2, 3])
+        mc.is_alive = False
+        try:
+            self.assertTrue(stop())
+            self.assertFalse(adaptive.stopped)
+        finally:
+            mc.is_alive = True
+
+    def test_save(self):
+        adaptive = mc.AdaptiveSimulation(FakeMonitor(), None)
+        adaptive.monitor.add(None)
+        tmpdir = tempfile.mkdtemp()
+        report = os.path.join(tmpdir, 'adaptive.csv')
+        try:
+            adaptive.save(report, 7)
+            adaptive.save(report, 8)
+            with open(report) as fid:
+                rows = [line.strip().split(',') for line in fid]
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(rows, [['candidate', 'realizations', 'undecided',
+                                 'changed', 'mean_se'], ['7', '1', '1', '0',
+                                                         ''],
+                                ['8', '1', '1', '0', '']])
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_sweep_grid(self):
+        grid = mc.sweep_grid(detect_prob=[0.9, 0.95], rad=[0, 1, 2])
+        self.assertEqual(len(grid), 6)
+        self.assertIn({'detect_prob': 0.95, 'rad': 1}, grid)
+        self.assertEqual(mc.sweep_grid(), [{}])
+
+    def test_sweep(self):
+        stations, par = small_network()
+        outfolder = tempfile.mkdtemp()
+        sweep = [{}, {'correct_method': 'percentile',
+                      'correct_percentile': 0.9},
+                 {'detect_prob': 0.8, 'rad': 1}]
+        try:
+            results = mc.gsimcli(stations, True, -999.9, [1, 2, 3], 'mean',
+                                 0.95, True, False, None, par, outfolder,
+                                 True, sweep=sweep,
+                                 backend=dss.NumpyDss(cores=1))
+            basename = os.path.basename(outfolder)
+            with open(os.path.join(outfolder,
+                                   basename + '_sweep.csv')) as fid:
+                rows = [line.strip().split(',') for line in fid]
+            sweep_files = [os.path.join(outfolder, '{0}_sweep_{1}_homogenised'
+                                        '_data.csv'.format(basename, j))
+                           for j in (1, 2, 3)]
+            with open(results[0]) as base, open(sweep_files[0]) as same:
+                self.assertEqual(base.read(), same.read())
+            self.assertTrue(all(os.path.isfile(path)
+                                for path in sweep_files))
+        finally:
+            shutil.rmtree(outfolder)
+        self.assertEqual([row[0] for row in rows], ['setting', '0', '1', '2',
+                                                    '3'])
+        self.assertEqual(rows[1][6], str(sum(results[1])))
+        self.assertEqual(rows[2][6], rows[1][6])
+        self.assertEqual(rows[3][2], 'percentile')
+
+    def test_detect_sweep(self):
+        stations, par = small_network()
+        rand = np.random.RandomState(5)
+        grids = gr.GridArrays([4, 3, 6], [0, 0, 2000], [1, 1, 1], -999.9,
+                              nsim=20)
+        for _ in xrange(20):
+            grids.add(rand.normal(10, 1, 72))
+        settings = {'detect_prob': 0.95, 'correct_method': 'mean',
+                    'correct_skew': None, 'correct_percentile': None,
+                    'rad': 0}
+        sweep = [settings, dict(settings, detect_prob=0.5)]
+        states = [{'stations_pset': copy.deepcopy(stations), 'dnumber_list': list(),
+                   'fnumber_list': list()} for setting in sweep]
+        mc.detect_sweep(grids, 2, sweep, states)
+        candidate = mc.hmg.take_candidate(stations, 2)[0]
+        homogenised, detected, filled = mc.hmg.detect(grids, candidate)
+        self.assertEqual(states[0]['dnumber_list'], [detected])
+        self.assertEqual(states[0]['fnumber_list'], [filled])
+        self.assertGreaterEqual(states[1]['dnumber_list'][0], detected)
+        updated = mc.hmg.update_station(copy.deepcopy(stations), homogenised)
+        np.testing.assert_array_equal(
+            states[0]['stations_pset'].values['clim'],
+            updated.values['clim'])
+
+    def test_save_sweep(self):
+        stations = small_network()[0]
+        stations.add_var(np.zeros(18), 'Flag')
+        settings = {'detect_prob': 0.95, 'correct_method': 'mean',
+                    'correct_skew': None, 'correct_percentile': None,
+                    'rad': 0}
+        sweep = [dict(settings, rad=1)]
+        states = [{'stations_pset': stations, 'dnumber_list': [1, 2],
+                   'fnumber_list': [0, 1]}]
+        outfolder = tempfile.mkdtemp()
+        try:
+            report = mc.save_sweep(outfolder, settings,
+                                   ('base.csv', [1, 0], [0, 0]), sweep,
+                                   states)
+            basename = os.path.basename(outfolder)
+            sweep_file = os.path.join(outfolder, basename +
+                                      '_sweep_1_homogenised_data.csv')
+            self.assertTrue(os.path.isfile(sweep_file))
+            with open(report) as fid:
+                rows = [line.strip().split(',') for line in fid]
+        finally:
+            shutil.rmtree(outfolder)
+        self.assertEqual(rows[1], ['0', '0.95', 'mean', '', '', '0', '1', '0',
+                                   'base.csv'])
+        self.assertEqual(rows[2], ['1', '0.95', 'mean', '', '', '1', '3', '1',
+                                   sweep_file])
+
+    def test_invalid(self):
+        for sweep, kwargs in [([{'prob': 0.9}], {}),
+                              ([{'rad': 1}], {'online_stats': True})]:
+            self.assertRaises(ValueError, mc.gsimcli, None, True, -999.9,
+                              [1], 'mean', 0.95, True, False, None, None,
+                              None, False, sweep=sweep, **kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+'''
+Created on 17/10/2026
+
+@author: julio
+'''
+import unittest
+
+import numpy as np
+import numpy.testing as nt
+
+import launchers.dss as dss
+import parsers.dss as pdss
+import tools.grid as gr
+import tools.kriging as kr
+from tools.simulation import DirectSequential
+
+
+class TestKriging(unittest.TestCase):
+
+    def setUp(self):
+        self.cov = kr.Covariance(0, [[kr.SPHERICAL, 2, 0, 0, 0, 10, 10, 10]])
+        self.points = np.array([[0, 0, 0], [4, 0, 0], [0, 6, 0]])
+        self.values = np.array([1., 3., 2.])
+
+    def test_covariance(self):
+        cov = self.cov([[0, 0, 0]], [[0, 0, 0], [5, 0, 0], [0, 12, 0]])
+        nt.assert_allclose(cov, [[2, 2 * (1 - 0.75 + 0.0625), 0]])
+        # anisotropy: the minor range is half the major one, along x
+        aniso = kr.Covariance(1, [[kr.EXPONENTIAL, 1, 0, 0, 0, 10, 5, 10]])
+        nt.assert_allclose(aniso([[0, 0, 0]], [[0, 0, 0], [0, 10, 0],
+                                               [5, 0, 0]]),
+                           [[2, np.exp(-3), np.exp(-3)]])
+
+    def test_krige(self):
+        for ktype in (kr.ORDINARY, kr.SIMPLE):
+            est, var = kr.krige(self.cov, self.points, self.values, [4, 0, 0],
+                                ktype, mean=2)
+            self.assertAlmostEqual(est, 3)
+            self.assertAlmostEqual(var, 0)
+        # beyond the range, simple kriging returns the mean
+        est, var = kr.krige(self.cov, self.points, self.values, [50, 50, 0],
+                            kr.SIMPLE, mean=2)
+        self.assertAlmostEqual(est, 2)
+        self.assertAlmostEqual(var, 2)
+
+    def test_search_template(self):
+        template = kr.search_template([2, 2, 1], [0, 0, 0], [1, 1, 1],
+                                      [10, 10, 10])
+        # 12 nodes in the same layer, 1 above and 1 below
+        self.assertEqual(len(template), 14)
+        dist = np.sqrt((template[:, :2] ** 2).sum(axis=1) +
+                       (2 * template[:, 2]) ** 2)
+        self.assertTrue((np.diff(dist) >= 0).all())
+
+    def test_gauss(self):
+        for p in (0.01, 0.3, 0.5, 0.9):
+            self.assertAlmostEqual(kr.gauss_cdf(kr.gauss_inv(p)), p, 4)
+
+
+class TestDirectSequential(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.par = pdss.DssParam()
+        cls.par.columns_set = [1, 2, 3, 4, 0, 0]
+        cls.par.xx = [6, 0, 1]
+        cls.par.yy = [5, 0, 1]
+        cls.par.zz = [4, 0, 1]
+        cls.par.nstruct = [1, 0]
+        cls.par.struct = [[1, 1, 0, 0, 0]]
+        cls.par.ranges = [[4, 4, 2]]
+        cls.par.srchradius = [4, 4, 2]
+        cls.par.nsamples = [1, 8]
+        cls.par.maxsim = 8
+        cls.par.krig = [0, 0, 7.42]
+        rand = np.random.RandomState(0)
+        cls.data = np.column_stack((rand.randint(0, 6, 20),
+                                    rand.randint(0, 5, 20),
+                                    rand.randint(0, 4, 20),
+                                    rand.gamma(2, 10, 20)))
+        cls.data[0, 3] = cls.par.nd
+
+    def test_data_nodes(self):
+        sim = DirectSequential(self.par, self.data)
+        valid = self.data[1:]
+        flat = valid[:, 0] + 6 * (valid[:, 1] + 5 * valid[:, 2])
+        nt.assert_array_equal(sim.nodes, np.unique(flat))
+        values = sim.simulate(1)
+        self.assertEqual(values.shape, (6 * 5 * 4,))
+        # the data are kept, and the simulated values follow their histogram
+        self.assertTrue(np.in1d(values[sim.nodes], valid[:, 3]).all())
+        self.assertTrue((values >= valid[:, 3].min()).all())
+        self.assertTrue((values <= valid[:, 3].max()).all())
+        nt.assert_array_equal(values, sim.simulate(1))
+        self.assertFalse(np.array_equal(values, sim.simulate(3)))
+
+    def test_backend(self):
+        pset = gr.PointSet(nodata=self.par.nd, nvars=4,
+                           varnames=['x', 'y', 'time', 'clim'],
+                           values=self.data)
+        stream = gr.GridStream([6, 5, 4], [0, 0, 0], [1, 1, 1], self.par.nd,
+                               loc=[2, 2], tol=1)
+        received = list()
+
+        def callback(simnum, values):
+            received.append(simnum)
+            stream.add(values)
+
+        dss.NumpyDss(cores=2).simulate(self.par, pset, 3, callback=callback)
+        self.assertEqual(received, [1, 2, 3])
+        self.assertEqual(stream.nfiles, 3)
+        sim = DirectSequential(self.par, pset)
+        first = sim.simulate(int(self.par.seed) + 2)
+        nt.assert_array_equal(stream.area_values([2, 2], 1)[0].ravel(),
+                              first[stream._lines.astype('int') - 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
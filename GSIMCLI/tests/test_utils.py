@@ -0,0 +1,55 @@
+'''
+Created on 17/10/2026
+
+@author: julio
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy.testing as nt
+
+import tools.grid as gr
+import tools.utils as ut
+
+
+class TestPickle(unittest.TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.pset = gr.PointSet(nodata=-999.9, nvars=3,
+                               varnames=['x', 'station', 'clim'],
+                               values=[[1, 1, 2.5], [2, 1, -999.9],
+                                       [3, 2, 4.25]])
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_round_trip(self):
+        path = os.path.join(self.tmpdir, 'checkpoint.pkl')
+        for i in xrange(2):
+            # the second one replaces the first
+            ut.pickle_atomic({'next': i, 'pset': self.pset}, path)
+        state = ut.unpickle(path)
+        self.assertEqual(state['next'], 1)
+        nt.assert_array_equal(state['pset'].values.values,
+                              self.pset.values.values)
+        self.assertFalse([name for name in os.listdir(self.tmpdir)
+                          if name.endswith('.tmp')])
+
+    def test_failure(self):
+        path = os.path.join(self.tmpdir, 'failure.pkl')
+        ut.pickle_atomic([1, 2], path)
+        with self.assertRaises(Exception):
+            ut.pickle_atomic(lambda: None, path)
+        self.assertEqual(ut.unpickle(path), [1, 2])
+        self.assertFalse([name for name in os.listdir(self.tmpdir)
+                          if name.endswith('.tmp')])
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
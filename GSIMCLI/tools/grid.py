@@ -9,8 +9,13 @@ Created on 12 de Out de 2013
 @author: julio
 """
 
+import collections
+import json
+import multiprocessing as mp
 import os
+import tempfile
 import time
+import warnings
 
 import bottleneck as bn
 import numpy as np
@@ -35,7 +40,8 @@ class PointSet(object):
     varnames : list of string
         Variables names.
     values : pandas.DataFrame
-        Variables values.
+        Variables values. If the PointSet was compacted (see `compact`), the
+        DataFrame is only rebuilt when it is accessed.
 
     Notes
     -----
@@ -66,6 +72,9 @@ class PointSet(object):
 
     """
 
+    __slots__ = ('path', 'name', 'nvars', 'nodata', 'varnames', '_values',
+                 '_columns', '_station_index')
+
     def __init__(self, name=None, nodata=-999.9, nvars=0, varnames=None,
                  values=None, psetpath=None, header=True):
         """Constructor to initialise a PointSet instance.
@@ -88,6 +97,9 @@ class PointSet(object):
             PointSet file has the GSLIB standard header lines.
 
         """
+        self._station_index = None
+        self._values = None
+        self._columns = None
         self.path = psetpath
         if self.path and os.path.isfile(self.path):
             self.load(self.path, nodata, header)
@@ -96,7 +108,8 @@ class PointSet(object):
             self.nvars = nvars
             self.nodata = nodata
             self.varnames = varnames or []
-            values = values or np.zeros((0, 0))
+            if values is None:
+                values = np.zeros((0, 0))
             self.values = pd.DataFrame(values)
             if len(self.values.columns) == len(self.varnames):
                 self.values.columns = self.varnames
@@ -106,6 +119,91 @@ class PointSet(object):
         """
         return str(self.values)
 
+    def __getstate__(self):
+        """Pickle the attributes, as there is no instance dictionary.
+
+        """
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        """Restore the pickled attributes.
+
+        """
+        for slot, value in state.iteritems():
+            setattr(self, slot, value)
+
+    @property
+    def values(self):
+        """Variables values, as a pandas.DataFrame.
+
+        """
+        if self._values is None and self._columns is not None:
+            self._values = self._expand()
+            self._columns = None
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+        self._columns = None
+
+    def compact(self, float32=None):
+        """Keep the values in compact arrays, until the DataFrame is needed
+        again.
+
+        Columns with integer values only (e.g., station ID's, time, flags or
+        keys converted by `parsers.spreadsheet.dtype_filter`) are kept as
+        int32, and columns with non-numeric values are kept as categorical.
+        Any other column is kept as it is, unless it is listed in `float32`.
+
+        Parameters
+        ----------
+        float32 : list of string, optional
+            Variables kept as float32, e.g., ['clim']. They are restored with
+            the shortest decimal number which has the same float32 value, so
+            values with up to 7 significant digits (e.g., read from a file)
+            are restored exactly, as well as the missing data value.
+
+        Notes
+        -----
+        The DataFrame is rebuilt, with the original types, the next time the
+        `values` attribute is accessed.
+
+        """
+        if self._values is None:
+            return
+        columns = list()
+        for var in self._values.columns:
+            col = self._values[var].values
+            if col.dtype == object:
+                col = pd.Categorical(col)
+            elif float32 and var in float32:
+                col = col.astype('float32')
+            elif col.dtype.kind == 'f' and _integral(col):
+                col = col.astype('int32')
+            columns.append((var, col.dtype, col))
+        self._columns = (self._values.index, columns)
+        self._values = None
+
+    def _expand(self):
+        """Build the DataFrame from the compact arrays.
+
+        """
+        index, columns = self._columns
+        names = list()
+        data = dict()
+        for var, dtype, col in columns:
+            if isinstance(col, pd.Categorical):
+                col = np.asarray(col)
+            elif dtype == 'float32':
+                # shortest decimal representation of each float32 value
+                col = col.astype(str).astype('float64')
+            elif dtype == 'int32':
+                col = col.astype('float64')
+            names.append(var)
+            data[var] = col
+        return pd.DataFrame(data, index=index, columns=names)
+
     def add_var(self, values, varname=None):
         """Append a new variable to an existing PointSet.
 
@@ -129,6 +227,33 @@ class PointSet(object):
         self.varnames.append(varname)
         self.values[varname] = values
 
+    def station_rows(self, station):
+        """Find the rows of a station.
+
+        The rows of every station are indexed the first time, and the index
+        is kept while `values` is the same DataFrame with the same number of
+        rows.
+
+        Parameters
+        ----------
+        station : number
+            Station ID number, in the variable 'station'.
+
+        Returns
+        -------
+        slice or ndarray
+            Positions of the station rows: a slice if they are contiguous, as
+            when the stations are sorted.
+
+        """
+        index = self._station_index
+        if (index is None or index[0] is not self.values or
+                index[1] != self.values.shape[0]):
+            index = (self.values, self.values.shape[0],
+                     _index_stations(self.values['station'].values))
+            self._station_index = index
+        return index[2].get(station, slice(0, 0))
+
     def load(self, psetfile, nd=-999.9, header=True):
         """Load a point-set from a file in GSLIB format.
 
@@ -155,7 +280,7 @@ class PointSet(object):
             self.nvars = int(fid.readline())
             for i in xrange(self.nvars):  # @UnusedVariable
                 self.varnames.append(fid.readline().strip())
-        values = np.loadtxt(fid)  # TODO: pd.read_table
+        values = read_table(fid, self.nvars if header else None)
         if not header:
             self.name = os.path.splitext(os.path.basename(psetfile))[0]
             self.nvars = values.shape[1]
@@ -164,7 +289,7 @@ class PointSet(object):
         self.values = pd.DataFrame(values, columns=self.varnames)
         fid.close()
 
-    def save(self, psetfile=None, header=True):
+    def save(self, psetfile=None, header=True, precision=None):
         """Write a point-set to a file in GSLIB format.
 
         Parameters
@@ -173,6 +298,9 @@ class PointSet(object):
             File path. If not specified, will rewrite the original file.
         header : boolean, default True
             PointSet file has the GSLIB standard header lines.
+        precision : int, optional
+            Number of decimal places, instead of the default fixed width
+            format (see `write_table`).
 
         """
         if not psetfile:
@@ -183,7 +311,7 @@ class PointSet(object):
         if header:
             fid.write(self.name + '\n' + str(self.nvars) + '\n' +
                       '\n'.join(self.varnames) + '\n')
-        np.savetxt(fid, self.values, fmt='%-10.6f')
+        write_table(fid, self.values.values, precision)
         fid.close()
 
     def flush_varnames(self, varnames=None):
@@ -242,8 +370,13 @@ class GridArr(object):
         Node size in Z-axis.
     nodata : number
         Missing data value.
-    val : ndarray
-        One dimension array containing the grid values.
+    val : ndarray or None
+        One dimension array containing the grid values. None if the grid was
+        loaded with `lazy=True`.
+    path : string or None
+        File path, if the grid was loaded from a file.
+    index : LineIndex or None
+        Lines index of the file, if the grid was loaded with `lazy=True`.
 
     Notes
     -----
@@ -293,8 +426,11 @@ class GridArr(object):
         self.cellz = cellz
         self.nodata = nodata
         self.val = val
+        self.path = None
+        self.index = None
 
-    def load(self, gridfile, dims, first, cells_size, nd=-999.9, skipheader=3):
+    def load(self, gridfile, dims, first, cells_size, nd=-999.9, skipheader=3,
+             lazy=False):
         """Load a grid from a file in GSLIB format.
 
         Parameters
@@ -311,8 +447,12 @@ class GridArr(object):
             Missing data value.
         skipheader : int, default 3
             Number of lines in the header.
+        lazy : boolean, default False
+            Do not read the values, only index the lines of the file. The
+            values will be read from the file when needed (see `drill`).
 
         """
+        self.path = gridfile
         self.dx = dims[0]
         self.dy = dims[1]
         self.dz = dims[2]
@@ -323,9 +463,17 @@ class GridArr(object):
         self.celly = cells_size[1]
         self.cellz = cells_size[2]
         self.nodata = nd
-        self.val = np.loadtxt(gridfile, skiprows=skipheader)
+        if lazy:
+            self.val = None
+            self.index = line_index(gridfile, skipheader)
+        else:
+            with open(gridfile, 'rb') as fid:
+                skip_lines(fid, skipheader)
+                self.val = read_table(fid)
+            if self.val.shape[1] == 1:
+                self.val = self.val[:, 0]
 
-    def save(self, outfile, varname='var', header=True):
+    def save(self, outfile, varname='var', header=True, precision=None):
         """Write a grid to a file in GSLIB format.
 
         Parameters
@@ -336,14 +484,16 @@ class GridArr(object):
             Variable name.
         header : boolean, default True
             PointSet file has the GSLIB standard header lines.
+        precision : int, optional
+            Number of decimal places, instead of the default fixed width
+            format (see `write_table`).
 
         """
         fid = open(outfile, 'w')
         if header:
             fid.write(os.path.splitext(os.path.basename(outfile))[0] +
                       '\n1\n' + varname + '\n')
-        # np.savetxt(fid, outvar.reshape(outvar.shape, order='F'), fmt='%10.4')
-        np.savetxt(fid, self.val, fmt='%-10.6f')
+        write_table(fid, self.val, precision)
         fid.close()
 
     def drill(self, wellxy, save=False, outfile=None, header=True):
@@ -360,15 +510,14 @@ class GridArr(object):
         header : boolean, default True
             PointSet file has the GSLIB standard header lines.
 
-        .. TODO: needs fix, it is not drilling in the right place
-
         """
         well = PointSet()
         well.name = self.name + ' drilled at ' + str(wellxy)
         well.nodata = self.nodata
         well.nvars = 4
         well.varnames = ['x', 'y', 'z', 'var']
-        well.values = pd.DataFrame(np.zeros((self.dz, 4)))
+        well.values = pd.DataFrame(np.zeros((self.dz, 4)),
+                                   columns=well.varnames)
         well.values.iloc[:, :3] = (np.column_stack
                                    (((np.repeat(np.array(wellxy)
                                                 [np.newaxis, :], self.dz,
@@ -376,10 +525,12 @@ class GridArr(object):
                                      np.arange(1, self.dz + 1))))
         xy_nodes = coord_to_grid(wellxy, [self.cellx, self.celly, self.cellz],
                                  [self.xi, self.yi, self.zi])
-        for z in xrange(self.dz):
-            p = (xy_nodes[0] + self.dx * (xy_nodes[1] - 1) +
-                 self.dx * self.dy * z)
-            well.values.iloc[z, 3] = self.val[p]
+        lines = np.array(line_zmirror(xy_nodes, [self.dx, self.dy, self.dz]))
+        if self.val is None:
+            with open(self.path, 'rb') as fid:
+                well.values.iloc[:, 3] = read_indexed(fid, self.index, lines)
+        else:
+            well.values.iloc[:, 3] = self.val[lines - 1]
         if save and outfile is not None:
             well.save(outfile, header)
         return well
@@ -394,8 +545,8 @@ class GridFiles(object):
 
     Attributes
     ----------
-    files : list of file
-        List containing the files handler (type 'file').
+    files : list of PooledFile or string
+        List containing the files handler (or their paths, if not opened).
     nfiles : int
         Number of files.
     dx : int
@@ -422,6 +573,17 @@ class GridFiles(object):
         PointSet file has the GSLIB standard header lines.
     nodata : number
         Missing data value.
+    cube : numpy.memmap or None
+        Memory-mapped realisations cube, with shape (nfiles, dz, dy, dx), used
+        instead of the files when it is available. See `pack`.
+    indexes : list of LineIndex or None
+        Lines index of each file, used to read only the needed lines. See
+        `index`.
+    cache : dict of ndarray
+        Values retrieved by `area_values`, by location (in grid nodes) and
+        radius, which are reused until the files are closed.
+    pool : FilePool or None
+        Pool which keeps a limited number of files open at the same time.
 
     .. TODO: make class child of GridArr?
 
@@ -445,9 +607,13 @@ class GridFiles(object):
         self.cells = 0
         self.header = 0
         self.nodata = -999.9
+        self.cube = None
+        self.indexes = None
+        self.cache = dict()
+        self.pool = None
 
     def load(self, first_file, n, dims, first_coord, cells_size, no_data,
-             headerin=3):
+             headerin=3, maxfiles=256):
         """Open several grid files and provide a list containing each file
         handler (delivered in the `files` attribute).
 
@@ -468,6 +634,9 @@ class GridFiles(object):
             Missing data value.
         headerin : int, default 3
             Number of lines in the header.
+        maxfiles : int, default 256
+            Maximum number of files open at the same time. The least recently
+            used files are closed and reopened when needed (see `FilePool`).
 
         Raises
         ------
@@ -483,31 +652,28 @@ class GridFiles(object):
         - 3rd file_with_this_name3.extension
         - nth file_with_this_namen.extension
 
+        If a realisations cube matching the grid exists next to the first file
+        (see `pack`), it is used instead and the files are not opened.
+
         """
         self.nfiles = n
-        self.dx = dims[0]
-        self.dy = dims[1]
-        self.dz = dims[2]
-        self.xi = first_coord[0]
-        self.yi = first_coord[1]
-        self.zi = first_coord[2]
-        self.cellx = cells_size[0]
-        self.celly = cells_size[1]
-        self.cellz = cells_size[2]
-        self.cells = np.prod(dims)
-        self.header = headerin
-        self.nodata = no_data
-        self.files.append(open(first_file, 'rb'))
-        for i in xrange(2, n + 1):
-            another = filename_indexing(first_file, i)
+        self._set_grid(dims, first_coord, cells_size, no_data, headerin)
+        paths = [first_file] + [filename_indexing(first_file, i)
+                                for i in xrange(2, n + 1)]
+        if self.find_cube(first_file):
+            self.files.extend(paths)
+            return
+
+        self.pool = FilePool(maxfiles)
+        for another in paths:
             if os.path.isfile(another):
-                self.files.append(open(another, 'rb'))
+                self.files.append(self.pool.open(another))
             else:
                 raise IOError('File {0} not found.'.
                               format(os.path.basename(another)))
 
     def open_files(self, files_list, dims, first_coord, cells_size, no_data,
-                   headerin=3, only_paths=False):
+                   headerin=3, only_paths=False, maxfiles=256):
         """Open a list of given grid files and provide a list containing each
         file handler (delivered in the `files` attribute).
 
@@ -527,6 +693,9 @@ class GridFiles(object):
             Number of lines in the header.
         only_paths : bool
             Do not open the files, just save their paths.
+        maxfiles : int, default 256
+            Maximum number of files open at the same time. The least recently
+            used files are closed and reopened when needed (see `FilePool`).
 
         Raises
         ------
@@ -545,9 +714,49 @@ class GridFiles(object):
         """
         def append_opened(path):
             "Auxiliary function to minimise the number of conditions verified."
-            self.files.append(open(path, 'rb'))
+            self.files.append(self.pool.open(path))
 
         self.nfiles = len(files_list)
+        self._set_grid(dims, first_coord, cells_size, no_data, headerin)
+
+        if only_paths or self.find_cube(files_list[0]):
+            open_file = self.files.append
+        else:
+            self.pool = FilePool(maxfiles)
+            open_file = append_opened
+
+        for gridfile in files_list:
+            try:
+                open_file(gridfile)
+            except IOError, msg:
+                print(msg)
+                raise IOError('File {0} not found.'.format(gridfile))
+
+    def __getstate__(self):
+        """Pickle the files paths instead of the opened files, and the cube
+        path instead of the cube, e.g., to send them to other processes.
+
+        """
+        state = self.__dict__.copy()
+        state['files'] = [_filename(grid) for grid in self.files]
+        state['cache'] = dict()
+        state['pool'] = None
+        if self.cube is not None:
+            state['cube'] = self.cube.filename
+        return state
+
+    def __setstate__(self, state):
+        """Reopen the cube, if there is one, after unpickling.
+
+        """
+        self.__dict__.update(state)
+        if self.cube is not None:
+            self.cube = load_cube(self.cube)[0]
+
+    def _set_grid(self, dims, first_coord, cells_size, no_data, headerin):
+        """Set the grid properties shared by every file.
+
+        """
         self.dx = dims[0]
         self.dy = dims[1]
         self.dz = dims[2]
@@ -561,45 +770,164 @@ class GridFiles(object):
         self.header = headerin
         self.nodata = no_data
 
-        if only_paths:
-            open_file = self.files.append
-        else:
-            open_file = append_opened
+    def find_cube(self, first_file):
+        """Look for a realisations cube packed from a set of files, and use
+        it if it matches the grid properties.
 
-        for gridfile in files_list:
-            try:
-                open_file(gridfile)
-            except IOError, msg:
-                print(msg)
-                raise IOError('File {0} not found.'.format(gridfile))
+        Parameters
+        ----------
+        first_file : string
+            File path to the first realisation.
+
+        Returns
+        -------
+        boolean
+            True if a valid cube was found.
+
+        """
+        path = cube_path(first_file)
+        if not os.path.isfile(path):
+            return False
+        cube, meta = load_cube(path)
+        if meta != dict(self._cube_meta(), files=meta['files']):
+            return False
+        # the maps might have been simulated again after packing
+        if (os.path.isfile(first_file) and
+                os.path.getmtime(first_file) > os.path.getmtime(path)):
+            return False
+        self.cube = cube
+        return True
+
+    def pack(self, path=None):
+        """Pack every realisation into one binary cube, which will be
+        memory-mapped from then on.
+
+        The cube is saved in NumPy format (.npy), as float32 values with shape
+        (nfiles, dz, dy, dx), where missing data is stored as NaN. A JSON file
+        with the same name holds the grid properties and the missing data
+        value.
+
+        Parameters
+        ----------
+        path : string, optional
+            Cube file path. If not specified, it will be named after the first
+            file, with extension *.npy*, and will be used by `load` and
+            `open_files` whenever the same files are opened.
+
+        Returns
+        -------
+        path : string
+            Cube file path.
+
+        """
+        if path is None:
+            path = cube_path(_filename(self.files[0]))
+        cube = np.lib.format.open_memmap(path, mode='w+', dtype='float32',
+                                         shape=(self.nfiles, self.dz, self.dy,
+                                                self.dx))
+        for i, gridfile in enumerate(self.files):
+            if _opened(gridfile):
+                grid = gridfile
+                grid.seek(os.SEEK_SET)
+            else:
+                grid = open(gridfile, 'rb')
+            skip_lines(grid, self.header)
+            values = read_values(grid, self.cells)
+            values[values == self.nodata] = np.nan
+            cube[i] = values.reshape((self.dz, self.dy, self.dx))
+            if _opened(gridfile):
+                grid.seek(os.SEEK_SET)
+            else:
+                grid.close()
+        cube.flush()
+        del cube
+
+        meta = self._cube_meta()
+        meta['files'] = [os.path.basename(_filename(grid))
+                         for grid in self.files]
+        with open(os.path.splitext(path)[0] + '.json', 'w') as fid:
+            json.dump(meta, fid, indent=1)
+        self.cube = load_cube(path)[0]
+        return path
+
+    def _cube_meta(self):
+        """Grid properties kept with a realisations cube.
+
+        """
+        return {
+            'nsim': int(self.nfiles),
+            'dims': map(int, [self.dx, self.dy, self.dz]),
+            'first': map(float, [self.xi, self.yi, self.zi]),
+            'cells_size': map(float, [self.cellx, self.celly, self.cellz]),
+            'nodata': float(self.nodata),
+        }
+
+    def index(self, fixed_width=None, persist=True):
+        """Index the lines of every file, so that the values needed by
+        `stats_area` are read directly, without reading all the previous
+        lines.
+
+        Parameters
+        ----------
+        fixed_width : int, optional
+            Length of every line, in bytes, if the files were written with
+            fixed width. The offsets are then computed instead of searched.
+        persist : boolean, default True
+            Save each index in a file next to the indexed file (with extension
+            *.idx* appended), which is reused while the indexed file does not
+            change.
+
+        See Also
+        --------
+        LineIndex : lines index of one file.
+
+        """
+        self.indexes = [line_index(_filename(grid), self.header, fixed_width,
+                                   persist)
+                        for grid in self.files]
 
     def reset_read(self):
         """Reset the  pointer that reads each file to the beginning.
 
         """
         for grid in self.files:
-            grid.seek(os.SEEK_SET)
+            if _opened(grid):
+                grid.seek(os.SEEK_SET)
 
     def dump(self):
         """Close all files.
 
         """
         for grid in self.files:
-            grid.close()
+            if _opened(grid):
+                grid.close()
         self.nfiles = 0
+        self.cube = None
+        self.cache = dict()
 
     def purge(self):
-        """Remove all simulated map files from the filesystem permanently.
+        """Remove all simulated map files from the filesystem permanently,
+        including the realisations cube, if there is one.
 
         """
+        if self.cube is not None:
+            path = self.cube.filename
+        else:
+            path = None
         self.dump()
         # workaround for delay issue on NT systems
         time.sleep(1)
         for grid in self.files:
-            os.remove(grid.name)
+            for leftover in [_filename(grid), _filename(grid) + '.idx']:
+                if os.path.isfile(leftover):
+                    os.remove(leftover)
+        if path:
+            os.remove(path)
+            os.remove(os.path.splitext(path)[0] + '.json')
 
     def stats(self, lmean=False, lmed=False, lskew=False, lvar=False,
-              lstd=False, lcoefvar=False, lperc=False, p=0.95):
+              lstd=False, lcoefvar=False, lperc=False, p=0.95, block=10000,
+              sketch=None, cores=1):
         """Calculate some statistics among every realisation.
 
         Each statistic is calculated node-wise along the complete number of
@@ -623,6 +951,17 @@ class GridFiles(object):
             Calculate the percentile `100 * (1 - p)`.
         p : number, default 0.95
             Probability value.
+        block : int, default 10000
+            Number of nodes read from every realisation at once. The memory
+            used is proportional to `block * nfiles`.
+        sketch : int, optional
+            Estimate the percentiles with a `QuantileSketch` of this size,
+            instead of sorting every value.
+        cores : int, default 1
+            Number of processes. The grid is split in bands of rows, one for
+            each process, which reads its own part of every file straight
+            from its first line. The files are indexed first, if they were
+            not yet (see `index`).
 
         Returns
         -------
@@ -633,110 +972,115 @@ class GridFiles(object):
         --------
         stats_area : same but considering a circular (and horizontal) area of
         a specified radius around a given point.
+        block_stats : statistics of a block of nodes along every realisation.
 
         """
-        # check if the map files are already opened or not
-        if isinstance(self.files[0], file):
-            opened_files = True
+        kwargs = dict(lmean=lmean, lmed=lmed, lskew=lskew, lvar=lvar,
+                      lstd=lstd, lcoefvar=lcoefvar, lperc=lperc, p=p,
+                      block=block, sketch=sketch)
+        if cores > 1 and self.dy * self.dz > 1:
+            if self.cube is None and not self.indexes:
+                # otherwise every band would read each file from its start
+                self.index()
+            # split the grid in bands of whole rows
+            bands = [band for band in
+                     np.array_split(np.arange(self.dy * self.dz), cores)
+                     if band.size]
+            jobs = [(self, band[0] * self.dx, (band[-1] + 1) * self.dx,
+                     kwargs) for band in bands]
+            pool = mp.Pool(len(jobs))
+            try:
+                parts = pool.map(_stats_worker, jobs)
+            finally:
+                pool.close()
+                pool.join()
+            maps = dict((key, np.concatenate([part[key] for part in parts]))
+                        for key in parts[0])
         else:
-            opened_files = False
+            maps = self._stats_range(0, self.cells, **kwargs)
 
-        if lmean:
-            meanmap = np.zeros(self.cells)
-        if lmed:
-            medmap = np.zeros(self.cells)
-        if lskew:
-            skewmap = np.zeros(self.cells)
-        if lvar:
-            varmap = np.zeros(self.cells)
-        if lstd:
-            stdmap = np.zeros(self.cells)
-        if lcoefvar:
-            coefvarmap = np.zeros(self.cells)
-        if lperc:
-            percmap = np.zeros((self.cells, 2))
-
-        arr = np.zeros(self.nfiles)
-        skip = True
-        offset = os.SEEK_SET
-        for cell in xrange(self.cells - self.header):
-            for i, gridfile in enumerate(self.files):
-                # deal with map files not open yet
-                if opened_files:
-                    grid = gridfile
-                else:
-                    grid = open(gridfile, 'rb')
-                    grid.seek(offset)
-
-                if skip:
-                    skip_lines(grid, self.header)
-                arr[i] = grid.readline()
-
-            if not opened_files:
-                offset = grid.tell()
-                grid.close()
+        # reset the reading pointer in each grid file
+        self.reset_read()
+        return self._stats_grids(maps)
 
-            skip = False
-            # replace no data's with NaN
-            bn.replace(arr, self.nodata, np.nan)
-            if lmean:
-                meanmap[cell] = bn.nanmean(arr)
-            if lmed:
-                medmap[cell] = bn.nanmedian(arr)
-            if lskew:
-                skewmap[cell] = pd.Series(arr).skew()
-            if lvar:
-                varmap[cell] = bn.nanvar(arr, ddof=1)
-            if lstd:
-                stdmap[cell] = bn.nanstd(arr, ddof=1)
-            if lcoefvar:
-                if lstd and lmean:
-                    coefvarmap[cell] = stdmap[cell] / meanmap[cell] * 100
-                else:
-                    std = bn.nanstd(arr, ddof=1)
-                    mean = bn.nanmean(arr)
-                    coefvarmap[cell] = std / mean * 100
-            if lperc:
-                percmap[cell] = pd.Series(arr).quantile([(1 - p) / 2,
-                                                         1 - (1 - p) / 2])
+    def _stats_range(self, first, last, lmean=False, lmed=False, lskew=False,
+                     lvar=False, lstd=False, lcoefvar=False, lperc=False,
+                     p=0.95, block=10000, sketch=None):
+        """Calculate some statistics of the nodes from `first` (inclusive) to
+        `last` (exclusive), by the order they are in the files.
 
-        retdict = dict()
+        Returns
+        -------
+        maps : dict of ndarray
+            One array for each calculated statistic, as in `block_stats`.
 
-        if lmean:
-            meangrid = GridArr(name='meanmap', dx=self.dx, dy=self.dy,
-                               dz=self.dz, nodata=self.nodata, val=meanmap)
-            retdict['meanmap'] = meangrid
-        if lmed:
-            medgrid = GridArr(name='medianmap', dx=self.dx, dy=self.dy,
-                              dz=self.dz, nodata=self.nodata, val=medmap)
-            retdict['medianmap'] = medgrid
-        if lskew:
-            skewgrid = GridArr(name='skewmap', dx=self.dx, dy=self.dy,
-                               dz=self.dz, nodata=self.nodata, val=skewmap)
-            retdict['skewmap'] = skewgrid
-        if lvar:
-            vargrid = GridArr(name='varmap', dx=self.dx, dy=self.dy,
-                              dz=self.dz, nodata=self.nodata, val=varmap)
-            retdict['varmap'] = vargrid
-        if lstd:
-            stdgrid = GridArr(name='stdmap', dx=self.dx, dy=self.dy,
-                              dz=self.dz, nodata=self.nodata, val=stdmap)
-            retdict['stdmap'] = stdgrid
-        if lcoefvar:
-            coefvargrid = GridArr(name='coefvarmap', dx=self.dx, dy=self.dy,
-                                  dz=self.dz, nodata=self.nodata,
-                                  val=coefvarmap)
-            retdict['coefvarmap'] = coefvargrid
+        """
+        ncells = last - first
+        maps = dict()
+        for flag, key in [(lmean, 'mean'), (lmed, 'median'),
+                          (lskew, 'skewness'), (lvar, 'variance'),
+                          (lstd, 'std'), (lcoefvar, 'coefvar')]:
+            if flag:
+                maps[key] = np.zeros(ncells)
         if lperc:
-            percgrid = GridArr(name='percmap', dx=self.dx, dy=self.dy,
-                               dz=self.dz, nodata=self.nodata, val=percmap)
-            retdict['percmap'] = percgrid
+            maps['perc'] = np.zeros((ncells, 2))
+
+        block = max(1, min(int(block), ncells))
+        arr = np.zeros((self.nfiles, block))
+        # position of the next line to read in each file, if already known
+        if self.indexes:
+            offsets = [int(index.offset(first + 1)) for index in self.indexes]
+        else:
+            offsets = [None] * self.nfiles
+        for start in xrange(first, last, block):
+            nlines = min(block, last - start)
+            if self.cube is not None:
+                arr[:, :nlines] = self.cube.reshape((self.nfiles, self.cells))[
+                    :, start:start + nlines]
+            else:
+                for i, gridfile in enumerate(self.files):
+                    # deal with map files not open yet
+                    if _opened(gridfile):
+                        grid = gridfile
+                    else:
+                        grid = open(gridfile, 'rb')
+
+                    if offsets[i] is None:
+                        grid.seek(os.SEEK_SET)
+                        skip_lines(grid, self.header + first)
+                    else:
+                        grid.seek(offsets[i])
+                    arr[i, :nlines] = read_values(grid, nlines)
+                    offsets[i] = grid.tell()
+
+                    if not _opened(gridfile):
+                        grid.close()
+
+            bstats = block_stats(arr[:, :nlines], self.nodata, lmean, lmed,
+                                 lskew, lvar, lstd, lcoefvar, lperc, p, sketch)
+            for key in maps:
+                maps[key][start - first:start - first + nlines] = bstats[key]
+
+        return maps
+
+    def _stats_grids(self, maps):
+        """Wrap the statistics maps, as returned by `block_stats`, in GridArr
+        instances named after each statistic.
 
+        """
+        names = {'mean': 'meanmap', 'median': 'medianmap',
+                 'skewness': 'skewmap', 'variance': 'varmap',
+                 'std': 'stdmap', 'coefvar': 'coefvarmap', 'perc': 'percmap'}
+        retdict = dict()
+        for key, val in maps.iteritems():
+            retdict[names[key]] = GridArr(name=names[key], dx=self.dx,
+                                          dy=self.dy, dz=self.dz,
+                                          nodata=self.nodata, val=val)
         return retdict
 
     def stats_area(self, loc, tol=0, lmean=False, lmed=False, lskew=False,
                    lvar=False, lstd=False, lcoefvar=False, lperc=False,
-                   p=0.95, save=False):
+                   p=0.95, save=False, sketch=None):
         """Calculate some statistics among every realisation, considering a
         circular (only horizontaly) area of radius `tol` around the point
         located at `loc`.
@@ -766,6 +1110,9 @@ class GridFiles(object):
         save : boolean, default False
             Write the points used to calculate the chosen statistics in
             PointSet format to a file named 'sim values at (x, y, line).prn'.
+        sketch : int, optional
+            Estimate the percentiles with a `QuantileSketch` of this size,
+            instead of sorting every value.
 
         Returns
         -------
@@ -775,147 +1122,2092 @@ class GridFiles(object):
         .. TODO: checkar stats variance com geoms
 
         """
-        if lmean:
-            meanline = np.zeros(self.dz)
-        if lmed:
-            medline = np.zeros(self.dz)
-        if lskew:
-            skewline = np.zeros(self.dz)
-        if lvar:
-            varline = np.zeros(self.dz)
-        if lstd:
-            stdline = np.zeros(self.dz)
-        if lcoefvar:
-            coefvarline = np.zeros(self.dz)
-        if lperc:
-            percline = np.zeros((self.dz, 2))
+        values = self.area_values(loc, tol)
+        loc = self._area_nodes(loc, tol)[0]
+        if save and tol == 0:
+            # FIXME: not working with the tolerance feature
+            # need to adjust the arrpset or cherry-pick arr
+            self._save_values(values, loc, self._values_folder())
+
+        return vline_stats(values, loc, self.zi, self.cellz, self.nodata,
+                           lmean, lmed, lskew, lvar, lstd, lcoefvar, lperc, p,
+                           sketch)
+
+    def stats_locations(self, locs, lmean=False, lmed=False, lskew=False,
+                        lvar=False, lstd=False, lcoefvar=False, lperc=False,
+                        p=0.95, sketch=None):
+        """Calculate some statistics among every realisation, considering a
+        circular (only horizontaly) area around each one of several
+        locations.
+
+        Every file is read only once, whatever the number of locations.
+
+        Parameters
+        ----------
+        locs : list of array_like
+            Location of each vertical line and its tolerance radius,
+            [x, y, tol].
+        lmean, lmed, lskew, lvar, lstd, lcoefvar, lperc : boolean, default False
+            Statistics to calculate, see `stats_area`.
+        p : number, default 0.95
+            Probability value.
+        sketch : int, optional
+            Estimate the percentiles with a `QuantileSketch` of this size.
+
+        Returns
+        -------
+        list of PointSet
+            PointSet instance containing the calculated statistics of each
+            location.
+
+        See Also
+        --------
+        stats_area : same for one location.
+
+        """
+        statspsets = list()
+        for loc, values in zip(locs, self.locations_values(locs)):
+            loc = self._area_nodes(loc[:2], loc[2])[0]
+            statspsets.append(vline_stats(values, loc, self.zi, self.cellz,
+                                          self.nodata, lmean, lmed, lskew,
+                                          lvar, lstd, lcoefvar, lperc, p,
+                                          sketch))
+        return statspsets
+
+    def _values_folder(self):
+        """Directory where the values used to calculate the statistics are
+        saved, the same of the realisations.
+
+        """
+        return os.path.dirname(_filename(self.files[0]))
+
+    def _save_values(self, values, loc, folder):
+        """Write the values of every realisation at a location, one PointSet
+        file per layer named 'sim values at (x, y, line).prn'.
+
+        """
+        nsim = values.shape[0]
+        for layer in xrange(self.dz):
+            arrpset = PointSet('realisations at location ({0}, {1}, {2})'.
+                               format(loc[0], loc[1], layer * self.cellz +
+                                      self.zi), self.nodata, 3,
+                               ['x', 'y', 'value'],
+                               values=np.zeros((nsim, 3)))
+            arrout = os.path.join(folder,
+                                  'sim values at ({0}, {1}, {2}).prn'.format(
+                                      loc[0], loc[1], layer * self.cellz
+                                      + self.zi))
+            arrpset.values.iloc[:, 2] = values[:, layer, :].ravel()
+            arrpset.values.iloc[:, :2] = np.repeat(np.array(loc)
+                                                   [np.newaxis, :],
+                                                   nsim, axis=0)
+            arrpset.save(arrout, header=True)
+
+    def _area_nodes(self, loc, tol=0):
+        """Find the grid nodes within a circular (only horizontaly) area of
+        radius `tol` around the point located at `loc`.
 
+        Returns
+        -------
+        loc : ndarray
+            Location of the vertical line, in grid nodes [x, y].
+        nodes : ndarray
+            Nodes [x, y] inside the grid, sorted by their line in the grid
+            file.
+
+        """
         # convert the coordinates of the first point to grid nodes
         loc = coord_to_grid(loc, [self.cellx, self.celly, self.cellz],
                             [self.xi, self.yi, self.zi])[:2]
         # find the nodes coordinates within a circle centred in the first point
         neighbours_nodes = circle(loc[0], loc[1], tol)
-        # compute the lines numbers for each point in the neighbourhood, across
-        # each grid layer. this yields a N*M matrix, with N equal to the number
-        # of neighbour nodes, and M equal to the number of layers in the grid.
-        neighbours_lines = [line_zmirror(node, [self.dx, self.dy, self.dz])
-                            for node in neighbours_nodes]
-        # sort the lines in ascending order
-        neighbours_lines = np.sort(neighbours_lines, axis=0)
-        # create an array to store the neighbour nodes in each grid file
-        nnodes = neighbours_lines.shape[0]
-        arr = np.zeros(self.nfiles * nnodes)
-
-        skip = True
-        curr_line = np.zeros(self.nfiles)
-
-        for layer in xrange(neighbours_lines.shape[1]):
-            for i, line in enumerate(neighbours_lines[:, layer]):
-                for j, grid in enumerate(self.files):
-                    # skip header lines only once per grid file
-                    if skip and self.header:
-                        skip_lines(grid, self.header)
-
-                    # advance to the next line with a neighbour node
-                    skip_lines(grid, int(line - curr_line[j] - 1))
-                    # read the line and store its value
-                    a = grid.readline()
-                    arr[i + j * nnodes] = float(a)
-
-                    curr_line[j] = line
-                    skip = False
-
-            # replace no data's with NaN
-            bn.replace(arr, self.nodata, np.nan)
-            # compute the required statistics
+        # discard the nodes outside the grid
+        inside = ((neighbours_nodes[:, 0] >= 1) &
+                  (neighbours_nodes[:, 0] <= self.dx) &
+                  (neighbours_nodes[:, 1] >= 1) &
+                  (neighbours_nodes[:, 1] <= self.dy))
+        neighbours_nodes = neighbours_nodes[inside]
+        # sort the nodes by their line in the grid file (y, then x)
+        neighbours_nodes = neighbours_nodes[np.lexsort((neighbours_nodes[:, 0],
+                                                        neighbours_nodes[:, 1]))]
+        return loc, neighbours_nodes
+
+    def _nodes_lines(self, nodes):
+        """Lines numbers of the given nodes [x, y] in every layer, in
+        ascending order, layer by layer.
+
+        """
+        # this yields a N*M matrix, with N equal to the number of nodes, and M
+        # equal to the number of layers in the grid.
+        lines = np.array([line_zmirror(node, [self.dx, self.dy, self.dz])
+                          for node in nodes])
+        return lines.T.ravel()
+
+    def area_values(self, loc, tol=0):
+        """Retrieve the simulated values within a circular (only horizontaly)
+        area of radius `tol` around the point located at `loc`, in every
+        realisation.
+
+        Parameters
+        ----------
+        loc : array_like
+            Location of the vertical line [x, y].
+        tol : number, default 0
+            Tolerance radius used to search for neighbour nodes.
+
+        Returns
+        -------
+        values : ndarray
+            Read-only array with shape (nfiles, dz, number of neighbour nodes),
+            where missing data is replaced with NaN.
+
+        Notes
+        -----
+        The values are kept in `cache`, so that any other statistic requested
+        for the same location and radius does not read the files again.
+
+        """
+        loc, neighbours_nodes = self._area_nodes(loc, tol)
+        key = (tuple(loc), tol)
+        if key in self.cache:
+            return self.cache[key]
+        nnodes = neighbours_nodes.shape[0]
+
+        if self.cube is not None:
+            values = self.cube[:, :, neighbours_nodes[:, 1] - 1,
+                               neighbours_nodes[:, 0] - 1].astype('float64')
+        else:
+            values = self._read_lines(self._nodes_lines(neighbours_nodes))
+            values = values.reshape((self.nfiles, self.dz, nnodes))
+        return self._cache_values(key, values)
+
+    def locations_values(self, locs):
+        """Retrieve the simulated values within circular (only horizontaly)
+        areas around several locations, in every realisation, reading each
+        file only once.
+
+        Parameters
+        ----------
+        locs : list of array_like
+            Location of each vertical line and its tolerance radius,
+            [x, y, tol].
+
+        Returns
+        -------
+        list of ndarray
+            One array for each location, with shape (nfiles, dz, number of
+            neighbour nodes), where missing data is replaced with NaN.
+
+        See Also
+        --------
+        area_values : same for one location.
+
+        """
+        if self.cube is not None:
+            return [self.area_values(loc[:2], loc[2]) for loc in locs]
+
+        areas = [self._area_nodes(loc[:2], loc[2]) for loc in locs]
+        keys = [(tuple(area[0]), loc[2]) for area, loc in zip(areas, locs)]
+        missing = [i for i, key in enumerate(keys) if key not in self.cache]
+        if missing:
+            lines = [self._nodes_lines(areas[i][1]) for i in missing]
+            # read the lines needed by every location in one pass
+            union, inverse = np.unique(np.concatenate(lines),
+                                       return_inverse=True)
+            values = self._read_lines(union)
+            bounds = np.cumsum([0] + [area.shape[0] for area in lines])
+            for j, i in enumerate(missing):
+                self._cache_values(keys[i], values[
+                    :, inverse[bounds[j]:bounds[j + 1]]].reshape(
+                        (self.nfiles, self.dz, areas[i][1].shape[0])))
+        return [self.cache[key] for key in keys]
+
+    def _cache_values(self, key, values):
+        """Keep the values of a location in `cache`, as a read-only array.
+
+        """
+        values.flags.writeable = False
+        self.cache[key] = values
+        return values
+
+    def _read_lines(self, lines):
+        """Read the given lines, in ascending order, of every file.
+
+        Returns
+        -------
+        values : ndarray
+            Array with shape (nfiles, number of lines), where missing data is
+            replaced with NaN.
+
+        """
+        values = np.zeros((self.nfiles, lines.shape[0]))
+        for j, gridfile in enumerate(self.files):
+            if _opened(gridfile):
+                grid = gridfile
+            else:
+                grid = open(gridfile, 'rb')
+            if self.indexes:
+                values[j] = read_indexed(grid, self.indexes[j], lines)
+            else:
+                values[j] = read_lines(grid, lines, self.header)
+            if not _opened(gridfile):
+                grid.close()
+
+        # reset the reading pointer in each grid file
+        self.reset_read()
+        # replace no data's with NaN
+        bn.replace(values, self.nodata, np.nan)
+        return values
+
+
+class RunningStats(object):
+
+    """Running moments of a set of nodes, updated with one realisation at a
+    time, without keeping the previous ones.
+
+    The moments are updated with Welford's algorithm (extended to the third
+    moment), which is numerically stable, and missing values (NaN) are
+    ignored node by node.
+
+    Attributes
+    ----------
+    count : ndarray
+        Number of values added to each node.
+    mean : ndarray
+        Mean of each node.
+    m2 : ndarray
+        Sum of the squared deviations from the mean of each node.
+    m3 : ndarray
+        Sum of the cubed deviations from the mean of each node.
+
+    """
+
+    def __init__(self, shape):
+        """Constructor to initialise a RunningStats instance.
+
+        Parameters
+        ----------
+        shape : int or tuple of int
+            Shape of the array of nodes.
+
+        """
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.m3 = np.zeros(shape)
+
+    def update(self, values):
+        """Add the values of one realisation.
+
+        Parameters
+        ----------
+        values : array_like
+            Value of each node, with the same shape given in the constructor.
+            Missing values must be NaN.
+
+        """
+        values = np.asarray(values, dtype='float64')
+        valid = ~np.isnan(values)
+        n1 = self.count
+        n = n1 + valid
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(valid, values - self.mean, 0)
+            delta_n = np.where(valid, delta / n, 0)
+        term1 = delta * delta_n * n1
+        self.mean += delta_n
+        self.m3 += term1 * delta_n * (n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+        self.count = n
+
+    def merge(self, other):
+        """Add the moments accumulated by another RunningStats instance with
+        the same shape.
+
+        Parameters
+        ----------
+        other : RunningStats
+            Moments of another set of realisations.
+
+        """
+        na = self.count
+        nb = other.count
+        n = na + nb
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.mean + delta * nb / n
+            m2 = self.m2 + other.m2 + delta ** 2 * na * nb / n
+            m3 = (self.m3 + other.m3 + delta ** 3 * na * nb * (na - nb) / n ** 2
+                  + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        empty = n == 0
+        self.mean = np.where(empty, 0, mean)
+        self.m2 = np.where(empty, 0, m2)
+        self.m3 = np.where(empty, 0, m3)
+        self.count = n
+
+    def results(self, lmean=False, lskew=False, lvar=False, lstd=False,
+                lcoefvar=False):
+        """Calculate the statistics from the accumulated moments.
+
+        Parameters
+        ----------
+        lmean, lskew, lvar, lstd, lcoefvar : boolean, default False
+            Statistics to calculate, see `block_stats`.
+
+        Returns
+        -------
+        dict of ndarray
+            One array for each calculated statistic, with the same keys used by
+            `block_stats`.
+
+        """
+        results = dict()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(self.count > 0, self.mean, np.nan)
+            var = np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+            std = np.sqrt(var)
             if lmean:
-                meanline[layer] = bn.nanmean(arr)
-            if lmed:
-                medline[layer] = bn.nanmedian(arr)
+                results['mean'] = mean
             if lskew:
-                skewline[layer] = pd.Series(arr).skew()
+                results['skewness'] = _skew_moments(self.count, self.m2,
+                                                    self.m3)
             if lvar:
-                varline[layer] = bn.nanvar(arr, ddof=1)
+                results['variance'] = var
             if lstd:
-                stdline[layer] = bn.nanstd(arr, ddof=1)
+                results['std'] = std
             if lcoefvar:
-                if lstd and lmean:
-                    coefvarline[layer] = stdline[layer] / meanline[layer] * 100
-                else:
-                    std = bn.nanstd(arr, ddof=1)
-                    mean = bn.nanmean(arr)
-                    coefvarline[layer] = std / mean * 100
-            if lperc:
-                percline[layer] = pd.Series(arr).quantile([(1 - p) / 2,
-                                                           1 - (1 - p) / 2])
-            if save and tol == 0:
-                # FIXME: not working with the tolerance feature
-                # need to adjust the arrpset or cherry-pick arr
-                arrpset = PointSet('realisations at location ({0}, {1}, {2})'.
-                                   format(loc[0], loc[1], layer * self.cellz +
-                                          self.zi), self.nodata, 3,
-                                   ['x', 'y', 'value'],
-                                   values=np.zeros((self.nfiles, 3)))
-                arrout = os.path.join(os.path.dirname(self.files[0].name),
-                                      'sim values at ({0}, {1}, {2}).prn'.format(
-                                          loc[0], loc[1], layer * self.cellz
-                                          + self.zi))
-                arrpset.values.iloc[:, 2] = arr
-                arrpset.values.iloc[:, :2] = np.repeat(np.array(loc)
-                                                       [np.newaxis, :],
-                                                       self.nfiles, axis=0)
-                arrpset.save(arrout, header=True)
-
-        ncols = sum((lmean, lmed, lvar, lstd, lcoefvar, lskew))
-        if lperc:
-            ncols += 2
-        statspset = PointSet(name='vertical line stats at (x,y) = ({0},{1})'.
-                             format(loc[0], loc[1]), nodata=self.nodata,
-                             nvars=3 + ncols, varnames=['x', 'y', 'z'],
-                             values=np.zeros((self.dz, 3 + ncols)))
-
-        statspset.values.iloc[:, :3] = (np.column_stack
-                                        (((np.repeat(np.array(loc)
-                                                     [np.newaxis, :], self.dz,
-                                                     axis=0)),
-                                          np.arange(self.zi, self.zi +
-                                                    self.cellz * self.dz))))
-
-        j = 3
-        if lmean:
-            statspset.varnames.append('mean')
-            statspset.values.iloc[:, j] = meanline
-            j += 1
-        if lmed:
-            statspset.varnames.append('median')
-            statspset.values.iloc[:, j] = medline
-            j += 1
-        if lskew:
-            statspset.varnames.append('skewness')
-            statspset.values.iloc[:, j] = skewline
-            j += 1
-        if lvar:
-            statspset.varnames.append('variance')
-            statspset.values.iloc[:, j] = varline
-            j += 1
-        if lstd:
-            statspset.varnames.append('std')
-            statspset.values.iloc[:, j] = stdline
-            j += 1
-        if lcoefvar:
-            statspset.varnames.append('coefvar')
-            statspset.values.iloc[:, j] = coefvarline
-            j += 1
-        if lperc:
-            statspset.varnames.append('lperc')
-            statspset.varnames.append('rperc')
-            statspset.values.iloc[:, -2:] = percline
+                results['coefvar'] = std / mean * 100
+        return results
 
-        # reset the reading pointer in each grid file
-        self.reset_read()
-        # update varnames
-        statspset.flush_varnames()
-        return statspset
+
+class QuantileSketch(object):
+
+    """Approximate quantiles of a set of nodes, updated with one realisation
+    at a time, without keeping every value.
+
+    Each node keeps a hierarchy of buffers, like the KLL sketch: when a buffer
+    holds `k` values, they are sorted and every other one is promoted to the
+    next level, where each value counts twice as much. The buffers of every
+    node are compacted at the same time, so that the operations are
+    vectorised along the nodes, although the values promoted in each node are
+    drawn independently. Missing values (NaN) are ignored node by node.
+
+    The quantiles are exact while fewer than `k` values were added, and
+    linearly interpolated as in `numpy.nanpercentile`. Otherwise, the rank
+    error is of the order of `log2(n / k) / k`, where `n` is the number of
+    values added to a node. The memory used is proportional to
+    `k * log2(n / k)` per node, instead of `n`.
+
+    Attributes
+    ----------
+    k : int
+        Number of values kept in each level, which controls the error.
+    levels : list of ndarray
+        Buffer of each level, with shape (number of nodes, 2 * k), padded with
+        NaN.
+    counts : list of ndarray
+        Number of values in each node of each level.
+
+    """
+
+    def __init__(self, shape, k=200, seed=None):
+        """Constructor to initialise a QuantileSketch instance.
+
+        Parameters
+        ----------
+        shape : int or tuple of int
+            Shape of the array of nodes.
+        k : int, default 200
+            Number of values kept in each level. The larger it is, the more
+            accurate and memory consuming the sketch is.
+        seed : int, optional
+            Seed of the random choice made at each compaction.
+
+        """
+        self.shape = shape
+        self.nodes = int(np.prod(shape))
+        self.k = int(k)
+        self.levels = list()
+        self.counts = list()
+        self._random = np.random.RandomState(seed)
+        self._add_level()
+
+    def _add_level(self):
+        """Append an empty level.
+
+        """
+        self.levels.append(np.empty((self.nodes, 2 * self.k)) * np.nan)
+        self.counts.append(np.zeros(self.nodes, dtype='int64'))
+
+    def update(self, values):
+        """Add the values of one realisation.
+
+        Parameters
+        ----------
+        values : array_like
+            Value of each node, with the same shape given in the constructor.
+            Missing values must be NaN.
+
+        """
+        values = np.asarray(values, dtype='float64').reshape((self.nodes, 1))
+        self._append(0, values, (~np.isnan(values[:, 0])).astype('int64'))
+
+    def merge(self, other):
+        """Add the values summarised by another QuantileSketch instance with
+        the same shape.
+
+        Parameters
+        ----------
+        other : QuantileSketch
+            Sketch of another set of realisations.
+
+        """
+        for level, (items, counts) in enumerate(zip(other.levels,
+                                                    other.counts)):
+            if counts.any():
+                self._append(level, np.sort(items, axis=1), counts)
+
+    def _append(self, level, items, counts):
+        """Append the first `counts` items of each row to a level, compacting
+        it if it gets full.
+
+        """
+        if level == len(self.levels):
+            self._add_level()
+        buf = self.levels[level]
+        rows, cols = np.nonzero(np.arange(items.shape[1]) < counts[:, None])
+        buf[rows, self.counts[level][rows] + cols] = items[rows, cols]
+        self.counts[level] += counts
+        if self.counts[level].max() >= self.k:
+            self._compact(level)
+
+    def _compact(self, level):
+        """Promote every other value of a level to the next one.
+
+        """
+        items = np.sort(self.levels[level], axis=1)
+        counts = self.counts[level]
+        pairs = counts // 2
+        # keep either the even or the odd values, drawn for each node
+        rows = np.arange(self.nodes)
+        offset = self._random.randint(2, size=self.nodes)
+        promoted = items[rows[:, None], offset[:, None] +
+                         2 * np.arange(pairs.max())]
+        # the largest value is left behind if the count is odd
+        odd = counts % 2 == 1
+        self.levels[level].fill(np.nan)
+        self.levels[level][odd, 0] = items[rows[odd], counts[odd] - 1]
+        self.counts[level] = counts % 2
+        self._append(level + 1, promoted, pairs)
+
+    def quantiles(self, q):
+        """Calculate the quantiles of each node.
+
+        Parameters
+        ----------
+        q : number or array_like
+            Quantile, or sequence of quantiles, between 0 and 1.
+
+        Returns
+        -------
+        ndarray
+            Array with shape (number of nodes, number of quantiles), or
+            (number of nodes, ) if `q` is a number. Nodes without values yield
+            NaN.
+
+        """
+        q = np.asarray(q, dtype='float64')
+        items = np.hstack(self.levels)
+        weights = np.hstack([np.repeat(2.0 ** level, 2 * self.k)
+                             for level in xrange(len(self.levels))])
+        order = np.argsort(items, axis=1)
+        rows = np.arange(self.nodes)[:, None]
+        items = items[rows, order]
+        weights = np.where(np.isnan(items), 0, weights[order])
+        cumw = np.cumsum(weights, axis=1)
+        total = cumw[:, -1]
+        # rank of the centre of each item, so that the ranks of a sample of
+        # equally weighted items are 0, 1, ..., n - 1
+        ranks = cumw - (weights + 1) / 2
+        nvalid = (weights > 0).sum(axis=1)
+
+        # search the ranks of every row at once, shifting each row apart
+        span = total.max() + 2
+        ranks = np.where(weights > 0, ranks, span - 1) + rows * span
+        targets = q.ravel()[None, :] * (total[:, None] - 1) + rows * span
+        first = rows * items.shape[1]
+        last = first + np.maximum(nvalid[:, None], 1) - 1
+        lower = np.searchsorted(ranks.ravel(), targets.ravel(), side='right')
+        lower = np.clip(lower.reshape(targets.shape) - 1, first, last)
+        upper = np.minimum(lower + 1, last)
+        ranks = ranks.ravel()
+        items = items.ravel()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(ranks[upper] > ranks[lower],
+                            (targets - ranks[lower]) /
+                            (ranks[upper] - ranks[lower]), 0)
+        frac = np.clip(frac, 0, 1)
+        result = items[lower] + frac * (items[upper] - items[lower])
+        result[nvalid == 0] = np.nan
+        if q.ndim == 0:
+            return result[:, 0]
+        return result
+
+
+class GridStream(GridFiles):
+
+    """Accumulate the statistics of the simulated maps while they are being
+    generated, one realisation at a time, so that the results are ready as
+    soon as the last one is finished.
+
+    It may be used in place of a GridFiles instance. Each realisation is read
+    once, when it is ingested, and it may be deleted right afterwards.
+    Realisations generated in memory may be added as arrays, without being
+    written to disk.
+
+    If a location is given, only the values within a circular area around it
+    are kept, and `stats_area` is available at that location. Otherwise, only
+    the running moments of every node are kept, and `stats` is available for
+    the statistics that do not need the complete distribution, unless a
+    quantile sketch of every node is kept as well.
+
+    Attributes
+    ----------
+    loc : array_like or None
+        Location of the vertical line [x, y].
+    tol : number
+        Tolerance radius used to search for neighbour nodes.
+    moments : RunningStats
+        Running moments of each layer (of each node, without location).
+    columns : list of ndarray or None
+        Values within the area, with shape (dz, number of neighbour nodes), of
+        each ingested realisation.
+    sketch : QuantileSketch or None
+        Quantile sketch of each node, without location.
+
+    See Also
+    --------
+    GridFiles : statistics of the realisations previously saved.
+
+    """
+
+    def __init__(self, dims, first_coord, cells_size, no_data, headerin=0,
+                 loc=None, tol=0, sketch=None):
+        """Constructor to initialise a GridStream instance.
+
+        Parameters
+        ----------
+        dims : array_like
+            Number of nodes in each direction, [dx, dy, dz]
+        first_coord : array_like
+            First coordinate in each direction, [xi, yi, zi].
+        cells_size : array_like
+            Nodes size in each direction, [cellx, celly, cellz].
+        no_data : number
+            Missing data value.
+        headerin : int, default 0
+            Number of lines in the header.
+        loc : array_like, optional
+            Location of the vertical line [x, y]. If not specified, the whole
+            grid is considered.
+        tol : number, default 0
+            Tolerance radius used to search for neighbour nodes.
+        sketch : int, optional
+            Keep a `QuantileSketch` of this size of every node, so that the
+            median and the percentiles are available without location.
+
+        """
+        GridFiles.__init__(self)
+        self._set_grid(dims, first_coord, cells_size, no_data, headerin)
+        self.loc = loc
+        self.tol = tol
+        self.folder = None
+        self.sketch = None
+        if loc is None:
+            self._lines = None
+            self.columns = None
+            self.moments = RunningStats(self.cells)
+            if sketch:
+                self.sketch = QuantileSketch(self.cells, sketch)
+        else:
+            self._nodes, nodes = self._area_nodes(loc, tol)
+            self._lines = self._nodes_lines(nodes)
+            self.columns = list()
+            self.moments = RunningStats(self.dz)
+
+    def ingest(self, path, remove=False):
+        """Add one realisation.
+
+        Parameters
+        ----------
+        path : string
+            File path to the realisation.
+        remove : boolean, default False
+            Delete the file after reading it.
+
+        """
+        with open(path, 'rb') as grid:
+            if self._lines is None:
+                skip_lines(grid, self.header)
+                values = read_values(grid, self.cells)
+            else:
+                values = read_lines(grid, self._lines, self.header)
+        self._update(values)
+
+        if self.folder is None:
+            self.folder = os.path.dirname(path)
+        if remove:
+            os.remove(path)
+        else:
+            self.files.append(path)
+
+    def add(self, values):
+        """Add one realisation, given as an array.
+
+        Parameters
+        ----------
+        values : array_like
+            Values of every node, in the order of the grid file (x cycles
+            fastest, then y, then z).
+
+        """
+        values = np.asarray(values, dtype='float64').ravel()
+        if values.size != self.cells:
+            raise ValueError('Expected {0} values, got {1}.'.
+                             format(self.cells, values.size))
+        if self._lines is None:
+            values = values.copy()
+        else:
+            values = values[self._lines.astype('int') - 1]
+        self._update(values)
+
+    def _update(self, values):
+        """Update the statistics with the values of one realisation.
+
+        """
+        # replace no data's with NaN
+        bn.replace(values, self.nodata, np.nan)
+        if self._lines is None:
+            self.moments.update(values)
+            if self.sketch is not None:
+                self.sketch.update(values)
+        else:
+            values = values.reshape((self.dz, -1))
+            self.columns.append(values)
+            for node in values.T:
+                self.moments.update(node)
+        self.nfiles += 1
+
+    def area_values(self, loc, tol=0):
+        """Retrieve the values kept within the area given in the constructor,
+        in every ingested realisation.
+
+        Parameters
+        ----------
+        loc : array_like
+            Location of the vertical line [x, y].
+        tol : number, default 0
+            Tolerance radius used to search for neighbour nodes.
+
+        Returns
+        -------
+        values : ndarray
+            Array with shape (nfiles, dz, number of neighbour nodes), where
+            missing data is replaced with NaN.
+
+        Raises
+        ------
+        ValueError
+            The area is not the one given in the constructor.
+
+        """
+        if (self.columns is None or tol != self.tol or
+                not np.array_equal(self._area_nodes(loc, tol)[0],
+                                   self._nodes)):
+            raise ValueError('Only the values around the location given in '
+                             'the constructor are kept.')
+        return np.array(self.columns).reshape((self.nfiles, self.dz, -1))
+
+    def stats_area(self, loc, tol=0, lmean=False, lmed=False, lskew=False,
+                   lvar=False, lstd=False, lcoefvar=False, lperc=False,
+                   p=0.95, save=False, sketch=None):
+        """Calculate some statistics among every ingested realisation,
+        considering the area given in the constructor.
+
+        The mean, skewness, variance, standard deviation and coefficient of
+        variation are taken from the running moments. See
+        `GridFiles.stats_area` for the parameters.
+
+        Returns
+        -------
+        statspset : PointSet
+            PointSet instance containing the calculated statistics.
+
+        Raises
+        ------
+        ValueError
+            The area is not the one given in the constructor.
+
+        """
+        values = self.area_values(loc, tol)
+        lstats = self.moments.results(lmean, lskew, lvar, lstd, lcoefvar)
+        if lmed or lperc:
+            lstats.update(block_stats(_layers_block(values), lmed=lmed,
+                                      lperc=lperc, p=p, sketch=sketch))
+        if save and tol == 0:
+            self._save_values(values, self._nodes, self.folder)
+        return vline_pset(lstats, self._nodes, self.zi, self.cellz,
+                          self.nodata, self.dz)
+
+    def stats(self, lmean=False, lmed=False, lskew=False, lvar=False,
+              lstd=False, lcoefvar=False, lperc=False, p=0.95, block=None):
+        """Calculate some statistics among every ingested realisation, from
+        the running moments and the quantile sketch of every node. See
+        `GridFiles.stats` for the parameters.
+
+        Returns
+        -------
+        retdict : dict of GridArr
+            Dictionary containing one GridArr for each calculated statistic.
+
+        Raises
+        ------
+        ValueError
+            The median or the percentiles were requested without a quantile
+            sketch, or only the values around a location are kept.
+
+        """
+        if self._lines is not None:
+            raise ValueError('Only the values around a location are kept.')
+        if (lmed or lperc) and self.sketch is None:
+            raise ValueError('The median and the percentiles are not '
+                             'available from the running moments.')
+        maps = self.moments.results(lmean, lskew, lvar, lstd, lcoefvar)
+        if lmed:
+            maps['median'] = self.sketch.quantiles(0.5)
+        if lperc:
+            maps['perc'] = self.sketch.quantiles([(1 - p) / 2,
+                                                  1 - (1 - p) / 2])
+        return self._stats_grids(maps)
+
+
+class GridArrays(GridFiles):
+
+    """Keep the realisations in memory, so that they can be handed over
+    directly from an in-process simulation, without being written to disk.
+
+    It may be used in place of a GridFiles instance, as the realisations are
+    kept in its `cube`, with shape (nfiles, dz, dy, dx) and missing data
+    stored as NaN. The cube may be backed by shared memory, so that it is
+    not copied to the processes of `stats(cores=n)`.
+
+    Attributes
+    ----------
+    folder : string or None
+        Directory where the values used in `stats_area` are saved.
+    shared : string or None
+        Path to the file in shared memory backing the cube, if any.
+
+    See Also
+    --------
+    GridFiles : realisations saved in files.
+    GridStream : statistics of realisations which are not kept.
+
+    """
+
+    def __init__(self, dims, first_coord, cells_size, no_data, nsim=None,
+                 shared=False, folder=None, dtype='float64'):
+        """Constructor to initialise a GridArrays instance.
+
+        Parameters
+        ----------
+        dims : array_like
+            Number of nodes in each direction, [dx, dy, dz]
+        first_coord : array_like
+            First coordinate in each direction, [xi, yi, zi].
+        cells_size : array_like
+            Nodes size in each direction, [cellx, celly, cellz].
+        no_data : number
+            Missing data value.
+        nsim : int, optional
+            Number of realisations, to allocate the memory only once.
+        shared : boolean, default False
+            Keep the cube in shared memory (a memory-mapped file in /dev/shm,
+            if available). `nsim` must be given.
+        folder : string, optional
+            Directory where the values used in `stats_area` are saved.
+        dtype : string, default 'float64'
+            Type of the values in the cube. Use 'float32' to halve the memory.
+
+        """
+        GridFiles.__init__(self)
+        self._set_grid(dims, first_coord, cells_size, no_data, 0)
+        self.folder = folder
+        self.shared = None
+        shape = (nsim or 0, self.dz, self.dy, self.dx)
+        if shared:
+            if not nsim:
+                raise ValueError('The number of realisations is needed to '
+                                 'allocate shared memory.')
+            shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            fd, self.shared = tempfile.mkstemp(suffix='.npy', dir=shm)
+            os.close(fd)
+            self._buffer = np.lib.format.open_memmap(self.shared, mode='w+',
+                                                     dtype=dtype, shape=shape)
+        else:
+            self._buffer = np.empty(shape, dtype=dtype)
+        self.cube = self._buffer[:0]
+
+    def __getstate__(self):
+        """Pickle the path to the shared memory instead of the cube, if it is
+        shared.
+
+        """
+        state = self.__dict__.copy()
+        state['cache'] = dict()
+        if self.shared is not None:
+            state['_buffer'] = None
+            state['cube'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Map the shared memory again, read-only, after unpickling.
+
+        """
+        self.__dict__.update(state)
+        if self.shared is not None:
+            self._buffer = np.load(self.shared, mmap_mode='r')
+            self.cube = self._buffer[:self.nfiles]
+
+    def add(self, values):
+        """Add one realisation, given as an array.
+
+        Parameters
+        ----------
+        values : array_like
+            Values of every node, in the order of the grid file (x cycles
+            fastest, then y, then z).
+
+        """
+        values = np.asarray(values, dtype='float64').ravel()
+        if values.size != self.cells:
+            raise ValueError('Expected {0} values, got {1}.'.
+                             format(self.cells, values.size))
+        if self.nfiles == self._buffer.shape[0]:
+            if self.shared is not None:
+                raise ValueError('The shared memory is full.')
+            grown = np.empty((max(1, 2 * self.nfiles),) +
+                             self._buffer.shape[1:], dtype=self._buffer.dtype)
+            grown[:self.nfiles] = self._buffer
+            self._buffer = grown
+        self._buffer[self.nfiles] = np.where(
+            values == self.nodata, np.nan,
+            values).reshape((self.dz, self.dy, self.dx))
+        self.nfiles += 1
+        self.cube = self._buffer[:self.nfiles]
+        self.cache = dict()
+
+    def export(self, first_file):
+        """Write every realisation to a file, as DSS does (without header).
+
+        Parameters
+        ----------
+        first_file : string
+            File path to the first realisation. The following ones are
+            numbered as in `filename_indexing`.
+
+        """
+        self.files = list()
+        for i in xrange(self.nfiles):
+            if i:
+                path = filename_indexing(first_file, i + 1)
+            else:
+                path = first_file
+            values = self.cube[i].ravel().astype('float64')
+            values[np.isnan(values)] = self.nodata
+            GridArr(dx=self.dx, dy=self.dy, dz=self.dz, nodata=self.nodata,
+                    val=values).save(path, header=False)
+            self.files.append(path)
+
+    def _values_folder(self):
+        """Directory where the values used to calculate the statistics are
+        saved.
+
+        """
+        return self.folder
+
+    def dump(self):
+        """Release the realisations, and the shared memory.
+
+        """
+        GridFiles.dump(self)
+        self._buffer = np.empty((0, self.dz, self.dy, self.dx),
+                                dtype=self._buffer.dtype)
+        if self.shared is not None:
+            os.remove(self.shared)
+            self.shared = None
+
+    def purge(self):
+        """Release the realisations and remove the exported files, if any.
+
+        """
+        self.dump()
+        for path in self.files:
+            if os.path.isfile(path):
+                os.remove(path)
+        self.files = list()
+
+
+class SimulationCache(object):
+
+    """Keep sets of realisations in a folder, to be reused whenever the same
+    simulation is requested again, e.g., to homogenise the same stations with
+    other detection or correction parameters.
+
+    Each set is saved as a realisations cube in NumPy format (.npy), with
+    shape (nsim, dz, dy, dx) and missing data stored as NaN, named after a key
+    which identifies the simulation (see `launchers.dss.simulation_key`). When
+    the folder grows beyond `maxsize`, the least recently used sets are
+    removed.
+
+    Attributes
+    ----------
+    folder : string
+        Directory where the realisations are kept.
+    maxsize : int
+        Maximum size of the folder, in bytes.
+    dtype : string
+        Type of the values in the cubes.
+    hits : int
+        Number of simulations found in the cache.
+    misses : int
+        Number of simulations not found in the cache.
+    evictions : int
+        Number of sets removed to keep the folder size.
+
+    """
+
+    def __init__(self, folder, maxsize=2 ** 30, dtype='float64'):
+        """Constructor to initialise a SimulationCache instance.
+
+        Parameters
+        ----------
+        folder : string
+            Directory where the realisations are kept. It is created if it does
+            not exist.
+        maxsize : int, default 1 GiB
+            Maximum size of the folder, in bytes. The sets already in the
+            folder are evicted to this size.
+        dtype : string, default 'float64'
+            Type of the values in the cubes. Use 'float32' to keep twice as
+            many realisations, which will then differ slightly from the
+            simulated ones.
+
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.folder = folder
+        self.maxsize = maxsize
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evict()
+
+    def path(self, key):
+        """Cube file path of a set of realisations.
+
+        """
+        return os.path.join(self.folder, key + '.npy')
+
+    def get(self, key):
+        """Look for a set of realisations, and count the hit or miss.
+
+        Parameters
+        ----------
+        key : string
+            Simulation key.
+
+        Returns
+        -------
+        numpy.memmap or None
+            Read-only memory-mapped cube, or None if it is not in the cache.
+
+        """
+        path = self.path(key)
+        try:
+            cube = np.load(path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            # the modification time tells the last use
+            os.utime(path, None)
+        except OSError:
+            # e.g., a read-only cache, which is still used
+            pass
+        self.hits += 1
+        return cube
+
+    def replay(self, cube, callback, nodata):
+        """Hand over each realisation of a cached set, as a simulation
+        backend does.
+
+        Parameters
+        ----------
+        cube : ndarray
+            Cube returned by `get`.
+        callback : function
+            Function called with the number of each realisation and its
+            values, with missing data as `nodata`.
+        nodata : number
+            Missing data value.
+
+        """
+        for i in xrange(cube.shape[0]):
+            values = cube[i].ravel().astype('float64')
+            values[np.isnan(values)] = nodata
+            callback(i + 1, values)
+
+    def writer(self, key, nsim, dims, nodata):
+        """Start saving a new set of realisations.
+
+        Parameters
+        ----------
+        key : string
+            Simulation key.
+        nsim : int
+            Number of realisations.
+        dims : array_like
+            Number of nodes in each direction, [dx, dy, dz].
+        nodata : number
+            Missing data value.
+
+        Returns
+        -------
+        CacheWriter
+
+        """
+        return CacheWriter(self, key, nsim, dims, nodata)
+
+    def size(self):
+        """Size of every set in the folder, in bytes.
+
+        """
+        return sum(os.path.getsize(path) for path, mtime in self._entries())
+
+    def evict(self, keep=None):
+        """Remove the least recently used sets, until the folder is not larger
+        than `maxsize`.
+
+        Parameters
+        ----------
+        keep : string, optional
+            Key of a set which is never removed.
+
+        """
+        entries = self._entries()
+        total = sum(os.path.getsize(path) for path, mtime in entries)
+        for path, mtime in sorted(entries, key=lambda entry: entry[1]):
+            if total <= self.maxsize:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            size = os.path.getsize(path)
+            try:
+                os.remove(path)
+            except OSError:
+                # removed meanwhile, e.g., by another process
+                continue
+            total -= size
+            self.evictions += 1
+
+    def _entries(self):
+        """Path and last use of each set in the folder.
+
+        """
+        entries = list()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.endswith('.npy'):
+                try:
+                    entries.append((path, os.path.getmtime(path)))
+                except OSError:
+                    pass
+        return entries
+
+    def report(self):
+        """Summary of the cache use.
+
+        Returns
+        -------
+        string
+
+        """
+        entries = len(self._entries())
+        return ('Simulation cache: {0} hits, {1} misses, {2} evicted, '
+                '{3:.1f} MB in {4} sets.'.format(self.hits, self.misses,
+                                                 self.evictions,
+                                                 self.size() / 2.0 ** 20,
+                                                 entries))
+
+
+class CacheWriter(object):
+
+    """Save a set of realisations in a SimulationCache, one at a time, as
+    they are simulated. The set is only available in the cache after
+    `commit`.
+
+    """
+
+    def __init__(self, cache, key, nsim, dims, nodata):
+        """Constructor to initialise a CacheWriter instance. See
+        `SimulationCache.writer`.
+
+        """
+        self.cache = cache
+        self.key = key
+        self.nodata = nodata
+        self.shape = (nsim, dims[2], dims[1], dims[0])
+        fd, self.temp = tempfile.mkstemp(suffix='.tmp', dir=cache.folder)
+        os.close(fd)
+        self.cube = np.lib.format.open_memmap(self.temp, mode='w+',
+                                              dtype=cache.dtype,
+                                              shape=self.shape)
+        self.done = np.zeros(nsim, dtype='bool')
+
+    def add(self, simnum, values):
+        """Save one realisation.
+
+        Parameters
+        ----------
+        simnum : int
+            Realisation number, starting at 1.
+        values : array_like
+            Values of every node, in the order of the grid file.
+
+        """
+        values = np.asarray(values, dtype='float64').ravel()
+        self.cube[simnum - 1] = np.where(values == self.nodata, np.nan,
+                                         values).reshape(self.shape[1:])
+        self.done[simnum - 1] = True
+
+    def commit(self):
+        """Make the set available in the cache, if every realisation was
+        saved, and keep the cache size.
+
+        """
+        if not self.done.all():
+            self.discard()
+            return
+        self.cube.flush()
+        self.cube = None
+        path = self.cache.path(self.key)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(self.temp, path)
+        self.cache.evict(keep=self.key)
+
+    def discard(self):
+        """Drop the saved realisations.
+
+        """
+        self.cube = None
+        if os.path.isfile(self.temp):
+            os.remove(self.temp)
+
+
+class FilePool(object):
+
+    """Keep a limited number of files open at the same time, closing the least
+    recently used ones when needed.
+
+    The files are handled through `PooledFile` instances, which reopen the
+    file and restore the reading position whenever they are used again after
+    being closed by the pool.
+
+    Attributes
+    ----------
+    maxfiles : int
+        Maximum number of files open at the same time.
+    opened : collections.OrderedDict
+        Open PooledFile instances, from the least to the most recently used.
+
+    """
+
+    def __init__(self, maxfiles=256):
+        """Constructor to initialise a FilePool instance.
+
+        Parameters
+        ----------
+        maxfiles : int, default 256
+            Maximum number of files open at the same time.
+
+        """
+        self.maxfiles = max(1, int(maxfiles))
+        self.opened = collections.OrderedDict()
+        self._last = None
+
+    def open(self, path, mode='rb'):
+        """Provide a file handled by the pool. The file is only opened when it
+        is first read.
+
+        Parameters
+        ----------
+        path : string
+            File path.
+        mode : string, default 'rb'
+            Mode in which the file is opened.
+
+        Returns
+        -------
+        PooledFile
+
+        Raises
+        ------
+        IOError
+            The file does not exist.
+
+        """
+        if not os.path.isfile(path):
+            raise IOError('File {0} not found.'.format(path))
+        return PooledFile(path, self, mode)
+
+    def acquire(self, pooled):
+        """Open file handler of a PooledFile, closing the least recently used
+        one if there are too many files open.
+
+        """
+        if pooled is self._last:
+            return pooled.fid
+        if pooled.fid is None:
+            if len(self.opened) >= self.maxfiles:
+                self.release(next(iter(self.opened)))
+            pooled.fid = open(pooled.name, pooled.mode)
+            pooled.fid.seek(pooled.offset)
+        else:
+            del self.opened[pooled]
+        self.opened[pooled] = None
+        self._last = pooled
+        return pooled.fid
+
+    def release(self, pooled):
+        """Close the file handler of a PooledFile, keeping its position.
+
+        """
+        if pooled.fid is None:
+            return
+        pooled.offset = pooled.fid.tell()
+        pooled.fid.close()
+        pooled.fid = None
+        del self.opened[pooled]
+        if pooled is self._last:
+            self._last = None
+
+    def close(self):
+        """Close every open file.
+
+        """
+        for pooled in self.opened.keys():
+            self.release(pooled)
+
+
+class PooledFile(object):
+
+    """File handled by a `FilePool`, with the reading methods of a file
+    object.
+
+    Attributes
+    ----------
+    name : string
+        File path.
+    mode : string
+        Mode in which the file is opened.
+    offset : int
+        Reading position while the file is closed.
+    fid : file or None
+        File handler, if the file is open.
+    closed : boolean
+        The file was closed by the user, not by the pool.
+
+    """
+
+    def __init__(self, path, pool, mode='rb'):
+        """Constructor to initialise a PooledFile instance.
+
+        Parameters
+        ----------
+        path : string
+            File path.
+        pool : FilePool
+            Pool handling the file.
+        mode : string, default 'rb'
+            Mode in which the file is opened.
+
+        """
+        self.name = path
+        self.mode = mode
+        self.pool = pool
+        self.offset = 0
+        self.fid = None
+        self.closed = False
+
+    def readline(self, size=-1):
+        """Read one line, see `file.readline`.
+
+        """
+        return self.pool.acquire(self).readline(size)
+
+    def read(self, size=-1):
+        """Read at most `size` bytes, see `file.read`.
+
+        """
+        return self.pool.acquire(self).read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Set the reading position, see `file.seek`.
+
+        """
+        # there is no need to open the file to move to a known position
+        if self.fid is None and whence == os.SEEK_SET:
+            self.offset = offset
+        else:
+            self.pool.acquire(self).seek(offset, whence)
+
+    def tell(self):
+        """Current reading position, see `file.tell`.
+
+        """
+        if self.fid is None:
+            return self.offset
+        return self.fid.tell()
+
+    def close(self):
+        """Close the file.
+
+        """
+        self.pool.release(self)
+        self.closed = True
+
+
+class LineIndex(object):
+
+    """Byte offset of each line of a file with one value per line, such as a
+    grid file in GSLIB format, which allows to read any line directly.
+
+    Attributes
+    ----------
+    path : string
+        Indexed file path.
+    header : int
+        Number of lines in the header.
+    size : int
+        Size of the indexed file, in bytes, when it was indexed.
+    mtime : float
+        Last modification time of the indexed file, when it was indexed.
+    offsets : ndarray or None
+        Byte offset of each line after the header. None if the lines have
+        fixed width.
+    start : int
+        Byte offset of the first line after the header.
+    width : int or None
+        Length of every line, in bytes, if they have fixed width.
+    nlines : int
+        Number of lines after the header.
+
+    Notes
+    -----
+    Line numbers do not consider the header lines, i.e., the first line after
+    the header is number 1, as in `grid_to_line`.
+
+    """
+
+    def __init__(self, path, header=0, fixed_width=None):
+        """Constructor to initialise a LineIndex instance. The file is indexed
+        immediately.
+
+        Parameters
+        ----------
+        path : string
+            File path.
+        header : int, default 0
+            Number of lines in the header.
+        fixed_width : int, optional
+            Length of every line, in bytes, if the file was written with fixed
+            width. The offsets are then computed instead of searched, unless
+            the file size does not agree with it.
+
+        """
+        self.path = path
+        self.header = header
+        self.offsets = None
+        self.width = None
+        self.build(fixed_width)
+
+    def build(self, fixed_width=None, chunk=2 ** 22):
+        """Index the file, reading it once in chunks of a given size.
+
+        Parameters
+        ----------
+        fixed_width : int, optional
+            Length of every line, in bytes, if the file was written with fixed
+            width.
+        chunk : int, default 4 MiB
+            Number of bytes read at once.
+
+        """
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+        with open(self.path, 'rb') as fid:
+            skip_lines(fid, self.header)
+            self.start = fid.tell()
+            if (fixed_width and
+                    (self.size - self.start) % fixed_width == 0):
+                self.width = fixed_width
+                self.nlines = (self.size - self.start) // fixed_width
+                return
+
+            starts = [np.array([self.start])]
+            position = self.start
+            while True:
+                data = fid.read(chunk)
+                if not data:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(data, dtype='uint8') ==
+                                          ord('\n'))
+                starts.append(newlines + position + 1)
+                position += len(data)
+
+        offsets = np.concatenate(starts).astype('int64')
+        offsets = offsets[offsets < self.size]
+        self.nlines = offsets.shape[0]
+        widths = np.unique(np.diff(offsets))
+        if (widths.shape[0] == 1 and
+                self.size - offsets[-1] == widths[0]):
+            # fixed width, there is no need to keep the offsets
+            self.width = int(widths[0])
+        else:
+            self.offsets = offsets
+
+    def is_valid(self):
+        """Check if the indexed file was not changed since it was indexed.
+
+        Returns
+        -------
+        boolean
+
+        """
+        if not os.path.isfile(self.path):
+            return False
+        stat = os.stat(self.path)
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def offset(self, lines):
+        """Byte offset of given lines.
+
+        Parameters
+        ----------
+        lines : int or array_like
+            Lines numbers.
+
+        Returns
+        -------
+        int or ndarray
+            Byte offset of each line.
+
+        """
+        lines = np.asarray(lines)
+        if self.width:
+            return self.start + (lines - 1) * self.width
+        else:
+            return self.offsets[lines - 1]
+
+    def save(self, path=None):
+        """Write the index to a file.
+
+        Parameters
+        ----------
+        path : string, optional
+            File path. If not specified, it will be the indexed file path with
+            extension *.idx* appended.
+
+        """
+        if path is None:
+            path = self.path + '.idx'
+        if self.offsets is None:
+            offsets = np.zeros(0, dtype='int64')
+        else:
+            offsets = self.offsets
+        with open(path, 'wb') as fid:
+            np.savez(fid, offsets=offsets, header=self.header, size=self.size,
+                     mtime=self.mtime, start=self.start,
+                     width=self.width or 0, nlines=self.nlines)
+
+    @classmethod
+    def load(cls, path, idxpath=None):
+        """Read an index from a file written by `save`.
+
+        Parameters
+        ----------
+        path : string
+            Indexed file path.
+        idxpath : string, optional
+            Index file path. If not specified, it will be the indexed file path
+            with extension *.idx* appended.
+
+        Returns
+        -------
+        LineIndex
+
+        """
+        if idxpath is None:
+            idxpath = path + '.idx'
+        index = cls.__new__(cls)
+        index.path = path
+        with open(idxpath, 'rb') as fid:
+            stored = np.load(fid)
+            index.header = int(stored['header'])
+            index.size = int(stored['size'])
+            index.mtime = float(stored['mtime'])
+            index.start = int(stored['start'])
+            index.width = int(stored['width']) or None
+            index.nlines = int(stored['nlines'])
+            if index.width:
+                index.offsets = None
+            else:
+                index.offsets = stored['offsets']
+        return index
+
+
+def line_index(path, header=0, fixed_width=None, persist=True):
+    """Get the lines index of a file, reusing a saved one if the file did not
+    change since it was indexed.
+
+    Parameters
+    ----------
+    path : string
+        File path.
+    header : int, default 0
+        Number of lines in the header.
+    fixed_width : int, optional
+        Length of every line, in bytes, if the file was written with fixed
+        width.
+    persist : boolean, default True
+        Look for and save the index in a file named as the indexed file with
+        extension *.idx* appended.
+
+    Returns
+    -------
+    index : LineIndex
+
+    """
+    idxpath = path + '.idx'
+    if persist and os.path.isfile(idxpath):
+        try:
+            index = LineIndex.load(path, idxpath)
+        except (IOError, KeyError, ValueError):
+            index = None
+        if index and index.header == header and index.is_valid():
+            return index
+
+    index = LineIndex(path, header, fixed_width)
+    if persist:
+        try:
+            index.save(idxpath)
+        except IOError:
+            # the index is still usable, but it will not be reused
+            pass
+    return index
+
+
+def read_indexed(fid, index, lines):
+    """Read the values in the given lines of a file with one value per line,
+    going straight to each line.
+
+    Parameters
+    ----------
+    fid : file handle
+        Input file.
+    index : LineIndex
+        Lines index of the file.
+    lines : array_like
+        Numbers of the lines to read. The header lines are not considered (the
+        first line after the header is number 1).
+
+    Returns
+    -------
+    ndarray
+        One dimension array with the read values.
+
+    """
+    offsets = index.offset(lines)
+    values = np.zeros(len(offsets))
+    for i, offset in enumerate(offsets):
+        fid.seek(int(offset))
+        values[i] = float(fid.readline())
+    return values
+
+
+def cube_path(first_file):
+    """Path to the realisations cube packed from a set of realisations.
+
+    Parameters
+    ----------
+    first_file : string
+        File path to the first realisation.
+
+    Returns
+    -------
+    string
+        Cube file path.
+
+    """
+    return os.path.splitext(first_file)[0] + '.npy'
+
+
+def load_cube(path):
+    """Load a realisations cube, as written by `GridFiles.pack`.
+
+    Parameters
+    ----------
+    path : string
+        Cube file path.
+
+    Returns
+    -------
+    cube : numpy.memmap
+        Read-only memory-mapped array with shape (nsim, dz, dy, dx).
+    meta : dict
+        Grid properties: nsim, dims, first, cells_size, nodata and files.
+
+    """
+    with open(os.path.splitext(path)[0] + '.json', 'r') as fid:
+        meta = json.load(fid)
+    cube = np.load(path, mmap_mode='r')
+    return cube, meta
+
+
+def _integral(values):
+    """Check if every value is an integer which fits in int32.
+
+    """
+    return (values.shape[0] > 0 and np.isfinite(values).all() and
+            (np.abs(values) < 2 ** 31).all() and
+            (values == np.round(values)).all())
+
+
+def _index_stations(stations):
+    """Group the positions of the rows of each station.
+
+    Parameters
+    ----------
+    stations : ndarray
+        Station ID number of each row.
+
+    Returns
+    -------
+    dict
+        Positions of the rows of each station, as a slice if they are
+        contiguous, or as an array otherwise.
+
+    """
+    order = np.argsort(stations, kind='mergesort')
+    ids, starts = np.unique(stations[order], return_index=True)
+    ends = np.append(starts[1:], order.shape[0])
+    index = dict()
+    for station, start, end in zip(ids, starts, ends):
+        rows = order[start:end]
+        if rows[-1] - rows[0] + 1 == rows.shape[0]:
+            rows = slice(rows[0], rows[-1] + 1)
+        index[station] = rows
+    return index
+
+
+def _filename(gridfile):
+    """Path of a file handler or of a file path.
+
+    """
+    if _opened(gridfile):
+        return gridfile.name
+    else:
+        return gridfile
+
+
+def _opened(gridfile):
+    """Check if a grid file is given by its file handler instead of its path.
+
+    """
+    return not isinstance(gridfile, basestring)
+
+
+def _stats_worker(args):
+    """Auxiliary function to calculate the statistics of a range of nodes in
+    a worker process, see `GridFiles.stats`.
+
+    """
+    grids, first, last, kwargs = args
+    return grids._stats_range(first, last, **kwargs)
+
+
+def vline_stats(values, loc, zi, cellz, nodata, lmean=False, lmed=False,
+                lskew=False, lvar=False, lstd=False, lcoefvar=False,
+                lperc=False, p=0.95, sketch=None):
+    """Calculate some statistics of a vertical line, among every realisation
+    and every neighbour node in each layer.
+
+    Parameters
+    ----------
+    values : ndarray
+        Array with shape (number of realisations, number of layers, number of
+        neighbour nodes), as returned by `GridFiles.area_values`.
+    loc : array_like
+        Location of the vertical line, in grid nodes [x, y].
+    zi : number
+        Initial value in Z-axis.
+    cellz : number
+        Node size in Z-axis.
+    nodata : number
+        Missing data value.
+    lmean, lmed, lskew, lvar, lstd, lcoefvar, lperc : boolean, default False
+        Statistics to calculate, see `GridFiles.stats_area`.
+    p : number, default 0.95
+        Probability value.
+    sketch : int, optional
+        Estimate the percentiles with a `QuantileSketch` of this size.
+
+    Returns
+    -------
+    statspset : PointSet
+        PointSet instance containing the calculated statistics.
+
+    """
+    lstats = block_stats(_layers_block(values), None, lmean, lmed, lskew,
+                         lvar, lstd, lcoefvar, lperc, p, sketch)
+    return vline_pset(lstats, loc, zi, cellz, nodata, values.shape[1])
+
+
+def _layers_block(values):
+    """Reshape the values of a vertical line, with shape (number of
+    realisations, number of layers, number of neighbour nodes), to one column
+    per layer, with the values of every realisation and node.
+
+    """
+    nsim, dz, nnodes = values.shape
+    return values.transpose((0, 2, 1)).reshape((nsim * nnodes, dz))
+
+
+def vline_pset(lstats, loc, zi, cellz, nodata, dz):
+    """Build a PointSet with the statistics of a vertical line.
+
+    Parameters
+    ----------
+    lstats : dict of ndarray
+        Statistics of each layer, as returned by `block_stats`.
+    loc : array_like
+        Location of the vertical line, in grid nodes [x, y].
+    zi : number
+        Initial value in Z-axis.
+    cellz : number
+        Node size in Z-axis.
+    nodata : number
+        Missing data value.
+    dz : int
+        Number of layers.
+
+    Returns
+    -------
+    statspset : PointSet
+        PointSet instance with the columns x, y, z and one column for each
+        statistic in `lstats` (two for the percentiles).
+
+    """
+    lmean, lmed, lskew, lvar, lstd, lcoefvar, lperc = [
+        key in lstats for key in ('mean', 'median', 'skewness', 'variance',
+                                  'std', 'coefvar', 'perc')]
+    ncols = sum((lmean, lmed, lvar, lstd, lcoefvar, lskew))
+    if lperc:
+        ncols += 2
+    statspset = PointSet(name='vertical line stats at (x,y) = ({0},{1})'.
+                         format(loc[0], loc[1]), nodata=nodata,
+                         nvars=3 + ncols, varnames=['x', 'y', 'z'],
+                         values=np.zeros((dz, 3 + ncols)))
+
+    statspset.values.iloc[:, :3] = (np.column_stack
+                                    (((np.repeat(np.array(loc)
+                                                 [np.newaxis, :], dz,
+                                                 axis=0)),
+                                      np.arange(zi, zi + cellz * dz,
+                                                cellz)[:dz])))
+
+    j = 3
+    for flag, key in [(lmean, 'mean'), (lmed, 'median'), (lskew, 'skewness'),
+                      (lvar, 'variance'), (lstd, 'std'),
+                      (lcoefvar, 'coefvar')]:
+        if flag:
+            statspset.varnames.append(key)
+            statspset.values.iloc[:, j] = lstats[key]
+            j += 1
+    if lperc:
+        statspset.varnames.append('lperc')
+        statspset.varnames.append('rperc')
+        statspset.values.iloc[:, -2:] = lstats['perc']
+
+    # update varnames
+    statspset.flush_varnames()
+    return statspset
+
+
+def block_stats(arr, nodata=None, lmean=False, lmed=False, lskew=False,
+                lvar=False, lstd=False, lcoefvar=False, lperc=False, p=0.95,
+                sketch=None):
+    """Calculate some statistics of a block of nodes along every realisation.
+
+    Each column of `arr` holds the values of one node in every realisation,
+    so the statistics are computed along the first axis, all nodes at once.
+
+    Parameters
+    ----------
+    arr : ndarray
+        Two dimensional array with shape (number of realisations, number of
+        nodes). It is modified in place if `nodata` is given.
+    nodata : number, optional
+        Missing data value, which will be replaced with NaN.
+    lmean : boolean, default False
+        Calculate the mean.
+    lmed : boolean, default False
+        Calculate the median.
+    lskew : boolean, default False
+        Calculate skewness.
+    lvar : boolean, default False
+        Calculate the variance.
+    lstd : boolean, default False
+        Calculate the standard deviation.
+    lcoefvar : boolean, default False
+        Calculate the coefficient of variation.
+    lperc : boolean, default False
+        Calculate the percentiles `100 * (1 - p) / 2` and
+        `100 * (1 + p) / 2`.
+    p : number, default 0.95
+        Probability value.
+    sketch : int, optional
+        Estimate the percentiles with a `QuantileSketch` of this size, fed with
+        one row at a time, instead of sorting every column.
+
+    Returns
+    -------
+    dict of ndarray
+        One array for each calculated statistic, with keys 'mean', 'median',
+        'skewness', 'variance', 'std', 'coefvar' and 'perc'. The percentiles
+        array has shape (number of nodes, 2).
+
+    Notes
+    -----
+    Missing values are ignored. The results are the same as those given by
+    bottleneck and pandas for each node, e.g., the skewness is the adjusted
+    Fisher-Pearson coefficient and the percentiles are linearly interpolated.
+
+    """
+    if nodata is not None:
+        # replace no data's with NaN
+        bn.replace(arr, nodata, np.nan)
+    results = dict()
+    if lmean or lcoefvar:
+        mean = bn.nanmean(arr, axis=0)
+        if lmean:
+            results['mean'] = mean
+    if lmed:
+        results['median'] = bn.nanmedian(arr, axis=0)
+    if lskew:
+        results['skewness'] = _nanskew(arr)
+    if lvar:
+        results['variance'] = bn.nanvar(arr, axis=0, ddof=1)
+    if lstd or lcoefvar:
+        std = bn.nanstd(arr, axis=0, ddof=1)
+        if lstd:
+            results['std'] = std
+    if lcoefvar:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            results['coefvar'] = std / mean * 100
+    if lperc and sketch:
+        qsketch = QuantileSketch(arr.shape[1], sketch)
+        for values in arr:
+            qsketch.update(values)
+        results['perc'] = qsketch.quantiles([(1 - p) / 2, 1 - (1 - p) / 2])
+    elif lperc:
+        with warnings.catch_warnings():
+            # nodes without any value yield NaN, as in pandas
+            warnings.simplefilter('ignore', RuntimeWarning)
+            perc = np.nanpercentile(arr, [100 * (1 - p) / 2,
+                                          100 * (1 - (1 - p) / 2)], axis=0)
+        results['perc'] = perc.T
+    return results
+
+
+def _nanskew(arr):
+    """Sample skewness along the first axis, ignoring NaN's, as computed by
+    pandas.Series.skew.
+
+    """
+    mask = np.isnan(arr)
+    count = (~mask).sum(axis=0).astype('float64')
+    values = np.where(mask, 0, arr)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=0) / count
+        adjusted = np.where(mask, 0, values - mean)
+        m2 = (adjusted ** 2).sum(axis=0)
+        m3 = (adjusted ** 3).sum(axis=0)
+    return _skew_moments(count, m2, m3)
+
+
+def _skew_moments(count, m2, m3):
+    """Sample skewness from the number of values and the sums of the second
+    and third powers of their deviations from the mean, as computed by
+    pandas.Series.skew.
+
+    """
+    m2 = m2.copy()
+    m3 = m3.copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # floating point error
+        m2[np.abs(m2) < 1e-14] = 0
+        m3[np.abs(m3) < 1e-14] = 0
+        skew = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2 ** 1.5)
+    skew = np.where(m2 == 0, 0, skew)
+    skew[count < 3] = np.nan
+    return skew
+
+
+def read_table(fid, ncols=None, chunksize=None):
+    """Read a table of numbers separated by white space, from the current
+    position of a file until its end, with the C parser of pandas.
+
+    It is equivalent to `numpy.loadtxt`, but much faster, and it always
+    returns a two dimensional array.
+
+    Parameters
+    ----------
+    fid : file handle or string
+        Input file, positioned at the first line to read, or file path.
+    ncols : int, optional
+        Number of columns, used to shape the array if there are no values.
+    chunksize : int, optional
+        Read `chunksize` lines at a time, returning an iterator.
+
+    Returns
+    -------
+    ndarray or iterator of ndarray
+        Array with shape (number of lines, number of columns), or an iterator
+        of such arrays if `chunksize` is given.
+
+    """
+    try:
+        reader = pd.read_csv(fid, delim_whitespace=True, header=None,
+                             comment='#', dtype='float64', engine='c',
+                             float_precision='round_trip',
+                             chunksize=chunksize)
+    except pd.errors.EmptyDataError:
+        values = np.zeros((0, ncols or 0))
+        if chunksize:
+            return iter([values])
+        return values
+    if chunksize:
+        return (chunk.values for chunk in reader)
+    return reader.values
+
+
+def write_table(fid, values, precision=None, chunksize=100000):
+    """Write a table of numbers, one row per line, formatting many rows at
+    once.
+
+    The output is the same as `numpy.savetxt(fid, values, fmt='%-10.6f')`,
+    unless another precision is given.
+
+    Parameters
+    ----------
+    fid : file handle
+        Output file.
+    values : array_like
+        One or two dimensional array. A one dimensional array is written as a
+        column.
+    precision : int, optional
+        Number of decimal places. If given, the values are not padded, which
+        makes smaller files.
+    chunksize : int, default 100000
+        Number of rows formatted and written at a time.
+
+    """
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    if precision is None:
+        fmt = '%-10.6f'
+    else:
+        fmt = '%.{0}f'.format(int(precision))
+    rowfmt = ' '.join([fmt] * values.shape[1]) + '\n'
+    for first in xrange(0, values.shape[0], chunksize):
+        chunk = values[first:first + chunksize]
+        fid.write((rowfmt * chunk.shape[0]) % tuple(chunk.ravel().tolist()))
+
+
+def read_values(fid, nlines):
+    """Read a number of lines from a file with one value per line.
+
+    Parameters
+    ----------
+    fid : file handle
+        Input file, positioned at the first line to read.
+    nlines : int
+        Number of lines to read.
+
+    Returns
+    -------
+    ndarray
+        One dimension array with the read values.
+
+    Raises
+    ------
+    IOError
+        The file ended before reading `nlines` values.
+
+    """
+    lines = [fid.readline() for i in xrange(nlines)]  # @UnusedVariable
+    values = np.fromstring(''.join(lines), sep=' ')
+    if values.shape[0] != nlines:
+        raise IOError('File {0} ended before reading {1} values.'.
+                      format(getattr(fid, 'name', fid), nlines))
+    return values
+
+
+def read_lines(fid, lines, header=0):
+    """Read the values in the given lines of a file with one value per line,
+    advancing sequentially from the beginning of the file.
+
+    Parameters
+    ----------
+    fid : file handle
+        Input file, positioned at its beginning.
+    lines : array_like
+        Numbers of the lines to read, in ascending order. The header lines are
+        not considered (the first line after the header is number 1).
+    header : int, default 0
+        Number of lines in the header.
+
+    Returns
+    -------
+    ndarray
+        One dimension array with the read values.
+
+    """
+    skip_lines(fid, header)
+    values = np.zeros(len(lines))
+    curr_line = 0
+    for i, line in enumerate(lines):
+        # advance to the next line with a neighbour node
+        skip_lines(fid, int(line - curr_line - 1))
+        values[i] = float(fid.readline())
+        curr_line = line
+    return values
 
 
 def coord_to_grid(coord, cells_size, first):
@@ -1054,7 +3346,7 @@ def add_header(path, name=None, varnames=None, out=None):
 
     """
     with open(path, 'r+') as f:
-        values = np.loadtxt(f)
+        values = read_table(f)
 
     if out is None:
         fname, ext = os.path.splitext(path)
@@ -1072,7 +3364,7 @@ def add_header(path, name=None, varnames=None, out=None):
         f.write(str(nvars) + '\n')
         for varname in varnames:
             f.write(varname + '\n')
-        np.savetxt(f, values, fmt='%-10.6f')
+        write_table(f, values)
 
 
 def remove_header(path, out=None):
@@ -1092,13 +3384,14 @@ def remove_header(path, out=None):
             f.readline()
             nvars = int(f.readline())
             skip_lines(f, nvars)
-            values = np.loadtxt(f)
+            values = read_table(f, nvars)
 
         if out is None:
             fname, ext = os.path.splitext(path)
             out = fname + '_nohead' + ext
 
-        np.savetxt(out, values, fmt='%-10.6f')
+        with open(out, 'w') as f:
+            write_table(f, values)
 
 
 def has_header(path):
@@ -19,6 +19,7 @@ from random import shuffle
 import numpy as np
 import pandas as pd
 import tools.grid as gr
+import tools.kriging as kr
 
 
 list_of_stations = namedtuple('Stations', 'stations total')
@@ -43,9 +44,10 @@ def detect(grids, obs_file, rad=0, method='mean', prob=0.95, skewness=None,
 
     Parameters
     ----------
-    grids : GridFiles object
+    grids : GridFiles or KrigingPDF object
         Instance of GridFiles type containing the geostatistical simulation
-        results.
+        results, or KrigingPDF instance to estimate the local PDF's by
+        kriging, without simulating them.
     obs_file : PointSet object or string
         Instance of PointSet type containing the observed values at the
         candidate station, or string with the full path to the PointSet file.
@@ -200,9 +202,10 @@ def detect(grids, obs_file, rad=0, method='mean', prob=0.95, skewness=None,
     meanvalues.index = obs.values.index
     obs.values.update(meanvalues, overwrite=False)
 
-    # detect irregularities
-    hom_where = ~obs.values['clim'].between(local_stats['lperc'],
-                                            local_stats['rperc'])
+    # detect irregularities, comparing by position, as the candidate keeps its
+    # rows labels in the stations PointSet
+    hom_where = ~obs.values['clim'].between(local_stats['lperc'].values,
+                                            local_stats['rperc'].values)
     detected_number = hom_where.sum()  # + fn
 
     # homogenise irregularities
@@ -229,8 +232,10 @@ def detect(grids, obs_file, rad=0, method='mean', prob=0.95, skewness=None,
         else:
             vline_perc = local_stats
 
-        fixvalues = np.where(obs.values['clim'] > local_stats['rperc'],
-                             vline_perc['rperc'], vline_perc['lperc'])
+        fixvalues = np.where(obs.values['clim'].values >
+                             local_stats['rperc'].values,
+                             vline_perc['rperc'].values,
+                             vline_perc['lperc'].values)
 
     homogenised.values['clim'] = obs.values['clim'].where(~hom_where,
                                                           fixvalues)
@@ -260,8 +265,8 @@ def detect(grids, obs_file, rad=0, method='mean', prob=0.95, skewness=None,
                     med = grids.stats_area(obs_xy, rad, lmed=True,
                                            save=False).values['median']
                 percentiles = np.where(
-                    obs.values['clim'] >= med, local_stats['rperc'],
-                    local_stats['lperc'])
+                    obs.values['clim'].values >= med.values,
+                    local_stats['rperc'].values, local_stats['lperc'].values)
                 homogenised.add_var(varname='pdet', values=percentiles)
             elif value:
                 varname = stats_names[key]
@@ -276,6 +281,347 @@ def detect(grids, obs_file, rad=0, method='mean', prob=0.95, skewness=None,
     return homogenised, detected_number, missing_data
 
 
+class KrigingPDF(object):
+
+    """Local PDF's estimated by kriging the reference stations, instead of
+    simulating them. It may be used in place of a GridFiles instance in
+    `detect`, for a quick screening of the data.
+
+    The local PDF at each time step is the normal distribution with the
+    kriging estimate as the mean and the kriging variance, using the
+    variogram, the search ellipsoid, the number of samples and the kriging
+    type in the DSS parameters. The time is the Z-axis, as in the
+    simulation. As in `simulation.DirectSequential`, the kriging variance is
+    taken relative to the sill, so it is scaled to the variance of the
+    reference values.
+
+    Attributes
+    ----------
+    par : DssParam object
+        DSS parameters.
+    cov : Covariance object
+        Covariance model.
+    points : ndarray
+        Coordinates [x, y, z] of the valid reference values.
+    data : ndarray
+        Valid reference values.
+    mean : float
+        Mean of the reference values, used by simple kriging.
+    variance : float
+        Variance of the reference values.
+
+    """
+
+    def __init__(self, par, references, no_data=None):
+        """Constructor to initialise a KrigingPDF instance.
+
+        Parameters
+        ----------
+        par : DssParam object
+            DSS parameters, with the grid and the variogram.
+        references : PointSet or array_like
+            Reference stations, with the columns given in `par.columns_set`.
+        no_data : number, optional
+            Missing data value of the statistics. If None, `par.nd` is used.
+
+        """
+        self.par = par
+        self.nodata = par.nd if no_data is None else no_data
+        self.xi, self.cellx = map(float, par.xx[1:3])
+        self.yi, self.celly = map(float, par.yy[1:3])
+        dz, self.zi, self.cellz = map(float, par.zz)
+        self.dz = int(dz)
+        self.cov = kr.Covariance.from_dsspar(par)
+        self.ktype = int(par.krig[0])
+        self.ndmin, self.ndmax = map(int, par.nsamples[:2])
+        self.radius = float(par.srchradius[0])
+        self._rot = kr.rotation(map(float, par.srchangles),
+                                map(float, par.srchradius))
+
+        if isinstance(references, gr.PointSet):
+            references = references.values.values
+        data = np.atleast_2d(np.asarray(references, dtype='float64'))
+        first_coord = [self.xi, self.yi, self.zi]
+        points = np.tile(first_coord, (data.shape[0], 1))
+        for axis, col in enumerate(par.columns_set[:3]):
+            if int(col):
+                points[:, axis] = data[:, int(col) - 1]
+        values = data[:, int(par.columns_set[3]) - 1]
+        valid = (np.isfinite(values) & (values != par.nd) &
+                 (values != self.nodata))
+        self.points, self.data = points[valid], values[valid]
+        self.mean = self.data.mean() if self.data.size else 0
+        self.variance = self.data.var(ddof=1) if self.data.size > 1 else 0
+
+    def estimate(self, loc):
+        """Kriging estimate and variance at every time step of a location.
+
+        Parameters
+        ----------
+        loc : array_like
+            Location of the vertical line [x, y].
+
+        Returns
+        -------
+        estimates, variances : ndarray
+            Kriging estimate and variance, scaled to the variance of the
+            reference values, at each time step.
+
+        """
+        estimates = np.zeros(self.dz)
+        variances = np.zeros(self.dz)
+        rotated = np.dot(self.points, self._rot.T)
+        for k in xrange(self.dz):
+            target = np.array([loc[0], loc[1], self.zi + k * self.cellz])
+            dist = np.sqrt(((rotated - np.dot(self._rot, target)) ** 2).
+                           sum(axis=1))
+            near = np.flatnonzero(dist <= self.radius)
+            near = near[np.argsort(dist[near], kind='mergesort')][:self.ndmax]
+            if near.size < self.ndmin:
+                estimates[k], variances[k] = self.mean, self.cov.sill
+            else:
+                estimates[k], variances[k] = kr.krige(
+                    self.cov, self.points[near], self.data[near], target,
+                    self.ktype, self.mean)
+        if self.cov.sill > 0:
+            variances *= self.variance / self.cov.sill
+        return estimates, variances
+
+    def stats_area(self, loc, tol=0, lmean=False, lmed=False, lskew=False,
+                   lvar=False, lstd=False, lcoefvar=False, lperc=False,
+                   p=0.95, save=False, sketch=None):
+        """Calculate some statistics of the local PDF's at a location. See
+        `GridFiles.stats_area` for the parameters.
+
+        The mean and the median are the kriging estimate, and the skewness is
+        zero. The tolerance radius, `save` and `sketch` are ignored, as the
+        PDF's are estimated at the location itself.
+
+        Returns
+        -------
+        statspset : PointSet
+            PointSet instance containing the calculated statistics.
+
+        """
+        estimates, variances = self.estimate(loc)
+        std = np.sqrt(variances)
+        lstats = dict()
+        if lmean:
+            lstats['mean'] = estimates
+        if lmed:
+            lstats['median'] = estimates
+        if lskew:
+            lstats['skewness'] = np.zeros(self.dz)
+        if lvar:
+            lstats['variance'] = variances
+        if lstd:
+            lstats['std'] = std
+        if lcoefvar:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                lstats['coefvar'] = std / estimates * 100
+        if lperc:
+            half = kr.gauss_inv(1 - (1 - p) / 2) * std
+            lstats['perc'] = np.column_stack((estimates - half,
+                                              estimates + half))
+        nodes = [int(round((loc[0] - self.xi) / self.cellx)),
+                 int(round((loc[1] - self.yi) / self.celly))]
+        return gr.vline_pset(lstats, nodes, self.zi, self.cellz, self.nodata,
+                             self.dz)
+
+    def reset_read(self):
+        """Nothing to reset, kept for compatibility with GridFiles.
+
+        """
+        pass
+
+    def dump(self):
+        """Nothing to close, kept for compatibility with GridFiles.
+
+        """
+        pass
+
+    def purge(self):
+        """Nothing to remove, kept for compatibility with GridFiles.
+
+        """
+        pass
+
+
+class DetectionMonitor(object):
+
+    """Follow the detection at a candidate station while the realisations are
+    being generated, so that the simulation may stop as soon as more
+    realisations would not change it.
+
+    After each batch of realisations, the percentiles which bound the
+    detection interval (see `detect`) are estimated in every time step, along
+    with their order statistics confidence intervals (their ranks follow a
+    binomial distribution, approximated by the normal one). The detection in
+    a time step is undecided while the observed value lies within the
+    confidence interval of either percentile.
+
+    Attributes
+    ----------
+    probe : GridStream
+        Values of every realisation around the candidate location.
+    prob : float
+        Probability value of the detection interval.
+    batch : int
+        Number of realisations between checks.
+    tol : int
+        Maximum number of undecided time steps to consider the detection
+        stable.
+    conf : float
+        Confidence level of the percentiles confidence intervals.
+    mean_tol : float or None
+        Maximum standard error of the mean, in any time step, to consider the
+        detection stable, as the mean fills the missing data.
+    history : list of dict
+        Number of realisations, undecided time steps, detections changed since
+        the previous check and maximum standard error of the mean, in each
+        check.
+    stable : boolean
+        The last check found the detection stable.
+
+    """
+
+    def __init__(self, obs, dims, first_coord, cells_size, no_data, rad=0,
+                 prob=0.95, batch=10, tol=0, conf=0.95, mean_tol=None):
+        """Constructor to initialise a DetectionMonitor instance.
+
+        Parameters
+        ----------
+        obs : PointSet object
+            Observed values at the candidate station.
+        dims : array_like
+            Number of nodes in each direction, [dx, dy, dz]
+        first_coord : array_like
+            First coordinate in each direction, [xi, yi, zi].
+        cells_size : array_like
+            Nodes size in each direction, [cellx, celly, cellz].
+        no_data : number
+            Missing data value.
+        rad : number, default 0
+            Tolerance radius used to search for neighbour nodes.
+        prob : float, default 0.95
+            Probability value of the detection interval.
+        batch : int, default 10
+            Number of realisations between checks.
+        tol : int, default 0
+            Maximum number of undecided time steps.
+        conf : float, default 0.95
+            Confidence level of the percentiles confidence intervals.
+        mean_tol : float, optional
+            Maximum standard error of the mean, in any time step.
+
+        """
+        values = obs.values
+        obs_xy = list(values.loc[values.first_valid_index(), ['x', 'y']])
+        self.probe = gr.GridStream(dims, first_coord, cells_size, no_data,
+                                   headerin=0, loc=obs_xy, tol=rad)
+        self.prob = prob
+        self.batch = batch
+        self.tol = tol
+        self.conf = conf
+        self.mean_tol = mean_tol
+        self.history = list()
+        self.stable = False
+
+        clim = values['clim'].values.astype('float64')
+        layers = np.round((values['time'].values - first_coord[2]) /
+                          cells_size[2]).astype('int')
+        valid = (np.isfinite(clim) & (clim != no_data) & (layers >= 0) &
+                 (layers < dims[2]))
+        self._obs = clim[valid]
+        self._layers = layers[valid]
+        self._detected = None
+
+    @property
+    def nsim(self):
+        """Number of realisations received."""
+        return self.probe.nfiles
+
+    def add(self, values):
+        """Add one realisation, given as an array, and check the detection
+        after each batch. Return True if it is stable.
+
+        """
+        self.probe.add(values)
+        return self._batch_done()
+
+    def ingest(self, path):
+        """Add one realisation, given as a file, and check the detection after
+        each batch. Return True if it is stable.
+
+        """
+        self.probe.ingest(path)
+        return self._batch_done()
+
+    def _batch_done(self):
+        """Check the detection if a batch was completed.
+
+        """
+        if self.nsim % self.batch == 0:
+            self.check()
+        return self.stable
+
+    def check(self):
+        """Check the stability of the detection with the realisations received
+        so far.
+
+        Returns
+        -------
+        dict
+            Number of realisations, undecided time steps, detections changed
+            since the previous check and maximum standard error of the mean.
+
+        """
+        values = self.probe.area_values(self.probe.loc, self.probe.tol)
+        nsim, dz, nnodes = values.shape
+        arr = values.transpose((0, 2, 1)).reshape((nsim * nnodes, dz))
+        arr = np.sort(arr[:, self._layers], axis=0)
+        count = np.isfinite(arr).sum(axis=0)
+        cols = np.arange(arr.shape[1])
+
+        z = kr.gauss_inv((1 + self.conf) / 2.0)
+        undecided = np.zeros(arr.shape[1], dtype='bool')
+        detected = np.zeros(arr.shape[1], dtype='bool')
+        for q, side in (((1 - self.prob) / 2.0, -1),
+                        (1 - (1 - self.prob) / 2.0, 1)):
+            perc = np.nanpercentile(arr, 100 * q, axis=0)
+            if side < 0:
+                detected |= self._obs < perc
+            else:
+                detected |= self._obs > perc
+            # ranks of the bounds, counting from 1; the bounds are open
+            # beyond the sample
+            spread = z * np.sqrt(count * q * (1 - q))
+            low = np.floor(count * q - spread).astype('int')
+            high = np.ceil(count * q + spread).astype('int')
+            lower = np.where(low < 1, -np.inf,
+                             arr[np.clip(low - 1, 0, None), cols])
+            upper = np.where(high > count, np.inf,
+                             arr[np.clip(high - 1, 0, arr.shape[0] - 1),
+                                 cols])
+            undecided |= (self._obs >= lower) & (self._obs <= upper)
+
+        if self._detected is None:
+            flipped = 0
+        else:
+            flipped = int((detected != self._detected).sum())
+        self._detected = detected
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_se = np.nanstd(arr, axis=0, ddof=1) / np.sqrt(count)
+        max_se = float(np.nanmax(mean_se)) if mean_se.size else 0.0
+
+        result = {'nsim': nsim, 'undecided': int(undecided.sum()),
+                  'flipped': flipped, 'mean_se': max_se}
+        self.history.append(result)
+        self.stable = (result['undecided'] <= self.tol and
+                       (self.mean_tol is None or max_se <= self.mean_tol))
+        return result
+
+
 def fill_station(pset_file, values, time_min, time_max, time_step=1,
                  header=True):
     """Look for missing values in a station and fill them with a given value.
@@ -480,14 +826,21 @@ def take_candidate(pset_file, station, header=True, save=False, path=None):
         pset = gr.PointSet()
         pset.load(pset_file, header=header)
 
-    candidate = pset.values[pset.values['station'] == int(station)]
-    neighbours = pset.values[pset.values['station'] != int(station)]
-
     # remove existing optional columns
     drop_vars = ['Flag', 'mean', 'median', 'std', 'pdet', 'variance',
                  'coefvar', 'skewness']
-    candidate = candidate.drop(drop_vars, axis=1, errors='ignore')
-    neighbours = neighbours.drop(drop_vars, axis=1, errors='ignore')
+    keep = [i for i, var in enumerate(pset.values.columns)
+            if var not in drop_vars]
+
+    # take the rows of the candidate station and the remainder ones
+    rows = pset.station_rows(int(station))
+    nrows = pset.values.shape[0]
+    if isinstance(rows, slice):
+        others = np.r_[0:rows.start, rows.stop:nrows]
+    else:
+        others = np.delete(np.arange(nrows), rows)
+    candidate = pset.values.iloc[rows, keep]
+    neighbours = pset.values.iloc[others, keep]
     nvars = candidate.shape[1]
     varnames = list(candidate.columns)
 
@@ -540,8 +893,17 @@ def update_station(stations_pset, station, header=True):
     # fill the missing variables with NaN's
     for var in missing_vars:
         pset.add_var(np.repeat(np.nan, pset.values.shape[0]), var)
-    # update the rows of the stations PointSet
-    pset.values.update(station.values)
+    # update the rows of the station, in the stations PointSet, with the
+    # non-NA values
+    stid = station.values['station'].dropna()
+    if stid.empty:
+        pset.values.update(station.values)
+        return pset
+    rows = pset.station_rows(stid.iloc[0])
+    current = pset.values.iloc[rows]
+    new = station.values.reindex(index=current.index,
+                                 columns=current.columns)
+    pset.values.iloc[rows] = current.where(new.isnull(), new).values
     return pset
 
 
@@ -859,7 +1221,7 @@ def clean_leftovers(tree, maps=True, pars=True, trn=True, dbg=True, cands=True,
     tree : string
         Path containing the target files.
     maps : boolean, default True
-        Remove simulated maps (\*.out).
+        Remove simulated maps (\*.out) and their lines indexes (\*.out.idx).
     pars : boolean, default True
         Remove simulation parameters (\*.par).
     trn : boolean, default True
@@ -881,6 +1243,7 @@ def clean_leftovers(tree, maps=True, pars=True, trn=True, dbg=True, cands=True,
     plate = list()
     if maps:
         plate.append('*.out')
+        plate.append('*.out.idx')
     if pars:
         plate.append('*.par')
     if trn:
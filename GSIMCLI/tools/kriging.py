@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides variogram models and kriging estimators, following the
+conventions of GSLIB used in the DSS parameters file (variogram structures,
+ranges, angles and search ellipsoid).
+
+Created on 17/10/2026
+
+@author: julio
+"""
+
+import math
+
+import numpy as np
+
+
+SPHERICAL = 1
+EXPONENTIAL = 2
+GAUSSIAN = 3
+
+ORDINARY = 0
+SIMPLE = 1
+
+
+class Covariance(object):
+    """Nested covariance model, made of a nugget effect and a set of
+    anisotropic structures.
+
+    Attributes
+    ----------
+    nugget : float
+        Nugget effect.
+    structures : list of tuple
+        Model type, sill contribution, rotation matrix and major range of
+        each structure. The model types are the same as in GSLIB: 1 is
+        spherical, 2 is exponential and 3 is gaussian.
+    sill : float
+        Total sill, i.e., the covariance at the origin.
+
+    """
+    def __init__(self, nugget=0, structures=None):
+        """Constructor to initialise a Covariance instance.
+
+        Parameters
+        ----------
+        nugget : number, default 0
+            Nugget effect.
+        structures : list, optional
+            List of [model, sill, ang1, ang2, ang3, range_max, range_min,
+            range_vertical], one for each structure.
+
+        """
+        self.nugget = float(nugget)
+        self.structures = list()
+        for struct in structures or list():
+            model, cc = int(struct[0]), float(struct[1])
+            if model not in (SPHERICAL, EXPONENTIAL, GAUSSIAN):
+                raise ValueError('Unsupported variogram model: {0}'.
+                                 format(model))
+            angles = map(float, struct[2:5])
+            ranges = map(float, struct[5:8])
+            self.structures.append((model, cc, rotation(angles, ranges),
+                                    ranges[0]))
+        self.sill = self.nugget + sum(s[1] for s in self.structures)
+
+    @classmethod
+    def from_dsspar(cls, par):
+        """Build the covariance model from the variogram in a DSS parameters
+        instance (`nstruct`, `struct` and `ranges`).
+
+        Parameters
+        ----------
+        par : DssParam object
+            DSS parameters.
+
+        Returns
+        -------
+        Covariance
+
+        """
+        structures = list()
+        for i in xrange(int(par.nstruct[0])):
+            structures.append(list(par.struct[i][:5]) +
+                              list(par.ranges[i][:3]))
+        return cls(par.nstruct[1], structures)
+
+    def __call__(self, a, b):
+        """Covariance between every pair of points of two sets.
+
+        Parameters
+        ----------
+        a : array_like
+            Coordinates [x, y, z] of N points, with shape (N, 3).
+        b : array_like
+            Coordinates [x, y, z] of M points, with shape (M, 3).
+
+        Returns
+        -------
+        ndarray
+            Covariances, with shape (N, M).
+
+        """
+        a = np.asarray(a, dtype='float64')
+        b = np.asarray(b, dtype='float64')
+        cov = np.zeros((a.shape[0], b.shape[0]))
+        cov[_sqdist(a, b) < 1e-10] = self.nugget
+        for model, cc, rot, arange in self.structures:
+            # rotate the points, rather than every difference between them
+            h = np.sqrt(_sqdist(np.dot(a, rot.T), np.dot(b, rot.T))) / arange
+            if model == SPHERICAL:
+                cov += np.where(h < 1, cc * (1 - h * (1.5 - 0.5 * h ** 2)), 0)
+            elif model == EXPONENTIAL:
+                cov += cc * np.exp(-3 * h)
+            else:
+                cov += cc * np.exp(-3 * h ** 2)
+        return cov
+
+
+def _sqdist(a, b):
+    """Squared euclidean distance between every pair of points of two sets.
+
+    """
+    sqdist = np.zeros((a.shape[0], b.shape[0]))
+    for axis in xrange(a.shape[1]):
+        sqdist += np.subtract.outer(a[:, axis], b[:, axis]) ** 2
+    return sqdist
+
+
+def rotation(angles, ranges):
+    """Rotation and anisotropy matrix of an ellipsoid, as in the `setrot`
+    routine of GSLIB.
+
+    Parameters
+    ----------
+    angles : array_like
+        Azimuth of the major axis (clockwise from north), its dip and the
+        plunge of the ellipsoid, in degrees.
+    ranges : array_like
+        Ranges along the major, minor and vertical axes.
+
+    Returns
+    -------
+    ndarray
+        Matrix with shape (3, 3). The distance between two points, scaled to
+        the major range, is the norm of this matrix times their difference.
+
+    """
+    ang1, ang2, ang3 = angles
+    if 0 <= ang1 < 270:
+        alpha = math.radians(90 - ang1)
+    else:
+        alpha = math.radians(450 - ang1)
+    beta = math.radians(-ang2)
+    theta = math.radians(ang3)
+    sina, cosa = math.sin(alpha), math.cos(alpha)
+    sinb, cosb = math.sin(beta), math.cos(beta)
+    sint, cost = math.sin(theta), math.cos(theta)
+    afac1 = float(ranges[0]) / ranges[1]
+    afac2 = float(ranges[0]) / ranges[2]
+    return np.array([[cosb * cosa, cosb * sina, -sinb],
+                     [afac1 * (-cost * sina + sint * sinb * cosa),
+                      afac1 * (cost * cosa + sint * sinb * sina),
+                      afac1 * (sint * cosb)],
+                     [afac2 * (sint * sina + cost * sinb * cosa),
+                      afac2 * (-sint * cosa + cost * sinb * sina),
+                      afac2 * (cost * cosb)]])
+
+
+def krige(cov, points, values, target, ktype=ORDINARY, mean=0):
+    """Estimate the value at one location, by simple or ordinary kriging.
+
+    Parameters
+    ----------
+    cov : Covariance object
+        Covariance model.
+    points : array_like
+        Coordinates [x, y, z] of the known values, with shape (N, 3).
+    values : array_like
+        Known values.
+    target : array_like
+        Coordinates [x, y, z] of the location to estimate.
+    ktype : {0, 1}, default 0
+        Kriging type, as in `DssParam.krig`: 0 for ordinary kriging, 1 for
+        simple kriging.
+    mean : number, default 0
+        Mean of the variable, for simple kriging.
+
+    Returns
+    -------
+    estimate : float
+        Kriging estimate.
+    variance : float
+        Kriging variance.
+
+    """
+    n = len(values)
+    if not n:
+        return float(mean), cov.sill
+    c0 = cov(points, np.atleast_2d(target))[:, 0]
+    if ktype == SIMPLE:
+        weights = _solve(cov(points, points), c0)
+        return (mean + np.dot(weights, np.asarray(values) - mean),
+                max(cov.sill - np.dot(weights, c0), 0))
+    lhs = np.ones((n + 1, n + 1))
+    lhs[:n, :n] = cov(points, points)
+    lhs[n, n] = 0
+    weights = _solve(lhs, np.append(c0, 1))
+    return (np.dot(weights[:n], values),
+            max(cov.sill - np.dot(weights[:n], c0) - weights[n], 0))
+
+
+def _solve(lhs, rhs):
+    """Solve a kriging system, even if it is singular (e.g., duplicated
+    points).
+
+    """
+    try:
+        return np.linalg.solve(lhs, rhs)
+    except np.linalg.LinAlgError:
+        return np.linalg.lstsq(lhs, rhs, rcond=None)[0]
+
+
+def search_template(radius, angles, cells_size, dims, maxnodes=100000):
+    """Offsets of the grid nodes within a search ellipsoid, sorted by their
+    anisotropic distance to the centre.
+
+    Parameters
+    ----------
+    radius : array_like
+        Search radius along the major, minor and vertical axes.
+    angles : array_like
+        Search angles, in degrees, as in `rotation`.
+    cells_size : array_like
+        Nodes size in each direction, [cellx, celly, cellz].
+    dims : array_like
+        Number of nodes in each direction, [dx, dy, dz].
+    maxnodes : int, default 100000
+        Maximum number of offsets, keeping the closest ones.
+
+    Returns
+    -------
+    ndarray
+        Offsets [x, y, z], in number of nodes, with shape (N, 3). The centre
+        is not included.
+
+    """
+    cells_size = np.asarray(cells_size, dtype='float64')
+    reach = np.minimum(np.ceil(max(radius) / cells_size),
+                       np.asarray(dims) - 1).astype('int')
+    axes = [np.arange(-r, r + 1) for r in reach]
+    offsets = np.array(np.meshgrid(*axes, indexing='ij')).reshape(3, -1).T
+    rot = rotation(angles, radius)
+    dist = np.sqrt((np.dot(offsets * cells_size, rot.T) ** 2).sum(axis=1))
+    keep = (dist <= radius[0]) & (dist > 0)
+    offsets, dist = offsets[keep], dist[keep]
+    order = np.argsort(dist, kind='mergesort')[:maxnodes]
+    return offsets[order]
+
+
+def gauss_cdf(y):
+    """Standard normal cumulative distribution function.
+
+    """
+    return 0.5 * (1 + math.erf(y / math.sqrt(2)))
+
+
+def gauss_inv(p):
+    """Standard normal quantile function, as in the `gauinv` routine of
+    GSLIB.
+
+    """
+    lim = 1e-10
+    if p < lim:
+        return -1e10
+    if p > 1 - lim:
+        return 1e10
+    pp = min(p, 1 - p)
+    y = math.sqrt(math.log(1 / (pp * pp)))
+    num = ((((y * -0.453642210148e-04 - 0.0204231210245) * y -
+             0.342242088547) * y - 1.0) * y - 0.322232431088)
+    den = ((((y * 0.38560700634e-02 + 0.103537752850) * y +
+             0.531103462366) * y + 0.588581570495) * y + 0.0993484626060)
+    xp = y + num / den
+    if p < 0.5:
+        xp = -xp
+    return xp
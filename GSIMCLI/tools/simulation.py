@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides a NumPy implementation of the *Direct Sequential
+Simulation* (DSS), with the same parameters as the DSS program, so that the
+realizations may be generated in-process, without the DSS binary file.
+
+Created on 17/10/2026
+
+@author: julio
+"""
+
+import math
+
+import numpy as np
+
+import tools.grid as gr
+import tools.kriging as kr
+
+
+class DirectSequential(object):
+    """Direct sequential simulation with a global distribution [1]_.
+
+    Each node of the grid, visited along a random path, is estimated by
+    kriging with the nearest data and previously simulated nodes. The
+    simulated value is drawn from the global distribution of the data, in
+    the interval centred at the kriging estimate, with the kriging variance
+    (both converted to normal scores).
+
+    The data are assigned to the nearest grid nodes. The following DSS
+    parameters are used: `columns_set`, `nd`, `xx`, `yy`, `zz`, `nsamples`,
+    `maxsim`, `srchradius`, `srchangles`, `krig`, `nstruct`, `struct`,
+    `ranges` and `seed`. The others (e.g., transformation, trimming limits,
+    octant search, secondary data) are ignored.
+
+    Attributes
+    ----------
+    par : DssParam object
+        DSS parameters.
+    dims : ndarray
+        Number of nodes in each direction, [dx, dy, dz].
+    first_coord : ndarray
+        First coordinate in each direction, [xi, yi, zi].
+    cells_size : ndarray
+        Nodes size in each direction, [cellx, celly, cellz].
+    cov : Covariance object
+        Covariance model.
+    template : ndarray
+        Offsets of the nodes within the search ellipsoid, closest first.
+    nodes : ndarray
+        Grid nodes, in the order of the grid file, with data.
+    data : ndarray
+        Data values assigned to those nodes.
+
+    References
+    ----------
+    .. [1] Soares, A. (2001). Direct sequential simulation and cosimulation.
+       Mathematical Geology, 33(8), 911-926.
+
+    """
+    def __init__(self, par, data):
+        """Constructor to initialise a DirectSequential instance.
+
+        Parameters
+        ----------
+        par : DssParam object
+            DSS parameters.
+        data : PointSet or array_like
+            Conditioning data, with the columns given in `par.columns_set`.
+
+        """
+        self.par = par
+        grids = [map(float, axis) for axis in (par.xx, par.yy, par.zz)]
+        self.dims = np.array([int(axis[0]) for axis in grids])
+        self.first_coord = np.array([axis[1] for axis in grids])
+        self.cells_size = np.array([axis[2] for axis in grids])
+        self.cov = kr.Covariance.from_dsspar(par)
+        self.ktype = int(par.krig[0])
+        self.ndmin, self.ndmax = map(int, par.nsamples[:2])
+        self.maxsim = int(par.maxsim)
+        self.template = kr.search_template(map(float, par.srchradius),
+                                           map(float, par.srchangles),
+                                           self.cells_size, self.dims)
+        self.nodes, self.data = self._assign(data)
+        values = np.sort(self.data)
+        self._cdf = (values, (np.arange(values.size) + 0.5) / values.size)
+        self.mean = values.mean() if values.size else 0
+
+    def _assign(self, data):
+        """Assign the valid data to the nearest grid nodes. If there are
+        several data in the same node, keep the closest one.
+
+        """
+        if isinstance(data, gr.PointSet):
+            data = data.values.values
+        data = np.atleast_2d(np.asarray(data, dtype='float64'))
+        coords = np.tile(self.first_coord, (data.shape[0], 1))
+        for axis, col in enumerate(self.par.columns_set[:3]):
+            if int(col):
+                coords[:, axis] = data[:, int(col) - 1]
+        values = data[:, int(self.par.columns_set[3]) - 1]
+        valid = np.isfinite(values) & (values != self.par.nd)
+        coords, values = coords[valid], values[valid]
+
+        pos = (coords - self.first_coord) / self.cells_size
+        nodes3 = np.round(pos).astype('int')
+        inside = ((nodes3 >= 0) & (nodes3 < self.dims)).all(axis=1)
+        pos, nodes3, values = pos[inside], nodes3[inside], values[inside]
+        dist = ((pos - nodes3) ** 2).sum(axis=1)
+        nodes = self._flat(nodes3)
+        # closest data first, then keep the first one of each node
+        order = np.lexsort((dist, nodes))
+        nodes, first = np.unique(nodes[order], return_index=True)
+        return nodes, values[order][first]
+
+    def _flat(self, nodes3):
+        """Position of nodes [x, y, z] in the grid file (x cycles fastest).
+
+        """
+        return nodes3[:, 0] + self.dims[0] * (nodes3[:, 1] +
+                                              self.dims[1] * nodes3[:, 2])
+
+    def _neighbours(self, state, node3, chunk=1024):
+        """Offsets and positions of the nearest data (state 1) and simulated
+        (state 2) nodes around a node.
+
+        """
+        found = {1: list(), 2: list()}
+        wanted = {1: self.ndmax, 2: self.maxsim}
+        counts = {1: 0, 2: 0}
+        for start in xrange(0, len(self.template), chunk):
+            offsets = self.template[start:start + chunk]
+            pos = node3 + offsets
+            inside = ((pos >= 0) & (pos < self.dims)).all(axis=1)
+            offsets, pos = offsets[inside], pos[inside]
+            flat = self._flat(pos)
+            states = state[flat]
+            for kind in (1, 2):
+                if counts[kind] < wanted[kind]:
+                    sel = (states == kind).nonzero()[0]
+                    sel = sel[:wanted[kind] - counts[kind]]
+                    found[kind].append((offsets[sel], flat[sel]))
+                    counts[kind] += sel.size
+            if counts[1] >= wanted[1] and counts[2] >= wanted[2]:
+                break
+        parts = found[1] + found[2]
+        if not parts:
+            return np.zeros((0, 3), dtype='int'), np.zeros(0, dtype='int')
+        return (np.concatenate([part[0] for part in parts]),
+                np.concatenate([part[1] for part in parts]))
+
+    def _draw(self, estimate, variance, rand):
+        """Draw a value from the global distribution, around the kriging
+        estimate.
+
+        """
+        values, probs = self._cdf
+        y = kr.gauss_inv(float(np.interp(estimate, values, probs)))
+        if self.cov.sill > 0:
+            y += math.sqrt(variance / self.cov.sill) * rand.standard_normal()
+        return float(np.interp(kr.gauss_cdf(y), probs, values))
+
+    def simulate(self, seed=None):
+        """Generate one realization.
+
+        Parameters
+        ----------
+        seed : int, optional
+            Seed of the random numbers. If None, `par.seed` is used.
+
+        Returns
+        -------
+        ndarray
+            Simulated values, one for each node in the order of the grid file
+            (x cycles fastest, then y, then z).
+
+        """
+        if seed is None:
+            seed = int(self.par.seed)
+        rand = np.random.RandomState(seed)
+        ncells = int(np.prod(self.dims))
+        grid = np.empty(ncells)
+        grid.fill(self.par.nd)
+        state = np.zeros(ncells, dtype='int8')
+        grid[self.nodes] = self.data
+        state[self.nodes] = 1
+        if not self.data.size:
+            return grid
+
+        path = rand.permutation(np.flatnonzero(state == 0))
+        origin = np.zeros((1, 3))
+        for node in path:
+            node3 = np.array([node % self.dims[0],
+                              node // self.dims[0] % self.dims[1],
+                              node // (self.dims[0] * self.dims[1])])
+            offsets, near = self._neighbours(state, node3)
+            if near.size < self.ndmin:
+                estimate, variance = self.mean, self.cov.sill
+            else:
+                estimate, variance = kr.krige(self.cov,
+                                              offsets * self.cells_size,
+                                              grid[near], origin, self.ktype,
+                                              self.mean)
+            grid[node] = self._draw(estimate, variance, rand)
+            state[node] = 2
+        return grid
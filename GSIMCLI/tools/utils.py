@@ -6,8 +6,10 @@ Created on 6 de Nov de 2013
 
 @author: julio
 """
+import cPickle
 import datetime
 import os
+import tempfile
 
 
 def dms2dec(d, m, s):
@@ -123,6 +125,52 @@ def filename_indexing(file_id, n):
     return fname
 
 
+def pickle_atomic(obj, path):
+    """Pickle an object to a file, atomically: the file is either completely
+    written or left as it was, even if the process is killed meanwhile.
+
+    Parameters
+    ----------
+    obj : object
+        Object to pickle.
+    path : string
+        File path.
+
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            cPickle.dump(obj, fid, cPickle.HIGHEST_PROTOCOL)
+            fid.flush()
+            os.fsync(fid.fileno())
+        if os.name == 'nt' and os.path.exists(path):
+            # rename does not replace existing files on NT systems
+            os.remove(path)
+        os.rename(temp, path)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def unpickle(path):
+    """Load a pickled object from a file.
+
+    Parameters
+    ----------
+    path : string
+        File path.
+
+    Returns
+    -------
+    object
+
+    """
+    with open(path, 'rb') as fid:
+        return cPickle.load(fid)
+
+
 def path_up(path, nlevels):
     """Go up n levels in the path tree.
 